@@ -0,0 +1,463 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Streaming summary statistics. Lets the sweeps reduce every chunk of
+#   experiments to a handful of numbers, so the memory for a summary is O(1)
+#   in the number of experiments instead of O(nExp). StreamingHistogram
+#   does the same for the histograms that plotting.py draws.
+#
+# Future:
+#
+import numpy as np
+from error import exit_with_error
+
+### Threshold kinds understood by OnlineStats, kind -> function(x, value) ###
+_THRESHOLD_D = {"gt"     : lambda x, v : x > v,
+                "ge"     : lambda x, v : x >= v,
+                "lt"     : lambda x, v : x < v,
+                "le"     : lambda x, v : x <= v,
+                "abs_gt" : lambda x, v : np.abs(x) > v,
+                "abs_lt" : lambda x, v : np.abs(x) < v}
+
+
+
+class OnlineStats:
+    """
+    Mergeable accumulator of count, mean, variance, min, max and threshold
+    exceedance counts. E.g. for the t-scores of Section 3
+
+        acc = OnlineStats(ThresholdD={"frac>2" : ("abs_gt", 2.0)})
+        acc.update(tV)          # scalar or array
+        acc.merge(otherAcc)     # e.g. from another chunk / worker
+        acc.mean, acc.std, acc.frac("frac>2")
+
+    Batches are folded in with Chan et al.'s (1979) parallel update of the
+    mean and sum of squared deviations (m2), which reduces to Welford's
+    update for a single value.
+    """
+    def __init__(self, ThresholdD=None):
+        """
+        ARGS:
+            ThresholdD : dict, name -> (kind, value), kind is one of
+                         gt, ge, lt, le, abs_gt, abs_lt. E.g.
+                         {"p<.05" : ("lt", 0.05)}
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        ThresholdD = {} if ThresholdD is None else ThresholdD
+        for (name, (kind, value)) in ThresholdD.items():
+            if(kind not in _THRESHOLD_D):
+                exit_with_error("ERROR!!! threshold {} has unknown kind {}\n".format(
+                                name, kind))
+        self.thresholdD = dict(ThresholdD)
+        self.count = 0
+        self.mean  = 0.0
+        self.m2    = 0.0        # Sum of squared deviations from the mean
+        self.min   = np.inf
+        self.max   = -np.inf
+        self.exceedD = {name : 0 for name in self.thresholdD}
+
+
+    def update(self, X=None):
+        """
+        ARGS:
+            X : a scalar or an array of values
+        RETURN:
+            self
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        xV = np.asarray(X, dtype=np.float64).ravel()
+        n  = len(xV)
+        if(n == 0):
+            return(self)
+        mean = np.mean(xV)
+        m2   = np.sum((xV - mean)**2)
+        self._merge_moments(N=n, Mean=mean, M2=m2)
+        self.min = min(self.min, np.min(xV))
+        self.max = max(self.max, np.max(xV))
+        for (name, (kind, value)) in self.thresholdD.items():
+            self.exceedD[name] += int(np.count_nonzero(_THRESHOLD_D[kind](xV, value)))
+        return(self)
+
+
+    def merge(self, Other=None):
+        """
+        ARGS:
+            Other : OnlineStats with the same thresholds
+        RETURN:
+            self
+        DESCRIPTION:
+            Merging is done in place. The result only depends on the order of
+            the merges, not on how the values were chunked up.
+        DEBUG:
+        FUTURE:
+        """
+        if(Other.thresholdD != self.thresholdD):
+            exit_with_error("ERROR!!! can't merge OnlineStats with different thresholds\n")
+        if(Other.count == 0):
+            return(self)
+        self._merge_moments(N=Other.count, Mean=Other.mean, M2=Other.m2)
+        self.min = min(self.min, Other.min)
+        self.max = max(self.max, Other.max)
+        for name in self.exceedD:
+            self.exceedD[name] += Other.exceedD[name]
+        return(self)
+
+
+    def _merge_moments(self, N=None, Mean=None, M2=None):
+        """
+        ARGS:
+            N, Mean, M2 : count, mean and sum of squared deviations of a batch
+        RETURN:
+        DESCRIPTION:
+            Chan et al. (1979)
+        DEBUG:
+        FUTURE:
+        """
+        total = self.count + N
+        delta = Mean - self.mean
+        self.mean  = self.mean + delta * N / total
+        self.m2    = self.m2 + M2 + delta**2 * self.count * N / total
+        self.count = total
+
+
+    def var(self, Ddof=0):
+        """
+        ARGS:
+            Ddof : delta degrees of freedom, 0 matches np.var()
+        RETURN:
+            variance of the values seen so far
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(self.count - Ddof <= 0):
+            return(np.nan)
+        return(self.m2 / (self.count - Ddof))
+
+
+    def std(self, Ddof=0):
+        """
+        ARGS:
+            Ddof : delta degrees of freedom, 0 matches np.std()
+        RETURN:
+            standard deviation of the values seen so far
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        return(np.sqrt(self.var(Ddof=Ddof)))
+
+
+    def frac(self, Name=None):
+        """
+        ARGS:
+            Name : name of a threshold
+        RETURN:
+            fraction of the values seen so far that exceed the threshold
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(self.count == 0):
+            return(np.nan)
+        return(self.exceedD[Name] / self.count)
+
+
+    def copy_empty(self):
+        """
+        ARGS:
+        RETURN:
+            a new, empty OnlineStats with the same thresholds
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        return(OnlineStats(ThresholdD=self.thresholdD))
+
+
+
+class StreamingHistogram:
+    """
+    Mergeable histogram that bins values as they are produced, so the raw
+    values never have to be kept. Two kinds of bins :
+
+    1. Fixed, Edges given. Values outside them are counted in underflow /
+       overflow.
+           hist = StreamingHistogram(Edges=np.linspace(0, 1, 51))    # p-values
+    2. Auto-calibrated, Edges = None. Bin k is [k*width, (k+1)*width) with
+       width a power of 2, picked from the first batch so its range spans
+       ~NBins bins. The bins grow to cover whatever arrives, and when more
+       than MaxBins are needed width doubles (pairs of bins are summed, which
+       is exact since the edges stay aligned).
+           hist = StreamingHistogram(NBins=100)                     # t-scores
+
+    Histograms of the same kind merge exactly, in any order. Auto histograms
+    with different widths (e.g. from workers that saw different data) are
+    brought to the coarser width first.
+        hist.update(tV) ; hist.merge(otherHist) ; hist.edges(), hist.counts
+    """
+    def __init__(self, Edges=None, NBins=100, MaxBins=4096):
+        """
+        ARGS:
+            Edges   : 1D array of increasing bin edges, None = auto-calibrated
+            NBins   : int, auto : number of bins the first batch is spread over
+            MaxBins : int, auto : max number of bins kept
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        self.nBins   = NBins
+        self.maxBins = MaxBins
+        self.fixed   = Edges is not None
+        self.edgeV   = None if Edges is None else np.asarray(Edges, dtype=np.float64)
+        self.width   = None             # auto : bin width, None until calibrated
+        self.offset  = 0                # auto : index k of the first bin
+        self.counts  = (np.zeros(len(self.edgeV) - 1, dtype=np.int64) if self.fixed
+                        else np.zeros(0, dtype=np.int64))
+        self.count     = 0              # Values binned, incl. under / overflow
+        self.underflow = 0
+        self.overflow  = 0
+        self.nan       = 0              # Non finite values, not binned
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def copy_empty(self):
+        """
+        ARGS:
+        RETURN:
+            a new, empty StreamingHistogram with the same bins
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        return(StreamingHistogram(Edges=self.edgeV, NBins=self.nBins, MaxBins=self.maxBins))
+
+
+    def update(self, X=None):
+        """
+        ARGS:
+            X : a scalar or an array of values
+        RETURN:
+            self
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        xV = np.asarray(X, dtype=np.float64).ravel()
+        finite = np.isfinite(xV)
+        self.nan += int(len(xV) - np.count_nonzero(finite))
+        xV = xV[finite]
+        if(len(xV) == 0):
+            return(self)
+        self.count += len(xV)
+        self.min = min(self.min, np.min(xV))
+        self.max = max(self.max, np.max(xV))
+        if(self.fixed):
+            idxV = np.searchsorted(self.edgeV, xV, side="right") - 1
+            # The last edge is inclusive, like np.histogram()
+            idxV[xV == self.edgeV[-1]] = len(self.counts) - 1
+            under = idxV < 0
+            over  = idxV >= len(self.counts)
+            self.underflow += int(np.count_nonzero(under))
+            self.overflow  += int(np.count_nonzero(over))
+            inside = ~(under | over)
+            self.counts += np.bincount(idxV[inside], minlength=len(self.counts))
+            return(self)
+        if(self.width is None):
+            self.width = _power_of_2_width(Span=np.max(xV) - np.min(xV), NBins=self.nBins)
+        # Coarsen first, so the bins padded in by _cover() never exceed MaxBins
+        self._fit(KMin=int(np.floor(np.min(xV) / self.width)),
+                  KMax=int(np.floor(np.max(xV) / self.width)))
+        kV = np.floor(xV / self.width).astype(np.int64)
+        self._cover(KMin=int(np.min(kV)), KMax=int(np.max(kV)))
+        self.counts += np.bincount(kV - self.offset, minlength=len(self.counts))
+        return(self)
+
+
+    def _fit(self, KMin=None, KMax=None):
+        """
+        ARGS:
+            KMin, KMax : auto : bin indices (at the current width) that have to exist
+        RETURN:
+        DESCRIPTION:
+            Doubles the width until the current bins and KMin..KMax span at
+            most MaxBins bins. Bin k at width w is bin floor(k/2) at 2w, so
+            the indices are halved along.
+        DEBUG:
+        FUTURE:
+        """
+        while(True):
+            if(len(self.counts) == 0):
+                span = KMax - KMin + 1
+            else:
+                span = (max(KMax, self.offset + len(self.counts) - 1) -
+                        min(KMin, self.offset) + 1)
+            if(span <= self.maxBins):
+                return
+            self._coarsen()
+            (KMin, KMax) = (KMin // 2, KMax // 2)
+
+
+    def _cover(self, KMin=None, KMax=None):
+        """
+        ARGS:
+            KMin, KMax : auto : bin indices (at the current width) that have to exist
+        RETURN:
+        DESCRIPTION:
+            Pads counts with empty bins on either side
+        DEBUG:
+        FUTURE:
+        """
+        if(len(self.counts) == 0):
+            self.offset = KMin
+            self.counts = np.zeros(KMax - KMin + 1, dtype=np.int64)
+            return
+        end = self.offset + len(self.counts) - 1
+        nLow  = max(0, self.offset - KMin)
+        nHigh = max(0, KMax - end)
+        if(nLow > 0 or nHigh > 0):
+            self.counts = np.concatenate((np.zeros(nLow, dtype=np.int64), self.counts,
+                                          np.zeros(nHigh, dtype=np.int64)))
+            self.offset -= nLow
+
+
+    def _coarsen(self):
+        """
+        ARGS:
+        RETURN:
+        DESCRIPTION:
+            auto : doubles the width, bin k becomes bin floor(k/2)
+        DEBUG:
+        FUTURE:
+        """
+        countV = self.counts
+        if(len(countV) == 0):
+            self.offset = self.offset // 2
+            self.width  = self.width * 2
+            return
+        if(self.offset % 2 != 0):
+            countV = np.concatenate(([0], countV))
+        if(len(countV) % 2 != 0):
+            countV = np.concatenate((countV, [0]))
+        self.counts = countV.reshape(-1, 2).sum(axis=1)
+        self.offset = self.offset // 2
+        self.width  = self.width * 2
+
+
+    def merge(self, Other=None):
+        """
+        ARGS:
+            Other : StreamingHistogram of the same kind (same Edges if fixed)
+        RETURN:
+            self
+        DESCRIPTION:
+            Merging is done in place, Other is left as is
+        DEBUG:
+        FUTURE:
+        """
+        if(self.fixed != Other.fixed or
+           (self.fixed and not np.array_equal(self.edgeV, Other.edgeV))):
+            exit_with_error("ERROR!!! can't merge StreamingHistograms with different edges\n")
+        if(Other.count == 0):
+            self.nan += Other.nan
+            return(self)
+        if(not self.fixed):
+            if(self.width is None):
+                self.width = Other.width
+            other = Other
+            if(Other.width < self.width):
+                other = _coarsened_copy(Hist=Other, Width=self.width)
+            while(self.width < other.width):
+                self._coarsen()
+            # Coarsen first, so the bins padded in by _cover() never exceed MaxBins
+            self._fit(KMin=other.offset, KMax=other.offset + len(other.counts) - 1)
+            if(other.width < self.width):
+                other = _coarsened_copy(Hist=other, Width=self.width)
+            self._cover(KMin=other.offset, KMax=other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+        else:
+            self.counts += Other.counts
+        self.count     += Other.count
+        self.underflow += Other.underflow
+        self.overflow  += Other.overflow
+        self.nan       += Other.nan
+        self.min = min(self.min, Other.min)
+        self.max = max(self.max, Other.max)
+        return(self)
+
+
+    def edges(self):
+        """
+        ARGS:
+        RETURN:
+            1D array, the len(counts) + 1 bin edges
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(self.fixed):
+            return(self.edgeV)
+        if(self.width is None):
+            return(np.zeros(1))
+        return((self.offset + np.arange(len(self.counts) + 1)) * self.width)
+
+
+    def density(self):
+        """
+        ARGS:
+        RETURN:
+            counts / (bin width * number of binned values), like
+            np.histogram(density=True)
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        total = np.sum(self.counts)
+        if(total == 0):
+            return(np.zeros(len(self.counts)))
+        return(self.counts / (np.diff(self.edges()) * total))
+
+
+
+def _power_of_2_width(Span=None, NBins=None):
+    """
+    ARGS:
+        Span  : float, max - min of the first batch
+        NBins : int, number of bins wanted over Span
+    RETURN:
+        largest power of 2 <= Span / NBins (1 if Span is 0)
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    if(Span <= 0):
+        return(1.0)
+    return(float(2.0**np.floor(np.log2(Span / NBins))))
+
+
+
+def _coarsened_copy(Hist=None, Width=None):
+    """
+    ARGS:
+        Hist  : auto StreamingHistogram
+        Width : float, a power of 2 multiple of Hist.width
+    RETURN:
+        copy of Hist rebinned to Width
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    copy = Hist.copy_empty()
+    (copy.width, copy.offset, copy.counts) = (Hist.width, Hist.offset, Hist.counts.copy())
+    while(copy.width < Width):
+        copy._coarsen()
+    return(copy)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+###############################################################################
+#   Author : Ali Snedden
+#   Date   : 3/9/19
+#
+#   Purpose:
+#       Benchmark the statistical hot paths and each section of main.py.
+#       Every case reports wall time (best of --repeat), throughput and peak
+#       memory. Results are written as JSON and can be compared against a
+#       stored baseline, failing (exit code 1) when a case got slower than
+#       the regression threshold allows.
+#
+#   Notes :
+#       1. Run from the top of the repo, e.g.
+#           python src/benchmark.py --output bench.json
+#           python src/benchmark.py --baseline bench.json --threshold 0.25
+#       2. Peak memory of in-process cases is from tracemalloc (numpy
+#          registers its allocations with it), so it is the peak of python +
+#          numpy allocations made by the case. Section cases run main.py in a
+#          subprocess and report its max RSS (which includes the ~10 MB the
+#          benchmark process had mapped when it forked).
+#       3. Baselines are machine specific, only compare runs from the same node.
+#
+###############################################################################
+import os
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+from error import exit_with_error
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+
+def time_case(Function=None, Repeat=None):
+    """
+    ARGS:
+        Function : function with no arguments, one run of the case
+        Repeat   : number of timed runs
+    RETURN:
+        (best wall time in s, peak traced memory in MB)
+    DESCRIPTION:
+        Function is called once untimed to warm up (imports, caches that are
+        meant to be warm), then Repeat times. Memory is traced on a separate
+        run so tracemalloc's overhead doesn't pollute the timings.
+    DEBUG:
+    FUTURE:
+    """
+    Function()
+    timeL = []
+    for i in range(Repeat):
+        start = time.perf_counter()
+        Function()
+        timeL.append(time.perf_counter() - start)
+    tracemalloc.start()
+    Function()
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return(min(timeL), peak / 2**20)
+
+
+
+def run_subprocess(ArgL=None):
+    """
+    ARGS:
+        ArgL : command line for main.py, without the interpreter
+    RETURN:
+        (wall time in s, max RSS of the child in MB)
+    DESCRIPTION:
+        Uses os.wait4() to get the rusage of just this child
+    DEBUG:
+    FUTURE:
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable] + ArgL, stdout=subprocess.DEVNULL,
+                            cwd=SRC_DIR)
+    (pid, status, rusage) = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if(proc.returncode != 0):
+        exit_with_error("ERROR!!! {} exited with {}\n".format(" ".join(ArgL),
+                        proc.returncode))
+    # ru_maxrss is in kB on Linux, bytes on OSX
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return(wall, rusage.ru_maxrss / scale)
+
+
+
+def build_cases(Quick=False):
+    """
+    ARGS:
+        Quick : bool, smaller problem sizes for a fast smoke run
+    RETURN:
+        list of (name, function, n items per run, unit, in process)
+    DESCRIPTION:
+        Heavy imports happen here, so 'benchmark.py -h' stays fast
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    import functions
+    from population import make_rng
+    from population import build_population
+
+    scale = 10 if Quick else 1
+    caseL = []
+
+    ### p-values, cold = the tail table is rebuilt every call ###
+    nT  = 100000 // scale
+    tV  = np.linspace(-6, 6, nT)
+    for df in [2, 10, 100]:
+        def pvalue_cold(DF=df):
+            functions.tail_table_cache_clear()
+            functions.convert_tscore_to_pvalue(T=1.5, DF=DF)
+        def pvalue_warm(DF=df):
+            functions.convert_tscore_to_pvalue(T=tV, DF=DF)
+        caseL.append(("pvalue_cold_df{}".format(df), pvalue_cold, 1, "calls", True))
+        caseL.append(("pvalue_warm_df{}".format(df), pvalue_warm, nT, "p-values", True))
+    welchDFV = make_rng(Seed=0).uniform(2, 78, nT)
+    def pvalue_welch():
+        functions.convert_tscore_to_pvalue(T=tV, DF=welchDFV)
+    caseL.append(("pvalue_welch_df", pvalue_welch, nT, "p-values", True))
+    ### p-values, exact incomplete beta method ###
+    for df in [2, 100]:
+        caseL.append(("pvalue_beta_df{}".format(df), lambda DF=df :
+                      functions.convert_tscore_to_pvalue(T=tV, DF=DF, Method="beta"),
+                      nT, "p-values", True))
+    caseL.append(("pvalue_beta_welch_df", lambda : functions.convert_tscore_to_pvalue(
+                  T=tV, DF=welchDFV, Method="beta"), nT, "p-values", True))
+
+    ### Grid builders and the integrator ###
+    for df in [3, 30]:
+        caseL.append(("t_dist_df{}".format(df), lambda DF=df : functions.t_dist(DF=DF),
+                      1, "grids", True))
+    edgeV = np.arange(-10, 10, 0.01)
+    caseL.append(("integrate", lambda : functions.integrate(
+                  Function=functions.t_dist_pdf_at_x, DF=5, Xmin=edgeV, Xmax=edgeV+0.01),
+                  len(edgeV), "bins", True))
+
+    ### t-tests ###
+    nExp = 100000 // scale
+    rng  = make_rng(Seed=1)
+    for nSamp in [3, 10, 40]:
+        samp1M = rng.standard_normal((nExp, nSamp))
+        samp2M = rng.standard_normal((nExp, nSamp))
+        caseL.append(("student_t_test_n{}".format(nSamp),
+                      lambda A=samp1M, B=samp2M : functions.student_t_test_batch(A, B),
+                      nExp, "experiments", True))
+        caseL.append(("welchs_t_test_n{}".format(nSamp),
+                      lambda A=samp1M, B=samp2M : functions.welchs_t_test_batch(A, B),
+                      nExp, "experiments", True))
+    caseL.append(("student_t_test_scalar", lambda : functions.student_t_test(
+                  samp1M[0], samp2M[0]), 1, "experiments", True))
+
+    ### Cumulative and leave one out meta-analysis, fixed effect part ###
+    import meta
+    nStudy = 10**6 // scale
+    esV  = rng.normal(0.3, 0.2, nStudy)
+    varV = rng.uniform(0.01, 0.3, nStudy)
+    caseL.append(("meta_cumulative", lambda : meta.cumulative_meta(EsV=esV, VarV=varV),
+                  nStudy, "studies", True))
+    caseL.append(("meta_leave_one_out", lambda : meta.leave_one_out_meta(EsV=esV, VarV=varV),
+                  nStudy, "studies", True))
+
+    ### Two stage bootstrap of the pooled effect, Section 4's default studies ###
+    from bootstrap import pooled_bootstrap_chunk
+    n1V = np.array([13, 31, 35, 12, 24, 177])
+    n2V = np.array([12, 12, 24, 22, 21, 117])
+    samp1V = rng.standard_normal(np.sum(n1V))
+    samp2V = rng.standard_normal(np.sum(n2V))
+    nRep = 10000 // scale
+    caseL.append(("bootstrap_pooled", lambda : pooled_bootstrap_chunk(Samp1V=samp1V,
+                  Samp2V=samp2V, N1V=n1V, N2V=n2V, NRep=nRep, Rng=make_rng(Seed=3)),
+                  nRep, "replicates", True))
+
+    ### Permutation tests, exact (nSamp = 5, 252 relabelings) and Monte Carlo ###
+    from permutation import permutation_test_batch
+    nPermExp = 10000 // scale
+    for (nSamp, nPerm) in [(5, 1000), (10, 1000)]:
+        samp1M = rng.standard_normal((nPermExp, nSamp))
+        samp2M = rng.standard_normal((nPermExp, nSamp))
+        caseL.append(("permutation_nsamp{}".format(nSamp),
+                      lambda S1=samp1M, S2=samp2M, P=nPerm : permutation_test_batch(Samp1M=S1,
+                      Samp2M=S2, NPerm=P, Rng=make_rng(Seed=4)), nPermExp, "experiments", True))
+
+    ### Multiple testing corrections, in memory and external sort (small chunks) ###
+    from multitest import adjust_pvalues, adjust_pvalues_chunked
+    nP = 10**6 // scale
+    pV = rng.uniform(size=nP)
+    caseL.append(("multitest_bh", lambda : adjust_pvalues(PV=pV, Method="bh"), nP, "p-values",
+                  True))
+    caseL.append(("multitest_bh_chunked", lambda : adjust_pvalues_chunked(
+                  ChunkIter=lambda : iter(np.array_split(pV, 8)), Method="bh",
+                  ChunkSize=nP // 8 + 1), nP, "p-values", True))
+
+    ### Effect sizes from reported statistics, half from means / SDs and half from p-values ###
+    from effectsize import convert_studies
+    nStudy = 10**5 // scale
+    studyD = {"n1" : rng.integers(5, 60, nStudy).astype(float),
+              "n2" : rng.integers(5, 60, nStudy).astype(float),
+              "mean1" : rng.normal(0.3, 0.2, nStudy), "mean2" : rng.normal(0, 0.2, nStudy),
+              "sd1" : rng.uniform(0.8, 1.2, nStudy), "sd2" : rng.uniform(0.8, 1.2, nStudy)}
+    studyD["p"] = rng.uniform(size=nStudy)
+    studyD["mean1"][::2] = np.nan
+    caseL.append(("effect_size_convert", lambda : convert_studies(ColumnD=studyD), nStudy,
+                  "studies", True))
+
+    ### Population generation ###
+    nPop = 10**7 // scale
+    for dtype in [np.float64, np.float32]:
+        caseL.append(("population_{}".format(np.dtype(dtype).name),
+                      lambda D=dtype : build_population(Rng=make_rng(Seed=2), Mu=0, Sd=1,
+                                                        N=nPop, Dtype=D),
+                      nPop, "deviates", True))
+
+    return(caseL)
+
+
+
+def build_section_cases(Quick=False):
+    """
+    ARGS:
+        Quick : bool, smaller problem sizes for a fast smoke run
+    RETURN:
+        list of (name, main.py arguments, n items per run, unit, in process)
+    DESCRIPTION:
+        main.py sections, end to end in a subprocess. These run before
+        build_cases() imports numpy : a child's max RSS includes what the
+        parent had mapped when it forked, so the parent has to be small.
+    DEBUG:
+    FUTURE:
+    """
+    scale = 10 if Quick else 1
+    popArgL = ["0", "1", "0", "1"]
+    sectionD = {"help"         : (["-h"], 1),
+                "stderr"       : (["stderr"] + popArgL + ["--stderr-nexp",
+                                  str(100000 // scale)], 100000 // scale),
+                "tscore"       : (["tscore"] + popArgL, 1),
+                "pvalue-sweep" : (["pvalue-sweep"] + popArgL + ["--sweep-nexp",
+                                  str(10000 // scale)], 7 * 10000 // scale),
+                "meta"         : (["meta"] + popArgL, 1),
+                "power"        : (["power"] + popArgL + ["--power-es", "0.5", "--power-nsamp",
+                                  "10", "40"], 1)}
+    caseL = []
+    for (section, (argL, nItem)) in sectionD.items():
+        caseL.append(("main_{}".format(section), ["main.py"] + argL, nItem, "experiments",
+                      False))
+    return(caseL)
+
+
+
+def run_cases(CaseL=None, Repeat=None, Filter=None):
+    """
+    ARGS:
+        CaseL  : from build_cases()
+        Repeat : number of timed runs per case
+        Filter : regex, only cases whose name matches are run
+    RETURN:
+        dict, case name -> dict of results
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    resultD = {}
+    for (name, function, nItem, unit, inProcess) in CaseL:
+        if(Filter is not None and re.search(Filter, name) is None):
+            continue
+        if(inProcess):
+            (wall, peakMB) = time_case(Function=function, Repeat=Repeat)
+        else:
+            runL = [run_subprocess(ArgL=function) for i in range(Repeat)]
+            wall   = min(run[0] for run in runL)
+            peakMB = max(run[1] for run in runL)
+        resultD[name] = {"time_s"      : wall,
+                         "throughput"  : nItem / wall,
+                         "unit"        : "{}/s".format(unit),
+                         "peak_mem_mb" : peakMB,
+                         "in_process"  : inProcess}
+        sys.stdout.write("{:<28}{:<14.6f}{:<14.4g}{:<16}{:<10.1f}\n".format(name, wall,
+                         nItem / wall, "{}/s".format(unit), peakMB))
+        sys.stdout.flush()
+    return(resultD)
+
+
+
+def compare(ResultD=None, BaselineD=None, Threshold=None):
+    """
+    ARGS:
+        ResultD   : this run, from run_cases()
+        BaselineD : a previous run, from run_cases()
+        Threshold : float, allowed fractional slowdown, e.g. 0.25 = 25%
+    RETURN:
+        list of (name, baseline time, time, ratio) of the regressed cases
+    DESCRIPTION:
+        Cases missing from either run are skipped
+    DEBUG:
+    FUTURE:
+    """
+    regressL = []
+    print("\n{:<28}{:<14}{:<14}{:<10}".format("case", "baseline_s", "time_s", "ratio"))
+    for name in sorted(set(ResultD) & set(BaselineD)):
+        base  = BaselineD[name]["time_s"]
+        now   = ResultD[name]["time_s"]
+        ratio = now / base
+        flag  = "  REGRESSION" if ratio > 1 + Threshold else ""
+        print("{:<28}{:<14.6f}{:<14.6f}{:<10.3f}{}".format(name, base, now, ratio, flag))
+        if(flag):
+            regressL.append((name, base, now, ratio))
+    return(regressL)
+
+
+
+def main():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    parser = argparse.ArgumentParser(prog="./src/benchmark.py",
+        description="Benchmark the statistical hot paths and the sections of main.py")
+    parser.add_argument("--output", type=str, default=None,
+                        help="write the results as JSON to this file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="JSON file of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail if a case is more than this fraction slower than the "
+                             "baseline (default: 0.25)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per case, the best is kept (default: 3)")
+    parser.add_argument("--filter", type=str, default=None,
+                        help="regex, only run the cases whose name matches")
+    parser.add_argument("--quick", action="store_true",
+                        help="10x smaller problem sizes")
+    args = parser.parse_args()
+
+    print("{:<28}{:<14}{:<14}{:<16}{:<10}".format("case", "time_s", "throughput", "unit",
+          "peak_MB"))
+    resultD = run_cases(CaseL=build_section_cases(Quick=args.quick), Repeat=args.repeat,
+                        Filter=args.filter)
+    resultD.update(run_cases(CaseL=build_cases(Quick=args.quick), Repeat=args.repeat,
+                             Filter=args.filter))
+    import numpy as np
+    outD = {"meta"    : {"python"   : platform.python_version(),
+                         "numpy"    : np.__version__,
+                         "machine"  : platform.machine(),
+                         "node"     : platform.node(),
+                         "cpus"     : os.cpu_count(),
+                         "quick"    : args.quick,
+                         "repeat"   : args.repeat,
+                         "date"     : time.strftime("%Y-%m-%d %H:%M:%S")},
+            "results" : resultD}
+    if(args.output is not None):
+        with open(args.output, "w") as f:
+            json.dump(outD, f, indent=1)
+    if(args.baseline is not None):
+        with open(args.baseline, "r") as f:
+            baseD = json.load(f)
+        if(baseD["meta"].get("quick") != args.quick):
+            sys.stderr.write("WARNING!!! baseline quick = {}, this run quick = {}\n".format(
+                             baseD["meta"].get("quick"), args.quick))
+        regressL = compare(ResultD=resultD, BaselineD=baseD["results"],
+                           Threshold=args.threshold)
+        if(len(regressL) > 0):
+            exit_with_error("ERROR!!! {} case(s) regressed by more than {:.0f}% : {}\n".format(
+                            len(regressL), 100*args.threshold,
+                            ", ".join(regress[0] for regress in regressL)))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Resampling engines. Draw many experiments from a population at once as
+#   blocks of indices and reduce them along an axis, instead of looping over
+#   experiments in python.
+#
+# Future:
+#
+import sys
+from math import erf
+from math import sqrt
+import numpy as np
+from accumulator import OnlineStats
+from error import exit_with_error
+from meta import group_mean_std
+from meta import cohens_d
+from meta import effect_size_variance
+from meta import fixed_effect
+from meta import random_effects
+
+BOOT_CHUNK_SIZE = 2**15         # Default number of experiments per chunk
+BOOT_MAX_DRAWS  = 2**22         # Max observations drawn at once by pooled_bootstrap_chunk()
+BOOT_RESAMPLE_L = ["both", "studies", "observations"]
+BOOT_CI_L       = ["percentile", "bca"]
+
+
+
+def sampling_distribution(PopV=None, NSamp=None, NExp=None, Rng=None,
+                          ChunkSize=BOOT_CHUNK_SIZE):
+    """
+    ARGS:
+        PopV      : 1D array, the population to draw from (with replacement)
+        NSamp     : int, number of samples per experiment
+        NExp      : int, number of experiments
+        Rng       : numpy.random.Generator, see population.make_rng()
+        ChunkSize : int, max number of experiments drawn at once
+    RETURN:
+        meanSampDist : mean of the experiment means
+        stdSampDist  : stdev of the experiment means (the sampling distribution)
+        std0         : stdev of the first experiment divided by sqrt(NSamp)
+        meanStd      : mean of the experiments' stdevs divided by sqrt(NSamp-1)
+    DESCRIPTION:
+        Used by Section 1 of main.py. Each chunk draws an index block of shape
+        (chunk, NSamp) and reduces the means and stdevs along axis 1, see
+        sampling_distribution_chunk(). Each chunk is reduced to OnlineStats
+        accumulators which are merged with merge_sampling_chunks(), so memory
+        is bounded by ChunkSize no matter how large NExp is.
+    DEBUG:
+        1. Same columns as the old per-experiment loop in main.py. With
+           ChunkSize >= NExp the means / stds are computed from the same draws
+           and match the old np.mean() / np.std() of the lists to ~1e-15.
+    FUTURE:
+    """
+    chunkL = []
+    for start in range(0, NExp, ChunkSize):
+        nChunk = min(ChunkSize, NExp - start)
+        chunkL.append(sampling_distribution_chunk(PopV=PopV, NSamp=NSamp,
+                      NChunk=nChunk, Rng=Rng))
+    return(merge_sampling_chunks(ChunkL=chunkL, NSamp=NSamp))
+
+
+
+def sampling_distribution_chunk(PopV=None, NSamp=None, NChunk=None, Rng=None,
+                                Hist=None):
+    """
+    ARGS:
+        PopV   : 1D array, the population to draw from (with replacement)
+        NSamp  : int, number of samples per experiment
+        NChunk : int, number of experiments in this chunk
+        Rng    : numpy.random.Generator
+        Hist   : optional accumulator.StreamingHistogram, the experiment means
+                 are added to it
+    RETURN:
+        meanAcc : accumulator.OnlineStats of the experiment means
+        stdAcc  : accumulator.OnlineStats of the experiment stdevs
+        std0    : stdev of the chunk's first experiment
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    N = len(PopV)
+    sampM  = PopV[Rng.integers(low=0, high=N, size=(NChunk, NSamp))]
+    meanV  = np.mean(sampM, axis=1, dtype=np.float64)
+    meanAcc = OnlineStats().update(meanV)
+    if(Hist is not None):
+        Hist.update(meanV)
+    stdAcc  = OnlineStats().update(np.std(sampM, axis=1, dtype=np.float64))
+    return(meanAcc, stdAcc, np.std(sampM[0], dtype=np.float64))
+
+
+
+def merge_sampling_chunks(ChunkL=None, NSamp=None):
+    """
+    ARGS:
+        ChunkL : list of sampling_distribution_chunk() outputs, in order.
+                 Anything after std0 in a chunk's tuple is ignored
+        NSamp  : int, number of samples per experiment
+    RETURN:
+        Same as sampling_distribution()
+    DESCRIPTION:
+        Merges the chunks' accumulators in order. std0 comes from the first 
+        chunk.
+    DEBUG:
+    FUTURE:
+    """
+    meanAcc = OnlineStats()
+    stdAcc  = OnlineStats()
+    for chunk in ChunkL:
+        meanAcc.merge(chunk[0])
+        stdAcc.merge(chunk[1])
+    std0 = ChunkL[0][2] / np.sqrt(NSamp)
+    return(meanAcc.mean, meanAcc.std(), std0, stdAcc.mean / np.sqrt(NSamp - 1))
+
+
+
+def pooled_bootstrap_chunk(Samp1V=None, Samp2V=None, N1V=None, N2V=None, NRep=None,
+                           Rng=None, Resample="both"):
+    """
+    ARGS:
+        Samp1V : 1D array, treatment samples of every study one after another
+        Samp2V : 1D array, control samples of every study one after another
+        N1V    : 1D int array, number of treatment samples in each study
+        N2V    : 1D int array, number of control samples in each study
+        NRep   : int, number of bootstrap replicates in this chunk
+        Rng    : numpy.random.Generator
+        Resample : "both"         : resample the studies, then the 
+                                    observations within each drawn study
+                   "studies"      : only resample the studies
+                   "observations" : only resample within the studies
+    RETURN:
+        dict, "fixed" / "random" -> 1D array (NRep,) of the pooled effect
+        size of each replicate, see meta.fixed_effect() / random_effects()
+    DESCRIPTION:
+        Two stage bootstrap done as index matrices, no python loop over
+        replicates. The studies of all replicates are drawn as a (NRep, k)
+        block. The observations are ragged (each drawn study keeps its own
+        N), so their indices are drawn flat, one per observation, as
+            offset of the study + floor(U * N of the study)
+        and reduced per (replicate, study) with meta.group_mean_std(). Each
+        replicate is then a meta-analysis along the last axis of (NRep, k)
+        arrays, using the same Cohen's d (eqs 3.20 / 3.21 in Lipsey & Wilson)
+        and variance as Section 4.
+    DEBUG:
+    FUTURE:
+    """
+    if(Resample not in BOOT_RESAMPLE_L):
+        exit_with_error("ERROR!!! Resample {} not in {}\n".format(Resample, BOOT_RESAMPLE_L))
+    N1V = np.asarray(N1V)
+    N2V = np.asarray(N2V)
+    k   = len(N1V)
+    if(Resample == "observations"):
+        studyM = np.broadcast_to(np.arange(k), (NRep, k))
+    else:
+        studyM = Rng.integers(low=0, high=k, size=(NRep, k))
+    n1M = N1V[studyM]
+    n2M = N2V[studyM]
+    if(Resample == "studies"):
+        (mean1V, sd1V) = group_mean_std(SampV=Samp1V, NV=N1V)
+        (mean2V, sd2V) = group_mean_std(SampV=Samp2V, NV=N2V)
+        (mean1M, sd1M, mean2M, sd2M) = (mean1V[studyM], sd1V[studyM], mean2V[studyM],
+                                        sd2V[studyM])
+    else:
+        (mean1M, sd1M) = _resample_groups(SampV=Samp1V, NV=N1V, StudyM=studyM, Rng=Rng)
+        (mean2M, sd2M) = _resample_groups(SampV=Samp2V, NV=N2V, StudyM=studyM, Rng=Rng)
+    (esM, varM) = cohens_d(Mean1=mean1M, Mean2=mean2M, N1=n1M, N2=n2M, Sd1=sd1M, Sd2=sd2M)
+    varEsM = effect_size_variance(Es=esM, N1=n1M, N2=n2M)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        random = random_effects(EsV=esM, VarV=varEsM)
+    fixed = fixed_effect(EsV=esM, VarV=varEsM)
+    return({"fixed" : np.atleast_1d(fixed["es"]), "random" : np.atleast_1d(random["es"])})
+
+
+
+def _resample_groups(SampV=None, NV=None, StudyM=None, Rng=None):
+    """
+    ARGS:
+        SampV  : 1D array, the samples of every study one after another
+        NV     : 1D int array, number of samples in each study
+        StudyM : int array, the study drawn in each (replicate, slot)
+        Rng    : numpy.random.Generator
+    RETURN:
+        meanM, sdM : mean and stdev (ddof=0) of a resample, with replacement,
+                     of each drawn study's samples. Same shape as StudyM
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    offsetV = np.concatenate(([0], np.cumsum(NV)[:-1]))
+    countV  = NV[StudyM].ravel()
+    countRepV = np.repeat(countV, countV)
+    idxV = np.repeat(offsetV[StudyM].ravel(), countV)
+    idxV += (Rng.random(len(idxV)) * countRepV).astype(idxV.dtype)
+    (meanV, sdV) = group_mean_std(SampV=SampV[idxV], NV=countV)
+    return(meanV.reshape(StudyM.shape), sdV.reshape(StudyM.shape))
+
+
+
+def bootstrap_ci(BootV=None, Estimate=None, Level=0.95, Method="percentile",
+                 JackknifeV=None):
+    """
+    ARGS:
+        BootV      : 1D array, the statistic of each bootstrap replicate
+        Estimate   : float, the statistic of the original data
+        Level      : float, confidence level
+        Method     : "percentile" or "bca"
+        JackknifeV : 1D array, leave-one-out values of the statistic, needed
+                     by "bca" for the acceleration
+    RETURN:
+        (lower, upper)
+    DESCRIPTION:
+        Percentile : the (1-Level)/2 and (1+Level)/2 quantiles of BootV.
+        BCa (Efron 1987) shifts those quantiles to correct for the bias
+            z0 = Phi^-1( fraction of BootV < Estimate )
+        and for the skewness, with the acceleration from the jackknife
+            a  = sum(d**3) / (6 sum(d**2)**1.5),  d = mean(JackknifeV) - JackknifeV
+        alpha' = Phi( z0 + (z0 + z_alpha) / (1 - a (z0 + z_alpha)) )
+        Unlike Estimate +/- Z*se neither is symmetric about Estimate.
+        Non-finite replicates (e.g. a resampled study with zero variance)
+        are dropped. If none are left the bounds are nan. If every replicate
+        is on one side of Estimate (tiny k, degenerate resamples) z0 is
+        infinite and BCa falls back to the percentile interval. Both warn on
+        stderr.
+    DEBUG:
+    FUTURE:
+    """
+    BootV = np.asarray(BootV, dtype=np.float64)
+    BootV = BootV[np.isfinite(BootV)]
+    alphaL = [(1.0 - Level) / 2.0, (1.0 + Level) / 2.0]
+    if(Method not in BOOT_CI_L):
+        exit_with_error("ERROR!!! Method {} not in {}\n".format(Method, BOOT_CI_L))
+    if(Method == "bca" and JackknifeV is None):
+        exit_with_error("ERROR!!! Method bca needs JackknifeV\n")
+    if(len(BootV) == 0):
+        sys.stderr.write("WARNING!!! no finite bootstrap replicates, the {} CI is nan\n".format(
+                         Method))
+        return(np.nan, np.nan)
+    if(Method == "bca"):
+        z0 = normal_quantile(P=np.mean(BootV < Estimate))
+    if(Method == "bca" and not np.isfinite(z0)):
+        sys.stderr.write("WARNING!!! every bootstrap replicate is on one side of the "
+                         "estimate, BCa falls back to the percentile CI\n")
+    elif(Method == "bca"):
+        dV = np.mean(JackknifeV) - np.asarray(JackknifeV, dtype=np.float64)
+        denom = 6.0 * np.sum(dV**2)**1.5
+        accel = np.sum(dV**3) / denom if denom > 0 else 0.0
+        zL = [normal_quantile(P=alpha) for alpha in alphaL]
+        alphaL = [normal_cdf(X=z0 + (z0 + z) / (1.0 - accel * (z0 + z))) for z in zL]
+    (lower, upper) = np.quantile(BootV, alphaL)
+    return(lower, upper)
+
+
+
+def normal_cdf(X=None):
+    """
+    ARGS:
+        X : float
+    RETURN:
+        Phi(X), the standard normal CDF
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return(0.5 * (1.0 + erf(X / sqrt(2.0))))
+
+
+
+def normal_quantile(P=None, Tol=1e-12):
+    """
+    ARGS:
+        P   : float in [0,1]
+        Tol : float, tolerance on the quantile
+    RETURN:
+        Phi^-1(P), +/- inf at P = 1 / 0
+    DESCRIPTION:
+        Bisection on normal_cdf(), only ever called for a few scalars
+    DEBUG:
+        1. normal_quantile(0.975) = 1.959963984540
+    FUTURE:
+    """
+    if(P <= 0):
+        return(-np.inf)
+    if(P >= 1):
+        return(np.inf)
+    (lo, hi) = (-40.0, 40.0)
+    while(hi - lo > Tol):
+        mid = (lo + hi) / 2.0
+        if(normal_cdf(X=mid) < P):
+            lo = mid
+        else:
+            hi = mid
+    return((lo + hi) / 2.0)
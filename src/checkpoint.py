@@ -0,0 +1,120 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Checkpoint / resume for the Monte Carlo sweeps (main.py --checkpoint FILE,
+#   --resume). A sweep is a list of tasks, each drawing from its own
+#   numpy.random.SeedSequence (see scheduler.spawn_seeds()), so the state
+#   needed to pick up where a run stopped is just the results of the tasks
+#   that completed : the remaining tasks rebuild their Generators from their
+#   seeds and draw exactly what they would have drawn. No Generator state is
+#   carried between tasks, so none has to be saved.
+#
+#   The completed tasks' results (the per chunk accumulators, not the raw
+#   draws) are pickled to FILE, atomically (see popstore._atomic_write()),
+#   at most once every Interval seconds plus once at the end of each sweep.
+#   A run killed at any point loses at most Interval seconds of work.
+#
+# Future:
+#
+import os
+import time
+import pickle
+from error import exit_with_error
+from popstore import _atomic_write
+
+CHECKPOINT_VERSION = 1
+
+
+
+class Checkpoint:
+    """
+    Completed task results of the sweeps of one run, e.g.
+
+        ckpt = Checkpoint(Path="run.ckpt", Interval=60, ConfigD=vars(args), Resume=True)
+        doneD = ckpt.done(Key="ttest_sweep")          # task index -> result
+        ... run the other tasks, ckpt.record(Key=..., Idx=..., Result=...) each
+        ckpt.save()
+
+    ConfigD identifies the run, resuming with a different one is an error,
+    since the saved results would not be the ones the new run computes.
+    """
+    def __init__(self, Path=None, Interval=60.0, ConfigD=None, Resume=False):
+        """
+        ARGS:
+            Path     : checkpoint file
+            Interval : float, min seconds between two saves from record()
+            ConfigD  : dict of everything the results depend on
+            Resume   : bool, load Path if it exists. Otherwise start empty
+                       (Path is overwritten on the first save)
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        self.path     = os.path.abspath(Path)
+        self.interval = Interval
+        self.lastSave = time.perf_counter()
+        self.saves    = 0
+        self.stateD   = {"version" : CHECKPOINT_VERSION, "config" : ConfigD, "tasks" : {}}
+        if(not Resume or not os.path.exists(Path)):
+            return
+        try:
+            with open(Path, "rb") as f:
+                stateD = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, OSError, AttributeError) as err:
+            exit_with_error("ERROR!!! can't read checkpoint {} : {}\n".format(Path, err))
+        if(stateD.get("version") != CHECKPOINT_VERSION):
+            exit_with_error("ERROR!!! checkpoint {} has version {}, expected {}\n".format(Path,
+                            stateD.get("version"), CHECKPOINT_VERSION))
+        if(stateD["config"] != ConfigD):
+            diffL = sorted(key for key in set(ConfigD) | set(stateD["config"])
+                           if ConfigD.get(key) != stateD["config"].get(key))
+            exit_with_error("ERROR!!! checkpoint {} is from a run with other options : "
+                            "{}\n".format(Path, ", ".join(diffL)))
+        self.stateD = stateD
+
+
+    def done(self, Key=None):
+        """
+        ARGS:
+            Key : name of the sweep
+        RETURN:
+            dict, task index -> result, of the sweep's completed tasks
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        return(dict(self.stateD["tasks"].get(Key, {})))
+
+
+    def record(self, Key=None, Idx=None, Result=None):
+        """
+        ARGS:
+            Key    : name of the sweep
+            Idx    : index of the task in the sweep
+            Result : the task's result, picklable
+        RETURN:
+        DESCRIPTION:
+            Saves if the last save is more than Interval seconds ago
+        DEBUG:
+        FUTURE:
+        """
+        self.stateD["tasks"].setdefault(Key, {})[Idx] = Result
+        if(time.perf_counter() - self.lastSave >= self.interval):
+            self.save()
+
+
+    def save(self):
+        """
+        ARGS:
+        RETURN:
+        DESCRIPTION:
+            Writes the checkpoint, replacing the previous one atomically
+        DEBUG:
+        FUTURE:
+        """
+        data = pickle.dumps(self.stateD, protocol=pickle.HIGHEST_PROTOCOL)
+        _atomic_write(Path=self.path, WriteFunction=lambda f : f.write(data))
+        self.lastSave = time.perf_counter()
+        self.saves += 1
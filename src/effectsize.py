@@ -0,0 +1,343 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Standardized mean differences from the summary statistics studies report,
+#   for pooling tables of published studies with meta.py. Follows Ch. 3 of
+#   Practical Meta-Analysis by Lipsey and Wilson (see
+#   notes/practical_meta_analysis.md), from most to least exact :
+#       1. means      : mean1, mean2, sd1, sd2, n1, n2. Same pooled SD as
+#                       Section 4, meta.cohens_d()
+#       2. t          : t, n1, n2.  d = t sqrt((n1 + n2) / (n1 n2))
+#       3. p          : p (two sided), n1, n2 and optionally sign (+1 / -1,
+#                       default +1). p -> |t| with DF = n1 + n2 - 2, then 2.
+#       4. counts     : events1, events2, n1, n2 -> log odds ratio, 0.5 added
+#                       to every cell of a 2x2 table with a 0 in it
+#       5. odds_ratio : or, n1, n2
+#   Odds ratios are converted with Hasselblad & Hedges' logit method,
+#       d = ln(OR) sqrt(3) / pi,   var(d) = 3 / pi**2 var(ln(OR))
+#   Each row uses the first one its columns allow.
+#
+#   Hedges' small sample correction (eq:esp_sm),
+#       g = (1 - 3 / (4N - 9)) d,   N = n1 + n2
+#   and the sampling variances are from meta.effect_size_variance()
+#   (eq:se_sm), except for counts where var(ln(OR)) is known.
+#
+#   Every conversion is vectorized over the rows. The table is a CSV with a
+#   header, read ChunkRows lines at a time with numpy's C parser, so a table
+#   of any length is converted without a python loop over rows :
+#       python src/effectsize.py STUDIES.csv [OUT.csv]
+#   Other columns (study names, years ...) are ignored, empty or NA fields
+#   are missing.
+#
+# Future:
+#   1. Fields with quoted newlines aren't supported, rows are split on lines
+#
+import sys
+import csv
+import itertools
+import numpy as np
+from math import pi
+from error import exit_with_error
+from functions import tscore_from_pvalue
+from meta import cohens_d
+from meta import effect_size_variance
+from meta import fixed_effect
+from meta import random_effects
+
+ES_SOURCE_L    = ["means", "t", "p", "counts", "odds_ratio"]    # In order of preference
+ES_COLUMN_L    = ["mean1", "mean2", "sd1", "sd2", "n1", "n2", "t", "p", "sign", "events1",
+                  "events2", "or"]
+ES_MISSING_L   = ["", "na", "nan", "null", "."]
+ES_CHUNK_ROWS  = 2**16          # Table rows parsed at a time
+ES_OUT_COLUMN_L= ["d", "var_d", "g", "var_g", "source"]
+
+
+
+def hedges_correction(N=None):
+    """
+    ARGS:
+        N : total sample size, n1 + n2
+    RETURN:
+        J = 1 - 3 / (4N - 9), g = J d  (eq:esp_sm)
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return(1.0 - 3.0 / (4.0 * N - 9.0))
+
+
+
+def d_from_tscore(T=None, N1=None, N2=None):
+    """
+    ARGS:
+        T      : two sample (pooled variance) t-score
+        N1, N2 : sample sizes of the treatment and control groups
+    RETURN:
+        d = T sqrt((N1 + N2) / (N1 N2))
+    DESCRIPTION:
+        t = (mean1 - mean2) / (sp sqrt(1/N1 + 1/N2)), so this is exactly the
+        d of cohens_d() for the same samples
+    DEBUG:
+    FUTURE:
+    """
+    return(T * np.sqrt((N1 + N2) / (N1 * N2)))
+
+
+
+def d_from_pvalue(P=None, N1=None, N2=None, Sign=1.0):
+    """
+    ARGS:
+        P      : two sided p-value of a two sample t-test
+        N1, N2 : sample sizes of the treatment and control groups
+        Sign   : +1 / -1, direction of the effect, which P doesn't carry
+    RETURN:
+        d of the t-score with two sided p-value P and DF = N1 + N2 - 2
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    tV = tscore_from_pvalue(P=P, DF=N1 + N2 - 2)
+    return(np.sign(Sign) * d_from_tscore(T=tV, N1=N1, N2=N2))
+
+
+
+def log_odds_ratio(Events1=None, N1=None, Events2=None, N2=None):
+    """
+    ARGS:
+        Events1, N1 : events and sample size of the treatment group
+        Events2, N2 : events and sample size of the control group
+    RETURN:
+        lnOr  : ln(OR) = ln( (a d) / (b c) )
+        varLn : its sampling variance, 1/a + 1/b + 1/c + 1/d
+        with a, b = events, non events of the treatment group and c, d those
+        of the control group
+    DESCRIPTION:
+        0.5 is added to all four cells of a table with an empty cell
+    DEBUG:
+    FUTURE:
+    """
+    cellM = np.stack(np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in
+                     (Events1, N1 - Events1, Events2, N2 - Events2)]))
+    cellM = cellM + 0.5 * np.any(cellM == 0, axis=0)
+    lnOr  = np.log(cellM[0] * cellM[3] / (cellM[1] * cellM[2]))
+    varLn = np.sum(1.0 / cellM, axis=0)
+    return(lnOr, varLn)
+
+
+
+def d_from_log_odds_ratio(LnOr=None):
+    """
+    ARGS:
+        LnOr : ln(odds ratio)
+    RETURN:
+        d = ln(OR) sqrt(3) / pi, Hasselblad & Hedges' logit method. Its
+        variance is 3 / pi**2 var(ln(OR))
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return(LnOr * np.sqrt(3.0) / pi)
+
+
+
+def convert_studies(ColumnD=None):
+    """
+    ARGS:
+        ColumnD : dict, column name (see ES_COLUMN_L) -> float array, one entry
+                  per study, nan = not reported. Missing columns are all nan
+    RETURN:
+        dict of arrays, one entry per study :
+            d, var_d : Cohen's d and its sampling variance
+            g, var_g : Hedges' g and its sampling variance
+            source   : int, index in ES_SOURCE_L of the statistics used, -1
+                       (and nan effect sizes) if there weren't enough
+        ValueError if the ES_COLUMN_L columns aren't 1D and of the same length
+    DESCRIPTION:
+        Every source is computed for every row, then each row takes the first
+        one that isn't nan. The p-value inversion is the only costly one, it
+        is only done for the rows that need it.
+    DEBUG:
+        1. Means -> t-score (student_t_test_batch()'s formula) -> d and
+           -> p-value -> d give the same d to 1e-12
+    FUTURE:
+    """
+    shapeS = set(np.shape(ColumnD[name]) for name in ES_COLUMN_L if name in ColumnD)
+    if(len(shapeS) > 1 or any(len(shape) != 1 for shape in shapeS)):
+        raise ValueError("the study columns have to be lists of the same length, got "
+                         "shapes {}".format(sorted(shapeS)))
+    nRow = shapeS.pop()[0] if len(shapeS) > 0 else 0
+    nan  = np.full(nRow, np.nan)
+    colD = {name : np.asarray(ColumnD.get(name, nan), dtype=np.float64)
+            for name in ES_COLUMN_L}
+    (n1V, n2V) = (colD["n1"], colD["n2"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dL = [cohens_d(Mean1=colD["mean1"], Mean2=colD["mean2"], N1=n1V, N2=n2V,
+                       Sd1=colD["sd1"], Sd2=colD["sd2"])[0],
+              d_from_tscore(T=colD["t"], N1=n1V, N2=n2V), nan.copy()]
+        needP = np.isnan(dL[0]) & np.isnan(dL[1]) & ~np.isnan(colD["p"])
+        signV = np.where(np.isnan(colD["sign"]), 1.0, colD["sign"])
+        dL[2][needP] = d_from_pvalue(P=colD["p"][needP], N1=n1V[needP], N2=n2V[needP],
+                                     Sign=signV[needP])
+        (lnOr, varLn) = log_odds_ratio(Events1=colD["events1"], N1=n1V,
+                                       Events2=colD["events2"], N2=n2V)
+        dL.append(d_from_log_odds_ratio(LnOr=lnOr))
+        dL.append(d_from_log_odds_ratio(LnOr=np.log(colD["or"])))
+        dM = np.stack(dL)
+        # Every source needs both sample sizes for its variance
+        okM = np.isfinite(dM) & ((n1V > 0) & (n2V > 0))[np.newaxis,:]
+        sourceV = np.where(np.any(okM, axis=0), np.argmax(okM, axis=0), -1)
+        dV = np.where(sourceV >= 0, dM[np.maximum(sourceV, 0), np.arange(nRow)], np.nan)
+        jV = hedges_correction(N=n1V + n2V)
+        gV = jV * dV
+        countsV = sourceV == ES_SOURCE_L.index("counts")
+        varCountsV = 3.0 / pi**2 * varLn
+        varDV = np.where(countsV, varCountsV, effect_size_variance(Es=dV, N1=n1V, N2=n2V))
+        varGV = np.where(countsV, jV**2 * varCountsV,
+                         effect_size_variance(Es=gV, N1=n1V, N2=n2V))
+    return({"d" : dV, "var_d" : varDV, "g" : gV, "var_g" : varGV, "source" : sourceV})
+
+
+
+def read_study_table(Path=None, ChunkRows=ES_CHUNK_ROWS):
+    """
+    ARGS:
+        Path      : CSV file with a header row, see ES_COLUMN_L for the
+                    columns used. Names are matched ignoring case and spaces
+        ChunkRows : rows parsed at a time
+    RETURN:
+        generator of dicts, column name -> float array of ChunkRows rows (the
+        last chunk can be shorter), only the ES_COLUMN_L columns present
+    DESCRIPTION:
+        The fields are parsed as strings by np.loadtxt() (C, handles quoted
+        commas), missing values (ES_MISSING_L) are mapped to nan and the rest
+        converted with one astype() per column.
+    DEBUG:
+    FUTURE:
+    """
+    with open(Path, "r", newline="") as f:
+        headerL = [name.strip().lower() for name in next(csv.reader([f.readline()]), [])]
+        useL = [name for name in ES_COLUMN_L if name in headerL]
+        if(len(useL) == 0):
+            exit_with_error("ERROR!!! {} has none of the columns {}\n".format(Path,
+                            ES_COLUMN_L))
+        idxL = [headerL.index(name) for name in useL]
+        lineNo = 1
+        while(True):
+            lineL = [line for line in itertools.islice(f, ChunkRows) if line.strip() != ""]
+            if(len(lineL) == 0):
+                return
+            try:
+                strM = np.loadtxt(lineL, dtype=str, delimiter=",", quotechar='"',
+                                  usecols=idxL, ndmin=2)
+            except ValueError as err:
+                exit_with_error("ERROR!!! {} after line {} : {}\n".format(Path, lineNo, err))
+            colD = {}
+            for (j, name) in enumerate(useL):
+                fieldV = np.char.lower(np.char.strip(strM[:,j]))
+                fieldV = np.where(np.isin(fieldV, ES_MISSING_L), "nan", fieldV)
+                try:
+                    colD[name] = fieldV.astype(np.float64)
+                except ValueError as err:
+                    exit_with_error("ERROR!!! {} column {} after line {} : {}\n".format(Path,
+                                    name, lineNo, err))
+            lineNo += len(lineL)
+            yield(colD)
+
+
+
+def convert_study_table(Path=None, ChunkRows=ES_CHUNK_ROWS):
+    """
+    ARGS:
+        see read_study_table()
+    RETURN:
+        generator of convert_studies() dicts, one per chunk of rows
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    for colD in read_study_table(Path=Path, ChunkRows=ChunkRows):
+        yield(convert_studies(ColumnD=colD))
+
+
+
+def pool_study_table(Path=None, ChunkRows=ES_CHUNK_ROWS, Es="g", OutPath=None):
+    """
+    ARGS:
+        Path, ChunkRows : see read_study_table()
+        Es      : "g" or "d", effect size pooled
+        OutPath : optional CSV to write every row's ES_OUT_COLUMN_L to, in
+                  the order of the table
+    RETURN:
+        dict :
+            n      : rows in the table
+            source : dict, ES_SOURCE_L name (or "none") -> number of rows
+            fixed  : meta.fixed_effect() of the rows with an effect size
+            random : meta.random_effects() of them, None for a single study
+    DESCRIPTION:
+        Only the effect sizes and variances are kept, 16 bytes per study, the
+        random effects model needs all of them
+    DEBUG:
+    FUTURE:
+    """
+    (esL, varL, sourceL) = ([], [], [])
+    out = None
+    if(OutPath is not None):
+        out = open(OutPath, "w")
+        out.write(",".join(ES_OUT_COLUMN_L) + "\n")
+    for outD in convert_study_table(Path=Path, ChunkRows=ChunkRows):
+        if(out is not None):
+            np.savetxt(out, np.column_stack([outD[name] for name in ES_OUT_COLUMN_L]),
+                       delimiter=",", fmt=["%.10g"] * 4 + ["%d"])
+        okV = outD["source"] >= 0
+        esL.append(outD[Es][okV])
+        varL.append(outD["var_" + Es][okV])
+        sourceL.append(outD["source"])
+    if(out is not None):
+        out.close()
+    esV  = np.concatenate(esL) if len(esL) > 0 else np.zeros(0)
+    varV = np.concatenate(varL) if len(varL) > 0 else np.zeros(0)
+    sourceV = np.concatenate(sourceL) if len(sourceL) > 0 else np.zeros(0, dtype=int)
+    if(len(esV) == 0):
+        exit_with_error("ERROR!!! no row of {} has the statistics for an effect "
+                        "size\n".format(Path))
+    countV = np.bincount(sourceV + 1, minlength=len(ES_SOURCE_L) + 1)
+    sourceD = {name : int(count) for (name, count) in zip(["none"] + ES_SOURCE_L, countV)}
+    return({"n" : len(sourceV), "source" : sourceD,
+            "fixed" : fixed_effect(EsV=esV, VarV=varV),
+            "random" : random_effects(EsV=esV, VarV=varV) if len(esV) > 1 else None})
+
+
+
+def main():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+        python src/effectsize.py STUDIES.csv [OUT.csv]
+        Converts the table's rows to Hedges' g, prints the pooled fixed and
+        random effects models and writes the per row effect sizes to OUT.csv
+    DEBUG:
+    FUTURE:
+    """
+    if(len(sys.argv) < 2):
+        exit_with_error("USAGE : python src/effectsize.py STUDIES.csv [OUT.csv]\n")
+    outD = pool_study_table(Path=sys.argv[1],
+                            OutPath=sys.argv[2] if len(sys.argv) > 2 else None)
+    print("{} rows : {}".format(outD["n"], ", ".join("{} {}".format(count, name)
+          for (name, count) in outD["source"].items() if count > 0)))
+    print("{:<8}{:<8}{:<10}{:<10}{:<10}{:<10}{:<14}{:<10}{:<8}".format("model", "k",
+          "g", "se", "lower", "upper", "Q", "tau2", "I2"))
+    (fixD, ranD) = (outD["fixed"], outD["random"])
+    print("{:<8}{:<8}{:<10.4f}{:<10.4f}{:<10.4f}{:<10.4f}{:<14.4f}".format("fixed",
+          fixD["k"], fixD["es"], fixD["se"], fixD["lower"], fixD["upper"], fixD["q"]))
+    if(ranD is None):
+        return
+    print("{:<8}{:<8}{:<10.4f}{:<10.4f}{:<10.4f}{:<10.4f}{:<14.4f}{:<10.4f}{:<8.3f}".format(
+          "random", ranD["k"], ranD["es"], ranD["se"], ranD["lower"], ranD["upper"],
+          ranD["q"], ranD["tau2"], ranD["i2"]))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+###############################################################################
+#   Author : Ali Snedden
+#   Date   : 3/9/19
+#
+#   Purpose:
+#       Load generator for src/worker.py. Sends --requests requests (a mix of
+#       t-tests, t -> p conversions and meta-analyses) with at most --window
+#       of them unanswered at any time, and reports the throughput and the
+#       latency percentiles of the answers.
+#
+#       By default it starts its own worker and talks to it over stdin /
+#       stdout. With --socket PATH it connects to a running worker instead,
+#       --clients connections at once. --cold N also times N one request
+#       runs of a fresh worker process each, i.e. what a pipeline calling a
+#       script per query pays.
+#
+#   Notes :
+#       1. python src/loadgen.py --requests 100000 --window 256
+#          python src/worker.py --socket /tmp/pvalue.sock &
+#          python src/loadgen.py --socket /tmp/pvalue.sock --clients 4
+#
+###############################################################################
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import numpy as np
+from error import exit_with_error
+from worker import WORKER_MAX_BATCH
+from worker import WORKER_MAX_WAIT
+
+LOADGEN_OP_L = ["ttest", "pvalue", "meta"]
+
+
+
+def parse_args(ArgL):
+    """
+    ARGS:
+        ArgL : command line, without the program name
+    RETURN:
+        argparse.Namespace
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    parser = argparse.ArgumentParser(description="Throughput and latency of src/worker.py")
+    parser.add_argument("--requests", type=int, default=20000,
+                        help="requests sent per client (default: %(default)s)")
+    parser.add_argument("--window", type=int, default=128,
+                        help="max unanswered requests per client (default: %(default)s)")
+    parser.add_argument("--mix", type=str, nargs="+", default=LOADGEN_OP_L,
+                        choices=LOADGEN_OP_L, help="ops sent, in turn (default: all)")
+    parser.add_argument("--nsamp", type=int, nargs="+", default=[3, 5, 10, 20],
+                        help="t-test sample sizes, picked at random (default: %(default)s)")
+    parser.add_argument("--studies", type=int, default=6,
+                        help="studies per meta-analysis (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--socket", type=str, default=None, metavar="PATH",
+                        help="connect to the worker listening here instead of starting one")
+    parser.add_argument("--clients", type=int, default=1,
+                        help="connections to --socket, each sending --requests "
+                             "(default: %(default)s)")
+    parser.add_argument("--max-batch", type=int, default=WORKER_MAX_BATCH,
+                        help="--max-batch of the worker started (default: %(default)s)")
+    parser.add_argument("--max-wait", type=float, default=WORKER_MAX_WAIT, metavar="MS",
+                        help="--max-wait of the worker started (default: %(default)s)")
+    parser.add_argument("--pvalue-method", type=str, default=None, choices=["grid", "beta"],
+                        help="--pvalue-method of the worker started")
+    parser.add_argument("--cold", type=int, default=0, metavar="N",
+                        help="also time N single request runs of a new worker process")
+    return(parser.parse_args(ArgL))
+
+
+
+def make_requests(N=None, MixL=None, NSampL=None, NStudies=None, Rng=None):
+    """
+    ARGS:
+        N        : number of requests
+        MixL     : ops, request i is MixL[i % len(MixL)]
+        NSampL   : t-test sample sizes to pick from
+        NStudies : studies per meta-analysis
+        Rng      : numpy.random.Generator
+    RETURN:
+        list of JSON lines, the ids are 0 ... N-1
+    DESCRIPTION:
+        The samples and statistics are drawn before the clock starts
+    DEBUG:
+    FUTURE:
+    """
+    lineL = []
+    for i in range(N):
+        op = MixL[i % len(MixL)]
+        if(op == "ttest"):
+            nSamp = int(Rng.choice(NSampL))
+            reqD  = {"samp1" : Rng.normal(0, 1, nSamp).tolist(),
+                     "samp2" : Rng.normal(0.5, 1, nSamp).tolist()}
+        elif(op == "pvalue"):
+            reqD  = {"t" : float(Rng.normal(0, 2)), "df" : int(Rng.choice(NSampL)) * 2 - 2}
+        else:
+            reqD  = {"es" : Rng.normal(0.3, 0.2, NStudies).tolist(),
+                     "var" : Rng.uniform(0.02, 0.2, NStudies).tolist()}
+        lineL.append(json.dumps(dict({"id" : i, "op" : op}, **reqD)) + "\n")
+    return(lineL)
+
+
+
+def run_client(LineL=None, Write=None, ReadLine=None, Window=None):
+    """
+    ARGS:
+        LineL    : request lines
+        Write    : function sending a line (and flushing it)
+        ReadLine : function returning the next answer line, "" at the end
+        Window   : max unanswered requests
+    RETURN:
+        latV   : latency of each request in s, in id order
+        errors : number of error answers
+    DESCRIPTION:
+        A thread sends, the calling thread reads the answers. A semaphore
+        keeps at most Window requests unanswered.
+    DEBUG:
+    FUTURE:
+    """
+    sentV  = np.zeros(len(LineL))
+    latV   = np.full(len(LineL), np.nan)
+    window = threading.Semaphore(Window)
+    def send():
+        for (i, line) in enumerate(LineL):
+            window.acquire()
+            sentV[i] = time.perf_counter()
+            Write(line)
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    errors = 0
+    for i in range(len(LineL)):
+        line = ReadLine()
+        if(line == ""):
+            exit_with_error("ERROR!!! the worker closed the connection after {} "
+                            "answers\n".format(i))
+        ansD = json.loads(line)
+        latV[ansD["id"]] = time.perf_counter() - sentV[ansD["id"]]
+        errors += "error" in ansD
+        window.release()
+    sender.join()
+    return(latV, errors)
+
+
+
+def worker_command(Args=None):
+    """
+    ARGS:
+        Args : argparse.Namespace
+    RETURN:
+        command line starting a worker on stdin / stdout
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return([sys.executable, "-u", __file__.replace("loadgen.py", "worker.py"),
+            "--max-batch", str(Args.max_batch), "--max-wait", str(Args.max_wait)]
+           + ([] if Args.pvalue_method is None else ["--pvalue-method", Args.pvalue_method]))
+
+
+
+def run_pipe(Args=None, LineL=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        LineL : request lines
+    RETURN:
+        latencies, errors and wall time in s of one client on a worker
+        started for it, and the worker's stats
+    DESCRIPTION:
+        The worker's start up isn't timed, the first request waits for it
+    DEBUG:
+    FUTURE:
+    """
+    proc = subprocess.Popen(worker_command(Args=Args), stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, text=True, bufsize=1)
+    def write(Line):
+        proc.stdin.write(Line)
+        proc.stdin.flush()
+    write(json.dumps({"id" : -1, "op" : "stats"}) + "\n")
+    proc.stdout.readline()
+    start = time.perf_counter()
+    (latV, errors) = run_client(LineL=LineL, Write=write, ReadLine=proc.stdout.readline,
+                                Window=Args.window)
+    wall = time.perf_counter() - start
+    write(json.dumps({"id" : -1, "op" : "stats"}) + "\n")
+    statsD = json.loads(proc.stdout.readline())
+    proc.stdin.close()
+    proc.wait()
+    return([latV], errors, wall, statsD)
+
+
+
+def run_socket(Args=None, LineLL=None):
+    """
+    ARGS:
+        Args   : argparse.Namespace
+        LineLL : list of request lines, one list per client
+    RETURN:
+        as run_pipe(), with a latency vector per client
+    DESCRIPTION:
+        One thread per client connection
+    DEBUG:
+    FUTURE:
+    """
+    connL = []
+    for lineL in LineLL:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(Args.socket)
+        except OSError as err:
+            exit_with_error("ERROR!!! can't connect to {} : {}\n".format(Args.socket, err))
+        connL.append((conn, conn.makefile("r")))
+    resultL = [None] * len(LineLL)
+    def client(Idx):
+        (conn, f) = connL[Idx]
+        resultL[Idx] = run_client(LineL=LineLL[Idx],
+                                  Write=lambda Line : conn.sendall(Line.encode()),
+                                  ReadLine=f.readline, Window=Args.window)
+    threadL = [threading.Thread(target=client, args=(i,)) for i in range(len(LineLL))]
+    start = time.perf_counter()
+    for thread in threadL:
+        thread.start()
+    for thread in threadL:
+        thread.join()
+    wall = time.perf_counter() - start
+    (conn, f) = connL[0]
+    conn.sendall((json.dumps({"id" : -1, "op" : "stats"}) + "\n").encode())
+    statsD = json.loads(f.readline())
+    for (conn, f) in connL:
+        f.close()
+        conn.close()
+    return([latV for (latV, errors) in resultL], sum(errors for (latV, errors) in resultL),
+           wall, statsD)
+
+
+
+def time_cold(Args=None, Line=None, N=None):
+    """
+    ARGS:
+        Args : argparse.Namespace
+        Line : one request line
+        N    : number of runs
+    RETURN:
+        wall times in s of N fresh workers answering Line, start to exit
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    timeL = []
+    for i in range(N):
+        start = time.perf_counter()
+        subprocess.run(worker_command(Args=Args), input=Line, capture_output=True, text=True,
+                       check=True)
+        timeL.append(time.perf_counter() - start)
+    return(np.array(timeL))
+
+
+
+def main():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    args = parse_args(sys.argv[1:])
+    if(args.requests < 1 or args.window < 1 or args.clients < 1):
+        exit_with_error("ERROR!!! --requests, --window and --clients have to be >= 1\n")
+    if(args.socket is None and args.clients != 1):
+        exit_with_error("ERROR!!! --clients needs --socket\n")
+    rng = np.random.default_rng(args.seed)
+    lineLL = [make_requests(N=args.requests, MixL=args.mix, NSampL=args.nsamp,
+                            NStudies=args.studies, Rng=rng) for i in range(args.clients)]
+    if(args.socket is None):
+        (latVL, errors, wall, statsD) = run_pipe(Args=args, LineL=lineLL[0])
+    else:
+        (latVL, errors, wall, statsD) = run_socket(Args=args, LineLL=lineLL)
+    latV = np.concatenate(latVL) * 1000.0
+    nReq = len(latV)
+    print("requests    : {}   ({} clients, window {}, mix {})".format(nReq, args.clients,
+          args.window, " ".join(args.mix)))
+    print("errors      : {}".format(errors))
+    print("wall        : {:.3f} s".format(wall))
+    print("throughput  : {:.0f} requests/s".format(nReq / wall))
+    print("latency ms  : p50 {:.3f}  p90 {:.3f}  p99 {:.3f}  max {:.3f}".format(
+          *np.percentile(latV, [50, 90, 99]), np.max(latV)))
+    print("worker      : {} batches, mean {:.1f} / max {} requests per batch, "
+          "tail tables {}".format(statsD["batches"], statsD["requests"] /
+          max(statsD["batches"], 1), statsD["max_batch"], statsD["tail_table_cache"]))
+    if(args.cold > 0):
+        coldV = time_cold(Args=args, Line=lineLL[0][0], N=args.cold) * 1000.0
+        print("cold start  : {} runs, mean {:.1f} ms, min {:.1f} ms per request".format(
+              args.cold, np.mean(coldV), np.min(coldV)))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -54,73 +54,311 @@
 #
 #
 ###############################################################################
-import time
-import numpy as np
-import random as rnd
 import sys
+import argparse
 from error import exit_with_error
-import matplotlib
-import random
-from functions import convert_tscore_to_pvalue
-from functions import student_t_test
-from functions import welchs_t_test
-from plotting import plot_histogram
-
-def print_help(ExitCode):
+
+SECTION_L = ["stderr", "tscore", "pvalue-sweep", "meta", "power"]   # Sections, in run order
+### Options that don't change the results, a --resume'd run may change them ###
+RESUME_FREE_L = ["workers", "checkpoint", "checkpoint_interval", "resume", "profile",
+                 "profile_cprofile", "pop_cache", "pop_cache_max_gb", "results",
+                 "results_append"]
+
+
+
+def parse_args(ArgL):
     """
     ARGS:
+        ArgL : command line arguments, i.e. sys.argv[1:]
     RETURN:
+        argparse.Namespace, args.section is one of SECTION_L or "all"
     DESCRIPTION:
+        Only argparse is imported here, so --help doesn't pay for numpy.
+        For backwards compatibility './src/main.py mu1 s1 mu2 s2' (no section)
+        runs all the sections.
     DEBUG:
     FUTURE:
     """
-    sys.stderr.write("./src/main.py mu1 s1 mu2 s2\n"
-                     "    mu1 : float, mean(population 1), assumed gaussian\n"
-                     "    s1  : float, stdev(population 1)\n"
-                     "    mu2 : float, mean(population 2), assumed gaussian\n"
-                     "    s2  : float, stdev(population 2)\n"
-                     "\nTo run locally, with all correctly installed packages run\n"
-                     "     source ~/.local/virtualenvs/python3.6/bin/activate\n")
-    sys.exit(ExitCode)
+    if(len(ArgL) > 0 and ArgL[0] not in SECTION_L + ["all"] and
+       ArgL[0] not in ["-h", "--help"]):
+        ArgL = ["all"] + list(ArgL)
+    # Options shared by every section
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("mu1", type=float, help="mean(population 1), assumed gaussian")
+    common.add_argument("s1",  type=float, help="stdev(population 1)")
+    common.add_argument("mu2", type=float, help="mean(population 2), assumed gaussian")
+    common.add_argument("s2",  type=float, help="stdev(population 2)")
+    common.add_argument("--npop", type=int, default=100000,
+                        help="number of individuals in each population (default: 100000)")
+    common.add_argument("--seed", type=int, default=42,
+                        help="seed for the random number generator (default: 42)")
+    common.add_argument("--float32", action="store_true",
+                        help="store the populations as float32 to halve memory")
+    common.add_argument("--chunk-size", type=int, default=2**15,
+                        help="max number of experiments drawn at once, bounds memory "
+                             "(default: 32768)")
+    common.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes for the Monte Carlo sweeps, "
+                             "<= 0 uses all cores. Output does not depend on it (default: 1)")
+    common.add_argument("--pop-cache", type=str, default=None, metavar="DIR",
+                        help="cache the generated populations in DIR and memory map "
+                             "them on later runs with the same parameters")
+    common.add_argument("--pop-cache-max-gb", type=float, default=None, metavar="GB",
+                        help="evict least recently used populations from --pop-cache "
+                             "beyond this size (default: unbounded)")
+    common.add_argument("--profile", type=str, default=None, metavar="FILE",
+                        help="write wall times per section and sweep cell, call counts of "
+                             "the hot functions, RNG draws and peak RSS to FILE (.csv for "
+                             "CSV, otherwise JSON)")
+    common.add_argument("--profile-cprofile", type=str, default=None, metavar="FILE",
+                        help="also dump cProfile stats of the main process to FILE, read "
+                             "with python -m pstats FILE")
+    common.add_argument("--results", type=str, default=None, metavar="DIR",
+                        help="also store the tables, and Section 3's per experiment t, DF "
+                             "and p values, as memory mappable .npy columns in DIR, see "
+                             "results.py")
+    common.add_argument("--results-append", action="store_true",
+                        help="add this run to the results already in --results DIR")
+    common.add_argument("--checkpoint", type=str, default=None, metavar="FILE",
+                        help="save the completed tasks of Sections 1 and 3 to FILE, so an "
+                             "interrupted run can be continued with --resume")
+    common.add_argument("--checkpoint-interval", type=float, default=60.0, metavar="SECONDS",
+                        help="min seconds between two --checkpoint saves (default: 60)")
+    common.add_argument("--resume", action="store_true",
+                        help="continue the run saved in --checkpoint FILE. Needs the same "
+                             "options (--workers may differ), the output is identical to an "
+                             "uninterrupted run")
+    common.add_argument("--plot-dir", type=str, default=None, metavar="DIR",
+                        help="write histograms of every sweep cell to DIR : the sample "
+                             "means (Section 1), t-scores and p-values (Section 3) and "
+                             "bootstrap replicates (Section 4). No display needed")
+    common.add_argument("--plot-format", type=str, nargs="+", default=["png"],
+                        choices=["png", "svg"],
+                        help="formats of the --plot-dir files (default: png)")
+    common.add_argument("--plot-bins", type=int, default=50,
+                        help="--plot-dir : number of bins the histograms start with "
+                             "(default: 50)")
+    # Per section options
+    stderrP = argparse.ArgumentParser(add_help=False)
+    stderrP.add_argument("--stderr-nsamp", type=int, default=50,
+                         help="Section 1 : samples per experiment (default: 50)")
+    stderrP.add_argument("--stderr-nexp", type=int, nargs="+",
+                         default=[20, 200, 2000, 20000, 50000, 100000],
+                         help="Section 1 : list of number of experiments "
+                              "(default: 20 200 2000 20000 50000 100000)")
+    sweepP = argparse.ArgumentParser(add_help=False)
+    sweepP.add_argument("--sweep-nexp", type=int, default=500,
+                        help="Section 3 : experiments per sample size (default: 500)")
+    sweepP.add_argument("--sweep-nsamp", type=int, nargs="+", default=[3,5,10,15,20,30,40],
+                        help="Section 3 : list of samples per group "
+                             "(default: 3 5 10 15 20 30 40)")
+    sweepP.add_argument("--multitest", action="store_true",
+                        help="Section 3 : also count the p-values of each nSamp rejected "
+                             "at 0.05 after Bonferroni, Holm, Benjamini-Hochberg and "
+                             "Benjamini-Yekutieli corrections")
+    sweepP.add_argument("--permutation", type=int, default=0, metavar="NPERM",
+                        help="Section 3 : also give permutation test p-values of the "
+                             "difference in means, exact when there are at most NPERM "
+                             "relabelings, otherwise from NPERM random ones (default: 0, off)")
+    pvalueP = argparse.ArgumentParser(add_help=False)
+    pvalueP.add_argument("--pvalue-method", type=str, choices=["grid", "beta"],
+                         default="beta",
+                         help="Sections 3 and 5 : 'beta' is exact (incomplete beta "
+                              "function) and much faster for Welch's DFs, 'grid' sums the "
+                              "binned t-distribution, the original method (default: beta)")
+    metaP = argparse.ArgumentParser(add_help=False)
+    metaP.add_argument("--studies", type=parse_study_size, nargs="+",
+                       default=[[13,12], [31,12], [35,24], [12,22], [24,21], [177,117]],
+                       help="Section 4 : study sizes as N_treat,N_wt pairs "
+                            "(default: 13,12 31,12 35,24 12,22 24,21 177,117)")
+    metaP.add_argument("--bootstrap", type=int, default=0, metavar="NREP",
+                       help="Section 4 : also give percentile and BCa bootstrap CIs of the "
+                            "pooled effects from NREP replicates (default: 0, off)")
+    metaP.add_argument("--bootstrap-resample", type=str, default="both",
+                       choices=["both", "studies", "observations"],
+                       help="Section 4 : resample the studies, the observations within "
+                            "each study or both (default: both)")
+    powerP = argparse.ArgumentParser(add_help=False)
+    powerP.add_argument("--power-es", type=float, nargs="+", default=None,
+                        help="Section 5 : list of effect sizes, (mu2 - mu1) / sd1 "
+                             "(default: from mu1 s1 mu2)")
+    powerP.add_argument("--power-sd-ratio", type=float, nargs="+", default=None,
+                        help="Section 5 : list of sd2 / sd1 (default: s2 / s1)")
+    powerP.add_argument("--power-nsamp", type=int, nargs="+", default=[5, 10, 20, 40],
+                        help="Section 5 : list of samples per group (default: 5 10 20 40)")
+    powerP.add_argument("--power-ci", type=float, default=0.01,
+                        help="Section 5 : a cell stops once the 95%% CI of its power is "
+                             "within +/- this (default: 0.01)")
+    powerP.add_argument("--power-max-nexp", type=int, default=100000,
+                        help="Section 5 : max experiments per cell (default: 100000)")
+    powerP.add_argument("--power-target", type=float, default=0.8,
+                        help="Section 5 : power the minimum sample size has to reach "
+                             "(default: 0.8)")
+    powerP.add_argument("--power-nmax", type=int, default=1000,
+                        help="Section 5 : largest sample size searched (default: 1000)")
 
+    parser = argparse.ArgumentParser(prog="./src/main.py",
+        description="Run a series of experiments drawing samples from two gaussian "
+                    "populations to build intuition about p-values and meta-analysis",
+        epilog="'./src/main.py mu1 s1 mu2 s2 ...' without a section runs all of them.\n"
+               "Use './src/main.py SECTION -h' for the section's options.\n\n"
+               "To run locally, with all correctly installed packages run\n"
+               "     source ~/.local/virtualenvs/python3.6/bin/activate",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="section", metavar="SECTION")
+    subparsers.required = True
+    subparsers.add_parser("all", parents=[common, stderrP, sweepP, pvalueP, metaP, powerP],
+                          help="run every section, in order")
+    subparsers.add_parser("stderr", parents=[common, stderrP],
+                          help="Section 1 : standard error of the mean")
+    subparsers.add_parser("tscore", parents=[common],
+                          help="Section 2 : t-score using the entire populations")
+    subparsers.add_parser("pvalue-sweep", parents=[common, sweepP, pvalueP],
+                          help="Section 3 : Student's vs. Welch's t-test p-values")
+    subparsers.add_parser("meta", parents=[common, metaP],
+                          help="Section 4 : Cohen's d and a meta-analysis example")
+    subparsers.add_parser("power", parents=[common, pvalueP, powerP],
+                          help="Section 5 : power and minimum sample size of the t-tests")
+    return(parser.parse_args(ArgL))
 
 
-def main():
+
+def parse_study_size(String):
     """
     ARGS:
+        String : 'N_treat,N_wt', e.g. '13,12'
     RETURN:
+        [N_treat, N_wt]
     DESCRIPTION:
     DEBUG:
     FUTURE:
     """
-    if(sys.version_info[0] < 3):
-        exit_with_error("ERROR!!! Runs with python3, NOT {}\n".format(sys.argv[0]))
-    if(len(sys.argv) == 2 and ("--h" in sys.argv[1] or "-h" in sys.argv[1])):
-        print_help(ExitCode=0)
-    elif(len(sys.argv) != 5):
-        print_help(ExitCode=1)
-    np.random.seed(42)
-    random.seed(42)
+    try:
+        sizeL = [int(n) for n in String.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected N_treat,N_wt, got {}".format(String))
+    if(len(sizeL) != 2 or min(sizeL) < 2):
+        raise argparse.ArgumentTypeError("expected N_treat,N_wt >= 2, got {}".format(String))
+    return(sizeL)
 
-    ### Create the population distributions, draw our experimental samples from these ###
-    # Population / Dist 1
-    pop1_mu = float(sys.argv[1])         ### average
-    pop1_sd = float(sys.argv[2])         ### standard dev
-    N1  = 100000    ### Number of samples 
-    pop1V = np.zeros([N1])
-    for i in range(N1):
-        pop1V[i] = random.gauss(pop1_mu, pop1_sd)
-    # Population / Dist 2
-    pop2_mu = float(sys.argv[3])
-    pop2_sd = float(sys.argv[4])
-    N2  = 100000    ### Number of samples 
-    pop2V = np.zeros([N2])
-    for i in range(N2):
-        pop2V[i] = random.gauss(pop2_mu, pop2_sd)
-    print("\n---------------------------------------------------------")
-    print("Population 1 : [mu,sd] = [{:<.3f},{:<.3f}]\n"
-          "Population 2 : [mu,sd] = [{:<.3f},{:<.3f}]\n".format(pop1_mu,pop1_sd,pop2_mu,pop2_sd))
 
+
+def spawn_run_seeds(Seed=None):
+    """
+    ARGS:
+        Seed : int, --seed
+    RETURN:
+        dict of numpy.random.SeedSequence, one per population and section
+    DESCRIPTION:
+        Each population and section gets its own stream, so a section gives 
+        the same output whether it is run alone or as part of 'all'. The 
+        sweeps spawn a SeedSequence per task, so output doesn't depend on 
+        --workers either.
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    nameL = ["pop1", "pop2"] + SECTION_L
+    return(dict(zip(nameL, np.random.SeedSequence(Seed).spawn(len(nameL)))))
+
+
+
+def build_populations(Args=None, SeedD=None, NameL=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        SeedD : dict from spawn_run_seeds()
+        NameL : list of populations to build, "pop1" and/or "pop2"
+    RETURN:
+        dict, name -> population array
+    DESCRIPTION:
+        With --pop-cache the populations come from a popstore.PopulationStore
+        (read-only memory maps), otherwise they are generated.
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    from population import make_rng
+    from population import build_population
+    dtype = np.float32 if Args.float32 else np.float64
+    paramD = {"pop1" : (Args.mu1, Args.s1), "pop2" : (Args.mu2, Args.s2)}
+    store  = None
+    if(Args.pop_cache is not None):
+        from popstore import PopulationStore
+        maxBytes = None
+        if(Args.pop_cache_max_gb is not None):
+            maxBytes = int(Args.pop_cache_max_gb * 2**30)
+        store = PopulationStore(Dir=Args.pop_cache, MaxBytes=maxBytes)
+    popD = {}
+    for name in NameL:
+        (mu, sd) = paramD[name]
+        if(store is not None):
+            popD[name] = store.get(Mu=mu, Sd=sd, N=Args.npop, Dtype=dtype, Seed=SeedD[name])
+        else:
+            popD[name] = build_population(Rng=make_rng(Seed=SeedD[name]), Mu=mu, Sd=sd,
+                                          N=Args.npop, Dtype=dtype)
+    return(popD)
+
+
+
+def store_table(Results=None, Table=None, ColumnD=None):
+    """
+    ARGS:
+        Results : results.ResultsStore or None
+        Table   : table name
+        ColumnD : dict, column name -> 1D array
+    RETURN:
+        ColumnD, the sections print their tables from it
+    DESCRIPTION:
+        Appends ColumnD to Results' Table, if there is a store
+    DEBUG:
+    FUTURE:
+    """
+    if(Results is not None):
+        Results.append(Table=Table, ColumnD=ColumnD)
+    return(ColumnD)
+
+
+
+def write_plots(Args=None, HistD=None, Prefix=None):
+    """
+    ARGS:
+        Args   : argparse.Namespace
+        HistD  : dict, see plotting.write_histograms()
+        Prefix : file name prefix, the section
+    RETURN:
+    DESCRIPTION:
+        Writes the histograms to --plot-dir. matplotlib is only imported here
+    DEBUG:
+    FUTURE:
+    """
+    from plotting import write_histograms
+    pathL = write_histograms(HistD=HistD, Dir=Args.plot_dir, FormatL=Args.plot_format,
+                             Prefix=Prefix)
+    print("Plots : wrote {} files to {}".format(len(pathL), Args.plot_dir))
+
+
+
+def section_stderr(Args=None, PopD=None, SeedD=None, Sched=None, Results=None,
+                   Checkpoint=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        PopD  : dict from build_populations()
+        SeedD : dict from spawn_run_seeds()
+        Sched : scheduler.Scheduler with the populations registered
+        Results : results.ResultsStore to store the tables in, or None
+        Checkpoint : checkpoint.Checkpoint of the run, or None
+    RETURN:
+    DESCRIPTION:
+        Section 1 : Standard error of the mean
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    from sweeps import stderr_sweep
+    from accumulator import StreamingHistogram
+    pop2V = PopD["pop2"]
     ### 
     #  Explore Standard deviation of the mean : \sigma / sqrt(N)
     #    Per : https://en.wikipedia.org/wiki/Standard_error#Standard_error_of_the_mean
@@ -128,8 +366,8 @@ def main():
     #    means around the population mean"
     ###
     # Draw 20 experiments, see if the means cluster with std. dev. of mean. Use dist. 2
-    nSamp       = 50          # Number of samples in each experiment
-    nExpL       = [20, 200, 2000, 20000, 50000, 100000]     # Number of experiments
+    nSamp       = Args.stderr_nsamp     # Number of samples in each experiment
+    nExpL       = Args.stderr_nexp      # Number of experiments
     print("\n\n---------------------------------------------------------")
     print("########## SECTION 1 ##########")
     print("# Testing Std. Dev. of Mean for Population 2.\n"
@@ -142,29 +380,51 @@ def main():
     print("{:<10}{:<15}{:<15}{:<17}{:<15}".format("nExp", "mean_sampdist", "std_sampdist",
           "stdL[0]/sqrt(N)", "mean(stdL/sqrt(N-1))"))
     # Loop over number of experiments
-    for nExp in nExpL:
-        experL = []               # Experiment list
-        experMeanL = []
-        experStdL = []
-        for i in range(nExp):
-            idxL    = np.random.randint(low=0, high=N2, size=nSamp)  # random draw of indices 
-            sampL   = pop2V[idxL]                                    # Get Samples drawn from dist 2.
-            mean    = np.mean(sampL)
-            std     = np.std(sampL)
-            # Record mean, stdev for this experiment
-            experMeanL.append(mean)
-            experStdL.append(std)
-            experL.append([mean,std])
-        ### Let's plot the distribution ###
-        print("{:<10}{:<15.4f}{:<15.4f}{:<17.4f}{:<15.4f}".format(nExp,np.mean(experMeanL),
-              np.std(experMeanL), experStdL[0] / np.sqrt(nSamp),
-              np.mean(experStdL) / np.sqrt(nSamp-1)))
+    hist  = None
+    if(Args.plot_dir is not None):
+        hist = StreamingHistogram(NBins=Args.plot_bins)
+    cellL = stderr_sweep(Sched=Sched, PopName="pop2", NSamp=nSamp, NExpL=nExpL,
+                         SeedSeq=SeedD["stderr"], ChunkSize=Args.chunk_size, Hist=hist,
+                         Checkpoint=Checkpoint)
+    tableD = store_table(Results=Results, Table="stderr", ColumnD=dict(zip(
+                         ["nexp", "mean_sampdist", "std_sampdist", "std0", "mean_std"],
+                         [np.array(nExpL)] + [np.array([cell[i] for cell in cellL])
+                                              for i in range(4)])))
+    for row in range(len(nExpL)):
+        print("{:<10}{:<15.4f}{:<15.4f}{:<17.4f}{:<15.4f}".format(tableD["nexp"][row],
+              tableD["mean_sampdist"][row], tableD["std_sampdist"][row], tableD["std0"][row],
+              tableD["mean_std"][row]))
     print("Notice that 'std_sampdist' converges to 'mean(stdL/sqrt(N-1))', we'd \n"
           "     expect this if the standard deviation of the mean really is standard \n"
           "     dev of the distribution of means")
-    
+    if(Args.plot_dir is not None):
+        write_plots(Args=Args, Prefix="stderr", HistD={"nExp={}".format(nExp) :
+                    (cell[4], "Sampling distribution, nSamp = {}, nExp = {}".format(nSamp,
+                     nExp), "mean of experiment") for (nExp, cell) in zip(nExpL, cellL)})
+
 
 
+def section_tscore(Args=None, PopD=None, SeedD=None, Sched=None, Results=None,
+                   Checkpoint=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        PopD  : dict from build_populations()
+        SeedD : dict from spawn_run_seeds()
+        Sched : scheduler.Scheduler with the populations registered
+        Results : results.ResultsStore to store the tables in, or None
+        Checkpoint : checkpoint.Checkpoint of the run, or None
+    RETURN:
+    DESCRIPTION:
+        Section 2 : t-score using the entire populations
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    pop1V = PopD["pop1"]
+    pop2V = PopD["pop2"]
+    N1 = len(pop1V)
+    N2 = len(pop2V)
     ##############################################
     ### Calculate distributions ###
     ### Take distribution 1 as the Wild Type or standard or null hypothesis ###   
@@ -177,8 +437,8 @@ def main():
     #t = (np.mean(pop2V) - mu1) / (sd2 / np.sqrt(N2))
     nSamp = N1
     #t=student_t_test_eq_samp_and_var(Pop1V=pop1V, Pop2V=pop2V, NSamp=nSamp)
-    samp1 = pop1V#[np.random.randint(low=0, high=N1, size=nSamp)]
-    samp2 = pop2V#[np.random.randint(low=0, high=N2, size=nSamp)]
+    samp1 = pop1V#[rng.integers(low=0, high=N1, size=nSamp)]
+    samp2 = pop2V#[rng.integers(low=0, high=N2, size=nSamp)]
     s1    = np.std(samp1)
     s2    = np.std(samp2)
     mu1   = np.mean(samp1)
@@ -193,16 +453,37 @@ def main():
         print("t-score using entire distribution N1 {} and N2 {}".format(N1,N2))
         print("t = {:<.3f}\n    Pop1  : [mu,sd] = [{:<.3f},{:<.3f}]\n"
               "    Pop2  : [mu,sd] = [{:<.3f},{:<.3f}]".format(t,
-               pop1_mu, pop1_sd,pop2_mu, pop2_sd))
+               Args.mu1, Args.s1, Args.mu2, Args.s2))
         print("    Samp1 : [mu,sd] = [{:<.3f},{:<.3f}]\n"
               "    Samp2 : [mu,sd] = [{:<.3f},{:<.3f}]\n".format(mu1,s1,mu2,s2))
-    
+    elif(Args.section == "tscore"):
+        sys.stderr.write("WARNING!!! Section 2 needs populations with equal stdev, "
+                         "s1 = {} and s2 = {}\n".format(Args.s1, Args.s2))
 
 
 
+def section_pvalue_sweep(Args=None, PopD=None, SeedD=None, Sched=None, Results=None,
+                         Checkpoint=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        PopD  : dict from build_populations()
+        SeedD : dict from spawn_run_seeds()
+        Sched : scheduler.Scheduler with the populations registered
+        Results : results.ResultsStore to store the tables in, or None
+        Checkpoint : checkpoint.Checkpoint of the run, or None
+    RETURN:
+    DESCRIPTION:
+        Section 3 : Student's vs. Welch's t-test p-values over sample sizes
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    from sweeps import ttest_sweep
+    from accumulator import StreamingHistogram
     ### Let's now look at the distribution of t-scores ###
     #print("\n---------------------------------------------------------")
-    nExp  = 500
+    nExp  = Args.sweep_nexp
     print("\n---------------------------------------------------------"
           "-----------------------------------")
     print("########## SECTION 3 ##########")
@@ -223,84 +504,414 @@ def main():
           "mu(tW)", "std(tW)", "frac>2",
           "mu(pW)", "std(pW)", "frac<.05"))
     #for nSamp in [3,5,10,15,20,30,40,50,75,100]:
-    for nSamp in [3,5,10,15,20,30,40]:
-        ### Equal sample sizes, equal variance
-        tL = np.zeros(nExp)
-        pL = np.zeros(nExp)
-        vL = np.zeros(nExp)
-        ### un-equal sample sizes, un-equal variance
-        tWelchL = np.zeros(nExp)
-        pWelchL = np.zeros(nExp)
-        vWelchL = np.zeros(nExp)
-        for i in range(nExp):
-            ### Draw Samples ###
-            samp1V = pop1V[np.random.randint(low=0, high=N1, size=nSamp)]
-            samp2V = pop2V[np.random.randint(low=0, high=N2, size=nSamp)]
-            ### Compute t-score, p-values - equal samp size, equal variance ###
-            (t,v,p)=student_t_test(Samp1V=samp1V, Samp2V=samp2V)
-            tL[i] = t
-            pL[i] = p
-            ### Compute t-score, p-values - un-equal samp size, un-equal variance ###
-            (t,v,p)=welchs_t_test(Samp1V=samp1V, Samp2V=samp2V)
-            tWelchL[i] = t
-            pWelchL[i] = p
+    nSampL = Args.sweep_nsamp
+    results = Results
+    if(Args.multitest and Results is None):
+        # The corrections need every p-value, they are streamed to a scratch store
+        import tempfile
+        from results import ResultsStore
+        scratch = tempfile.TemporaryDirectory(prefix="pvalue-sweep_")
+        results = ResultsStore(Dir=scratch.name)
+        results.start_run()
+    histD  = None
+    if(Args.plot_dir is not None):
+        # p-values have fixed bins on [0,1], the t-scores' are calibrated as they come
+        pEdgeV = np.linspace(0, 1, Args.plot_bins + 1)
+        histD  = {"t"      : StreamingHistogram(NBins=Args.plot_bins),
+                  "p"      : StreamingHistogram(Edges=pEdgeV),
+                  "tWelch" : StreamingHistogram(NBins=Args.plot_bins),
+                  "pWelch" : StreamingHistogram(Edges=pEdgeV)}
+        if(Args.permutation > 0):
+            histD["pPerm"] = StreamingHistogram(Edges=pEdgeV)
+    cellL  = ttest_sweep(Sched=Sched, Pop1Name="pop1", Pop2Name="pop2", NSampL=nSampL,
+                         NExp=nExp, SeedSeq=SeedD["pvalue-sweep"], ChunkSize=Args.chunk_size,
+                         PvalueMethod=Args.pvalue_method, HistD=histD,
+                         Results=results, Checkpoint=Checkpoint, NPerm=Args.permutation)
+    # Columns in print order, (accumulator, column, threshold, threshold's column)
+    tableD = {"nsamp" : np.array(nSampL)}
+    for (name, col, frac, fracCol) in [("t",      "t",       "frac>2",   "frac_gt2_t"),
+                                       ("p",      "p",       "frac<.05", "frac_lt05_p"),
+                                       ("tWelch", "t_welch", "frac>2",   "frac_gt2_t_welch"),
+                                       ("pWelch", "p_welch", "frac<.05", "frac_lt05_p_welch")]:
+        tableD["mu_" + col]  = np.array([cell[name].mean for cell in cellL])
+        tableD["std_" + col] = np.array([cell[name].std() for cell in cellL])
+        tableD[fracCol]      = np.array([cell[name].frac(frac) for cell in cellL])
+    tableD = store_table(Results=Results, Table="pvalue-sweep", ColumnD=tableD)
+    for row in range(len(nSampL)):
         print("{:<7}{:<8.3f}{:<8.3f}{:<7.3f} "
               "{:<8.3f}{:<8.3f}{:<9.3f}| "
               "{:<8.3f}{:<8.3f}{:<7.3f} "
-              "{:<8.3f}{:<8.3f}{:<9.3f}".format(
-              nSamp, np.mean(tL), np.std(tL), len(tL[np.abs(tL) > 2])/nExp,
-              np.mean(pL), np.std(pL), len(pL[np.abs(pL) < 0.05])/nExp,
-              np.mean(tWelchL), np.std(tWelchL), len(tWelchL[np.abs(tWelchL) > 2])/nExp,
-              np.mean(pWelchL), np.std(pWelchL), len(pWelchL[np.abs(pWelchL) < 0.05])/nExp))
+              "{:<8.3f}{:<8.3f}{:<9.3f}".format(*[tableD[col][row] for col in tableD]))
+    if(Args.permutation > 0):
+        from permutation import permutation_method
+        permD = store_table(Results=Results, Table="pvalue-sweep_permutation", ColumnD={
+                            "nsamp"       : np.array(nSampL),
+                            "method"      : np.array([permutation_method(N1=nSamp, N2=nSamp,
+                                                      NPerm=Args.permutation) for nSamp in nSampL]),
+                            "mu_p_perm"   : np.array([cell["pPerm"].mean for cell in cellL]),
+                            "std_p_perm"  : np.array([cell["pPerm"].std() for cell in cellL]),
+                            "frac_lt05_p_perm" : np.array([cell["pPerm"].frac("frac<.05")
+                                                           for cell in cellL])})
+        print("\nPermutation test of mu1 - mu2, at most {} relabelings per experiment".format(
+              Args.permutation))
+        print("{:<7}{:<13}{:<8}{:<8}{:<9}".format("nSamp", "method", "mu(pP)", "std(pP)",
+              "frac<.05"))
+        for row in range(len(nSampL)):
+            print("{:<7}{:<13}{:<8.3f}{:<8.3f}{:<9.3f}".format(*[permD[col][row]
+                  for col in permD]))
+    if(Args.multitest):
+        from multitest import adjust_pvalues_chunked
+        from multitest import MULTITEST_METHOD_L
+        from functions import convert_tscore_to_pvalue
+        alpha = 0.05
+        rowL  = []
+        for nSamp in nSampL:
+            for (test, tCol, dfCol) in [("student", "t", "df"), ("welch", "t_welch", "df_welch")]:
+                # Chunks hold one task each, so one nSamp. The p-values are recomputed
+                # exactly, the grid's are 0 beyond |t| = 10 and would all be rejected
+                chunkIter = lambda tCol=tCol, dfCol=dfCol, nSamp=nSamp : (
+                            convert_tscore_to_pvalue(T=chunkD[tCol], DF=chunkD[dfCol],
+                            Method="beta") for chunkD in results.chunks(
+                            Table="pvalue-sweep_experiments", Run=results.run,
+                            ColumnL=["nsamp", tCol, dfCol]) if chunkD["nsamp"][0] == nSamp)
+                rowL.append([nSamp, test, sum(int(np.count_nonzero(pV < alpha))
+                                              for pV in chunkIter())] +
+                            [adjust_pvalues_chunked(ChunkIter=chunkIter, Method=method,
+                             Alpha=alpha)["rejected"] for method in MULTITEST_METHOD_L])
+        multiD = store_table(Results=Results, Table="pvalue-sweep_multitest", ColumnD={
+                             name : np.array([row[i] for row in rowL]) for (i, name) in
+                             enumerate(["nsamp", "test", "raw"] + MULTITEST_METHOD_L)})
+        print("\nMultiple testing : p-values of each nSamp rejected at {} (of {})".format(alpha,
+              nExp))
+        print("{:<7}{:<9}{:<8}{:<12}{:<8}{:<8}{:<8}".format("nSamp", "test", "p<.05",
+              *MULTITEST_METHOD_L))
+        for row in range(len(rowL)):
+            print("{:<7}{:<9}{:<8}{:<12}{:<8}{:<8}{:<8}".format(*[multiD[col][row]
+                  for col in multiD]))
+        if(results is not Results):
+            scratch.cleanup()
+    if(Args.plot_dir is not None):
+        labelD = {"t" : "Student's t", "p" : "Student's p-value", "tWelch" : "Welch's t",
+                  "pWelch" : "Welch's p-value", "pPerm" : "Permutation p-value"}
+        write_plots(Args=Args, Prefix="pvalue-sweep", HistD={
+                    "nSamp={}_{}".format(nSamp, name) : (cell[name + "_hist"],
+                    "{}, nSamp = {}, nExp = {}".format(labelD[name], nSamp, nExp),
+                    labelD[name]) for (nSamp, cell) in zip(nSampL, cellL) for name in histD})
+
 
+def section_meta(Args=None, PopD=None, SeedD=None, Sched=None, Results=None,
+                 Checkpoint=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        PopD  : dict from build_populations()
+        SeedD : dict from spawn_run_seeds()
+        Sched : scheduler.Scheduler with the populations registered
+        Results : results.ResultsStore to store the tables in, or None
+        Checkpoint : checkpoint.Checkpoint of the run, or None
+    RETURN:
+    DESCRIPTION:
+        Section 4 : Cohen's d and a meta-analysis example
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    from population import make_rng
+    from meta import group_mean_std
+    from meta import cohens_d
+    from meta import effect_size_variance
+    from meta import fixed_effect
+    from meta import random_effects
+    from meta import cumulative_meta
+    from meta import leave_one_out_meta
+    pop1V = PopD["pop1"]
+    pop2V = PopD["pop2"]
+    N1 = len(pop1V)
+    N2 = len(pop2V)
     ### Let's now emulate the studies in Table 4 of
     ### "Evidence Base Update for Autism Spectrum Disorder" by Smith and Iadarola ###
     # first column is early intervertion, 2nd column is treatment as usual
-    studySizeLL=[[13,12], [31,12], [35,24], [12,22], [24,21], [177,117]]
-    esL = []        # List of effect sizes from studySizeLL
-    varL= []        # List of variances from studySizeLL, computed from pooled stdev, sp
-    for studyL in studySizeLL:
-        samp1V = pop1V[np.random.randint(low=0, high=N1, size=studyL[0])]
-        samp2V = pop2V[np.random.randint(low=0, high=N2, size=studyL[1])]
-        mean1  = np.mean(samp1V)
-        mean2  = np.mean(samp2V)
-        sd1    = np.std(samp1V)
-        sd2    = np.std(samp2V)
-        # pooled stdev. see eqn 3.20 in Lipsey & Wilson
-        var = (((studyL[0] - 1)*sd1**2 + (studyL[1] - 1)*sd2**2) /
-               ((studyL[0] - 1) + (studyL[1] - 1) ))
-        stdP  = np.sqrt(var)
-        # Standardized mean diff - Cohen's d (?)- eq 3.21 Lipsey & Wilson, eq 7 latex notes
-        es = (mean1 - mean2) / stdP   # Effect size
-        esL.append(es)
-        varL.append(var)
-
-    cIL = []        # Confidence interval for each studySizeLL
-    meanES = np.mean(esL)
-    stdES  = np.sqrt(1/sum(varL))   # Eqn 13 in latex., p114 in Lipsey & Wilson
-    z = 1.96        # Critical value for z-distribution, with alpha = 0.05
-    lower  = meanES - z*stdES       # Eqn 14 in latex
-    upper  = meanES + z*stdES       # Eqn 15 in latex
+    studySizeLL = Args.studies
+    rng = make_rng(Seed=SeedD["meta"])
+    n1V = np.array([studyL[0] for studyL in studySizeLL])
+    n2V = np.array([studyL[1] for studyL in studySizeLL])
+    # Draw every study's samples at once, then reduce each study's slice
+    samp1V = pop1V[rng.integers(low=0, high=N1, size=np.sum(n1V))]
+    samp2V = pop2V[rng.integers(low=0, high=N2, size=np.sum(n2V))]
+    (mean1V, sd1V) = group_mean_std(SampV=samp1V, NV=n1V)
+    (mean2V, sd2V) = group_mean_std(SampV=samp2V, NV=n2V)
+    # Standardized mean diff - Cohen's d (?)- eq 3.21 Lipsey & Wilson, eq 7 latex notes
+    # using the pooled stdev. see eqn 3.20 in Lipsey & Wilson
+    (esL, varL) = cohens_d(Mean1=mean1V, Mean2=mean2V, N1=n1V, N2=n2V, Sd1=sd1V, Sd2=sd2V)
+    varEsL = effect_size_variance(Es=esL, N1=n1V, N2=n2V)   # eq:se_sm in latex notes
+
+    fixed  = fixed_effect(EsV=esL, VarV=varEsL)     # Eqn 13-15 in latex., p114 in Lipsey & Wilson
+    random = random_effects(EsV=esL, VarV=varEsL)   # DerSimonian-Laird
     print("\n\n---------------------------------------------------------"
           "-----------------------------------")
     print("########## SECTION 4 ##########")
     print("---------------------------------------------------------"
           "-----------------------------------")
-    print("{:<10} {:<8} {:<8} {:<12} {:<8}".format("study",
-          "N_treat", "N_wt", "Effect_Size", "Var") )
-    for idx in range(len(studySizeLL)):
-        print("{:<10} {:<8} {:<8} {:<12.6f} {:<8.6f}".format("study_{}".format(idx),
-              studySizeLL[idx][0], studySizeLL[idx][1], esL[idx], varL[idx]))
+    print("{:<10} {:<8} {:<8} {:<12} {:<10} {:<10}".format("study",
+          "N_treat", "N_wt", "Effect_Size", "Var_pooled", "Var_ES") )
+    studyD = store_table(Results=Results, Table="meta_studies", ColumnD={
+                         "study" : np.arange(len(studySizeLL)), "n_treat" : n1V,
+                         "n_wt" : n2V, "es" : esL, "var_pooled" : varL, "var_es" : varEsL})
+    for idx in studyD["study"]:
+        print("{:<10} {:<8} {:<8} {:<12.6f} {:<10.6f} {:<10.6f}".format(
+              "study_{}".format(idx), studyD["n_treat"][idx], studyD["n_wt"][idx],
+              studyD["es"][idx], studyD["var_pooled"][idx], studyD["var_es"][idx]))
           
-    print("Total Effect Size = {:<10.6f}; 95% CI = [{:<10.6f}, {:<10.6f}]\n".format(meanES,
-         lower, upper))
-        
-    
-    
+    pooledD = store_table(Results=Results, Table="meta_pooled", ColumnD={
+                          "model" : np.array(["fixed", "random"]),
+                          "es"    : np.array([fixed["es"], random["es"]]),
+                          "lower" : np.array([fixed["lower"], random["lower"]]),
+                          "upper" : np.array([fixed["upper"], random["upper"]]),
+                          "q"     : np.array([fixed["q"], random["q"]]),
+                          "k"     : np.array([fixed["k"], random["k"]]),
+                          "tau2"  : np.array([0.0, random["tau2"]]),
+                          "i2"    : np.array([0.0, random["i2"]])})
+    print("Fixed effect  : Total Effect Size = {:<10.6f}; 95% CI = [{:<10.6f}, {:<10.6f}]"
+          "".format(pooledD["es"][0], pooledD["lower"][0], pooledD["upper"][0]))
+    print("Random effect : Total Effect Size = {:<10.6f}; 95% CI = [{:<10.6f}, {:<10.6f}]"
+          "".format(pooledD["es"][1], pooledD["lower"][1], pooledD["upper"][1]))
+    print("Heterogeneity : Q = {:<.4f} (k-1 = {}); tau^2 = {:<.6f}; I^2 = {:<.4f}\n".format(
+          pooledD["q"][1], pooledD["k"][1] - 1, pooledD["tau2"][1], pooledD["i2"][1]))
+
+    ### Sensitivity analyses, from running sums of the weights (see meta.py) ###
+    cumD = cumulative_meta(EsV=esL, VarV=varEsL, Random=True)
+    looD = leave_one_out_meta(EsV=esL, VarV=varEsL, Random=True)
+    sensL = [("Cumulative, in study order", "up to", "meta_cumulative", cumD),
+             ("Leave one out", "without", "meta_leave_one_out", looD)]
+    if(len(studySizeLL) < 2):
+        # Leaving out the only study leaves nothing to pool
+        sensL = sensL[:1]
+    for (title, label, table, tableD) in sensL:
+        tableD = store_table(Results=Results, Table=table, ColumnD={"study" :
+                             np.arange(len(studySizeLL)), **{name : tableD[name] for name
+                             in ["es", "lower", "upper", "random_es", "tau2", "i2"]}})
+        print("{} :".format(title))
+        print("{:<18} {:<12} {:<24} {:<12} {:<10} {:<10}".format("studies", "Fixed_ES",
+              "Fixed_95%_CI", "Random_ES", "tau^2", "I^2"))
+        for idx in range(len(studySizeLL)):
+            print("{:<18} {:<12.6f} [{:<9.6f}, {:<9.6f}]  {:<12.6f} {:<10.6f} {:<10.4f}"
+                  "".format("{} study_{}".format(label, idx), tableD["es"][idx],
+                  tableD["lower"][idx], tableD["upper"][idx], tableD["random_es"][idx],
+                  tableD["tau2"][idx], tableD["i2"][idx]))
+        print("")
+    if(len(studySizeLL) < 2):
+        print("Leave one out : needs 2 or more studies, skipped\n")
+
+    ### Bootstrap CIs, not necessarily symmetric about the pooled effect ###
+    if(Args.bootstrap > 0):
+        from scheduler import child_seed
+        from sweeps import pooled_bootstrap_sweep
+        from bootstrap import bootstrap_ci
+        bootD = pooled_bootstrap_sweep(Sched=Sched, Samp1V=samp1V, Samp2V=samp2V, N1V=n1V,
+                                       N2V=n2V, NRep=Args.bootstrap,
+                                       SeedSeq=child_seed(SeedSeq=SeedD["meta"], Key=(0,)),
+                                       ChunkSize=Args.chunk_size,
+                                       Resample=Args.bootstrap_resample)
+        store_table(Results=Results, Table="meta_bootstrap", ColumnD=bootD)
+        print("Bootstrap : {} replicates, resampling {}".format(Args.bootstrap,
+              Args.bootstrap_resample))
+        ciL = []
+        for (pooled, bootName, jackV) in [(fixed, "fixed", looD["es"]),
+                                          (random, "random", looD["random_es"])]:
+            ciL += [bootstrap_ci(BootV=bootD[bootName], Estimate=pooled["es"], Method=method,
+                                 JackknifeV=jackV) for method in ["percentile", "bca"]]
+        ciD = store_table(Results=Results, Table="meta_bootstrap_ci", ColumnD={
+                          "model"  : np.array(["fixed", "fixed", "random", "random"]),
+                          "method" : np.array(["percentile", "bca"] * 2),
+                          "lower"  : np.array([ci[0] for ci in ciL]),
+                          "upper"  : np.array([ci[1] for ci in ciL])})
+        for (row, name) in [(0, "Fixed effect "), (2, "Random effect")]:
+            print("{} : percentile 95% CI = [{:<10.6f}, {:<10.6f}]; BCa 95% CI = "
+                  "[{:<10.6f}, {:<10.6f}]".format(name, ciD["lower"][row], ciD["upper"][row],
+                  ciD["lower"][row + 1], ciD["upper"][row + 1]))
+        print("")
+        if(Args.plot_dir is not None):
+            from accumulator import StreamingHistogram
+            write_plots(Args=Args, Prefix="meta", HistD={"bootstrap_{}".format(name) :
+                        (StreamingHistogram(NBins=Args.plot_bins).update(bootD[name]),
+                         "Bootstrap, {} effect, {} replicates".format(name, Args.bootstrap),
+                         "pooled effect size") for name in ["fixed", "random"]})
+
+
+def section_power(Args=None, PopD=None, SeedD=None, Sched=None, Results=None,
+                  Checkpoint=None):
+    """
+    ARGS:
+        Args  : argparse.Namespace
+        PopD  : dict from build_populations(), unused
+        SeedD : dict from spawn_run_seeds()
+        Sched : scheduler.Scheduler
+        Results : results.ResultsStore to store the tables in, or None
+        Checkpoint : checkpoint.Checkpoint of the run, or None
+    RETURN:
+    DESCRIPTION:
+        Section 5 : power of Student's and Welch's t-tests over a grid of 
+        effect size, sd ratio and nSamp, then the minimum nSamp reaching
+        --power-target. See power.py
+    DEBUG:
+    FUTURE:
+    """
+    import numpy as np
+    from power import power_grid
+    from power import min_sample_size
+    from power import POWER_TEST_L
+    esL    = Args.power_es
+    ratioL = Args.power_sd_ratio
+    if(esL is None):
+        esL = [(Args.mu2 - Args.mu1) / Args.s1]
+    if(ratioL is None):
+        ratioL = [Args.s2 / Args.s1]
+    kwargD = {"HalfWidth" : Args.power_ci, "MaxExp" : Args.power_max_nexp,
+              "ChunkSize" : Args.chunk_size,
+              "PvalueMethod" : Args.pvalue_method}
+    print("\n\n---------------------------------------------------------"
+          "-----------------------------------")
+    print("########## SECTION 5 ##########")
+    print("# Power (fraction of p < .05), each cell stops once its 95% CI is "
+          "within +/- {}".format(Args.power_ci))
+    print("---------------------------------------------------------"
+          "-----------------------------------")
+    print("{:<9}{:<10}{:<7}{:<9}{:<10}{:<10}{:<10}{:<10}".format("effect", "sd_ratio",
+          "nSamp", "nExp", "power(S)", "+/-", "power(W)", "+/-"))
+    gridL = power_grid(Sched=Sched, EffectSizeL=esL, SdRatioL=ratioL,
+                       NSampL=Args.power_nsamp, SeedSeq=SeedD["power"], **kwargD)
+    gridD = {"es"       : np.array([key[0] for (key, result) in gridL]),
+             "sd_ratio" : np.array([key[1] for (key, result) in gridL]),
+             "nsamp"    : np.array([key[2] for (key, result) in gridL]),
+             "nexp"     : np.array([result["nexp"] for (key, result) in gridL]),
+             "stop"     : np.array([result["stop"] for (key, result) in gridL])}
+    for test in POWER_TEST_L:
+        for name in ["power", "lower", "upper"]:
+            gridD["{}_{}".format(name, test)] = np.array([result[name][test] for (key, result)
+                                                          in gridL])
+    gridD = store_table(Results=Results, Table="power_grid", ColumnD=gridD)
+    for row in range(len(gridL)):
+        halfD = {test : (gridD["upper_" + test][row] - gridD["lower_" + test][row]) / 2.0
+                 for test in POWER_TEST_L}
+        print("{:<9.3f}{:<10.3f}{:<7}{:<9}{:<10.4f}{:<10.4f}{:<10.4f}{:<10.4f}".format(
+              gridD["es"][row], gridD["sd_ratio"][row], gridD["nsamp"][row],
+              gridD["nexp"][row], gridD["power_student"][row], halfD["student"],
+              gridD["power_welch"][row], halfD["welch"]))
+    nExp   = int(np.sum(gridD["nexp"]))
+    budget = len(gridL) * Args.power_max_nexp
+    print("Experiments run : {} of a fixed budget of {} ({:.1f}%)".format(nExp, budget,
+          100.0 * nExp / budget))
+
+    ### Minimum nSamp reaching the target power ###
+    searchL = [(es, ratio, test) for es in esL for ratio in ratioL for test in POWER_TEST_L]
+    minL = min_sample_size(Sched=Sched, SearchL=searchL, TargetPower=Args.power_target,
+                           NMin=2, NMax=Args.power_nmax, SeedSeq=SeedD["power"], **kwargD)
+    print("\nMinimum nSamp per group for power >= {}".format(Args.power_target))
+    print("{:<9}{:<10}{:<9}{:<8}{:<9}{:<9}{:<9}".format("effect", "sd_ratio", "test",
+          "nSamp", "power", "probes", "nExp"))
+    # nsamp = -1 when even --power-nmax falls short
+    minD = store_table(Results=Results, Table="power_min_nsamp", ColumnD={
+                       "es"       : np.array([key[0] for key in searchL]),
+                       "sd_ratio" : np.array([key[1] for key in searchL]),
+                       "test"     : np.array([key[2] for key in searchL]),
+                       "nsamp"    : np.array([-1 if result["nsamp"] is None else
+                                              result["nsamp"] for result in minL]),
+                       "power"    : np.array([result["power"] for result in minL]),
+                       "probes"   : np.array([len(result["probe"]) for result in minL]),
+                       "nexp"     : np.array([result["nexp"] for result in minL])})
+    for row in range(len(searchL)):
+        nSamp = minD["nsamp"][row]
+        nSamp = ">{}".format(Args.power_nmax) if nSamp < 0 else nSamp
+        print("{:<9.3f}{:<10.3f}{:<9}{:<8}{:<9.4f}{:<9}{:<9}".format(minD["es"][row],
+              minD["sd_ratio"][row], minD["test"][row], nSamp, minD["power"][row],
+              minD["probes"][row], minD["nexp"][row]))
+    print("")
+
+
+### Section name -> (function, populations it needs)
+SECTION_D = {"stderr"       : (section_stderr,       ["pop2"]),
+             "tscore"       : (section_tscore,       ["pop1", "pop2"]),
+             "pvalue-sweep" : (section_pvalue_sweep, ["pop1", "pop2"]),
+             "meta"         : (section_meta,         ["pop1", "pop2"]),
+             "power"        : (section_power,        [])}
+
+
+
+def main():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+        Heavy modules (numpy, the sweeps, multiprocessing) are imported only 
+        once a section is actually run, matplotlib is only imported by 
+        plotting.py. So './src/main.py -h' starts in a few tens of ms.
+
+        --profile / --profile-cprofile enable the profiler before the
+        instrumented modules are imported, without them nothing is wrapped.
+    DEBUG:
+        1. Wall time of './src/main.py -h', best of 7 :
+           all imports at the top of main.py : ~870 ms
+           lazy imports                      :  ~46 ms
+    FUTURE:
+    """
+    if(sys.version_info[0] < 3):
+        exit_with_error("ERROR!!! Runs with python3, NOT {}\n".format(sys.argv[0]))
+    args = parse_args(sys.argv[1:])
+    profile = args.profile is not None or args.profile_cprofile is not None
+    import profiler
+    if(profile):
+        # Before anything instrumented is imported, see profiler.counted()
+        profiler.enable()
+    from scheduler import Scheduler
+    sectionL = SECTION_L if args.section == "all" else [args.section]
+    seedD = spawn_run_seeds(Seed=args.seed)
+    if(args.resume and args.checkpoint is None):
+        exit_with_error("ERROR!!! --resume needs --checkpoint FILE\n")
+    if(args.resume and getattr(args, "multitest", False) and args.results is None):
+        # The tasks done before the restart aren't rerun, their p-values are only in --results
+        exit_with_error("ERROR!!! --resume with --multitest needs --results DIR\n")
+    ckpt = None
+    if(args.checkpoint is not None):
+        from checkpoint import Checkpoint
+        ckpt = Checkpoint(Path=args.checkpoint, Interval=args.checkpoint_interval,
+                          ConfigD={key : value for (key, value) in vars(args).items()
+                                   if key not in RESUME_FREE_L},
+                          Resume=args.resume)
+    results = None
+    if(args.results is not None):
+        from results import ResultsStore
+        results = ResultsStore(Dir=args.results, Append=args.results_append)
+        if(args.resume):
+            results.resume_run()
+        else:
+            results.start_run(MetaD={"argv" : sys.argv, "seed" : args.seed})
+
+    ### Create the population distributions, draw our experimental samples from these ###
+    popNameL = sorted(set(name for section in sectionL for name in SECTION_D[section][1]))
+    cProf = None
+    if(args.profile_cprofile is not None):
+        import cProfile
+        cProf = cProfile.Profile()
+        cProf.enable()
+    with profiler.section(Name="populations"):
+        popD = build_populations(Args=args, SeedD=seedD, NameL=popNameL)
+    print("\n---------------------------------------------------------")
+    print("Population 1 : [mu,sd] = [{:<.3f},{:<.3f}]\n"
+          "Population 2 : [mu,sd] = [{:<.3f},{:<.3f}]\n".format(args.mu1,args.s1,
+          args.mu2,args.s2))
+    with Scheduler(Workers=args.workers, PopD=popD) as sched:
+        for section in sectionL:
+            with profiler.section(Name=section):
+                SECTION_D[section][0](Args=args, PopD=popD, SeedD=seedD, Sched=sched,
+                                      Results=results, Checkpoint=ckpt)
+    if(cProf is not None):
+        cProf.disable()
+        cProf.dump_stats(args.profile_cprofile)
+    if(args.profile is not None):
+        profiler.write_report(Path=args.profile, MetaD={"argv" : sys.argv,
+                              "workers" : sched.workers, "seed" : args.seed})
 
-    
 
 
 if __name__ == "__main__":
     main()
-
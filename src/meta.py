@@ -0,0 +1,467 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Meta-analysis of effect sizes, following Ch. 6 of Practical Meta-Analysis
+#   by Lipsey and Wilson (see notes/practical_meta_analysis.md).
+#
+#   Everything works on arrays. The studies lie along the last axis, any
+#   leading axes are independent meta-analyses. So pooling 10^6 studies is
+#   one call on a (10^6,) array and 10^4 simulated meta-analyses of k
+#   studies is one call on a (10^4, k) array.
+#
+# Future:
+#
+import numpy as np
+from error import exit_with_error
+
+Z_CRIT = 1.96           # Critical value for z-distribution, with alpha = 0.05
+
+
+
+def pooled_variance(N1=None, N2=None, Sd1=None, Sd2=None):
+    """
+    ARGS:
+        N1, N2   : sample sizes of the treatment and control groups
+        Sd1, Sd2 : stdevs of the treatment and control groups
+    RETURN:
+        pooled variance, sp**2. Arrays in -> array out
+    DESCRIPTION:
+        Eqn 3.20 in Lipsey & Wilson
+            sp = sqrt( ( (n1 - 1) s1**2 + (n2 - 1)s2**2 ) / ( (n1 - 1) + (n2 - 1)))
+    DEBUG:
+    FUTURE:
+    """
+    return(((N1 - 1)*Sd1**2 + (N2 - 1)*Sd2**2) / ((N1 - 1) + (N2 - 1)))
+
+
+
+def cohens_d(Mean1=None, Mean2=None, N1=None, N2=None, Sd1=None, Sd2=None):
+    """
+    ARGS:
+        Mean1, Mean2 : means of the treatment and control groups
+        N1, N2       : sample sizes
+        Sd1, Sd2     : stdevs
+    RETURN:
+        es  : standardized mean difference (Cohen's d)
+        var : pooled variance used to standardize it, sp**2
+    DESCRIPTION:
+        Eqn 3.21 in Lipsey & Wilson, eq 7 latex notes
+            ES = (mean1 - mean2) / sp
+    DEBUG:
+    FUTURE:
+    """
+    var = pooled_variance(N1=N1, N2=N2, Sd1=Sd1, Sd2=Sd2)
+    es  = (Mean1 - Mean2) / np.sqrt(var)
+    return(es, var)
+
+
+
+def group_mean_std(SampV=None, NV=None):
+    """
+    ARGS:
+        SampV : 1D array, the samples of several groups one after another
+        NV    : 1D int array, number of samples in each group
+    RETURN:
+        meanV, sdV : mean and stdev (np.std, ddof=0) of each group
+    DESCRIPTION:
+        Ragged groups (e.g. the studies in Section 4) reduced without a python
+        loop, using np.add.reduceat over the group offsets. The stdev is done 
+        in two passes (deviations from the group mean) for accuracy.
+    DEBUG:
+        1. Matches np.mean() / np.std() of each group to ~1e-16
+    FUTURE:
+    """
+    NV = np.asarray(NV)
+    offsetV = np.concatenate(([0], np.cumsum(NV)[:-1]))
+    meanV = np.add.reduceat(SampV, offsetV, dtype=np.float64) / NV
+    devV  = SampV - np.repeat(meanV, NV)
+    sdV   = np.sqrt(np.add.reduceat(devV**2, offsetV) / NV)
+    return(meanV, sdV)
+
+
+
+def effect_size_variance(Es=None, N1=None, N2=None):
+    """
+    ARGS:
+        Es     : standardized mean difference(s)
+        N1, N2 : sample sizes of the treatment and control groups
+    RETURN:
+        sampling variance of Es, i.e. SE_sm**2 (eq:se_sm in the latex notes)
+            var = (n1 + n2) / (n1 n2) + Es**2 / (2 (n1 + n2))
+    DESCRIPTION:
+        The inverse variance weight is w = 1 / var (eq:w_sm)
+    DEBUG:
+    FUTURE:
+    """
+    return((N1 + N2) / (N1 * N2) + Es**2 / (2.0 * (N1 + N2)))
+
+
+
+def fixed_effect(EsV=None, VarV=None, Z=Z_CRIT):
+    """
+    ARGS:
+        EsV  : effect sizes, studies along the last axis
+        VarV : sampling variances of EsV, same shape
+        Z    : critical value of the z-distribution for the CI
+    RETURN:
+        dict, each entry has the shape of EsV minus its last axis :
+            es    : inverse variance weighted mean effect size (eq:es_gen)
+            se    : its standard error, sqrt(1 / sum(w))  (eq:se_es)
+            lower : es - Z*se
+            upper : es + Z*se
+            q     : homogeneity statistic Q (eq:q2)
+            k     : number of studies
+    DESCRIPTION:
+        Inverse variance weighted fixed effect model, p114 of Lipsey & Wilson.
+        Q is clamped at 0 (round off can make it slightly negative) and is 0
+        for a single study, as in _pool_from_sums().
+    DEBUG:
+    FUTURE:
+    """
+    EsV  = np.asarray(EsV, dtype=np.float64)
+    VarV = np.asarray(VarV, dtype=np.float64)
+    wV   = 1.0 / VarV
+    sumW   = np.sum(wV, axis=-1)
+    sumWEs = np.sum(wV * EsV, axis=-1)
+    sumWEs2= np.sum(wV * EsV**2, axis=-1)
+    es  = sumWEs / sumW
+    se  = np.sqrt(1.0 / sumW)
+    q   = np.where(EsV.shape[-1] > 1, np.maximum(0.0, sumWEs2 - sumWEs**2 / sumW), 0.0)[()]
+    return({"es" : es, "se" : se, "lower" : es - Z*se, "upper" : es + Z*se,
+            "q" : q, "k" : EsV.shape[-1]})
+
+
+
+def random_effects(EsV=None, VarV=None, Z=Z_CRIT):
+    """
+    ARGS:
+        EsV  : effect sizes, studies along the last axis
+        VarV : sampling variances of EsV, same shape
+        Z    : critical value of the z-distribution for the CI
+    RETURN:
+        dict, each entry has the shape of EsV minus its last axis :
+            es    : random effects weighted mean effect size
+            se    : its standard error, sqrt(1 / sum(w*))
+            lower : es - Z*se
+            upper : es + Z*se
+            q     : homogeneity statistic Q of the fixed effect model
+            tau2  : between studies variance, sigma_theta**2
+            i2    : fraction of the variation due to heterogeneity,
+                    I**2 = max(0, (Q - (k-1)) / Q)
+            k     : number of studies
+    DESCRIPTION:
+        DerSimonian-Laird method of moments, Ch. 6 of Lipsey & Wilson
+            tau2 = (Q - (k - 1)) / (sum(w) - sum(w**2) / sum(w))
+        set to 0 if negative, and for a single study (0 / 0). The studies
+        are then reweighted with
+            w* = 1 / (var + tau2)
+    DEBUG:
+        1. tau2 = 0 (Q < k-1) reduces to fixed_effect()
+    FUTURE:
+    """
+    EsV  = np.asarray(EsV, dtype=np.float64)
+    VarV = np.asarray(VarV, dtype=np.float64)
+    k    = EsV.shape[-1]
+    fixed = fixed_effect(EsV=EsV, VarV=VarV, Z=Z)
+    wV    = 1.0 / VarV
+    sumW  = np.sum(wV, axis=-1)
+    sumW2 = np.sum(wV**2, axis=-1)
+    q     = fixed["q"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tau2 = np.where(k > 1, np.maximum(0.0, (q - (k - 1)) / (sumW - sumW2 / sumW)),
+                        0.0)[()]
+        i2 = np.where(q > 0, np.maximum(0.0, (q - (k - 1)) / q), 0.0)[()]
+    wStarV = 1.0 / (VarV + np.expand_dims(tau2, -1))
+    sumWStar = np.sum(wStarV, axis=-1)
+    es  = np.sum(wStarV * EsV, axis=-1) / sumWStar
+    se  = np.sqrt(1.0 / sumWStar)
+    return({"es" : es, "se" : se, "lower" : es - Z*se, "upper" : es + Z*se,
+            "q" : q, "tau2" : tau2, "i2" : i2, "k" : k})
+
+
+
+def _pool_from_sums(SumW=None, SumWEs=None, SumWEs2=None, SumW2=None, K=None, Z=Z_CRIT):
+    """
+    ARGS:
+        SumW, SumWEs, SumWEs2, SumW2 : sums over the studies of w, w*es,
+                                       w*es**2 and w**2, with w = 1 / var
+        K : number of studies
+        Z : critical value of the z-distribution for the CI
+    RETURN:
+        dict with es, se, lower, upper, q (fixed effect model) and tau2, i2
+        (DerSimonian-Laird), k. Arrays in -> arrays out
+    DESCRIPTION:
+        Everything fixed_effect() and random_effects() compute that only
+        needs the four sums, i.e. all but the random effects mean. Meta-
+        analyses of a single study have q = tau2 = i2 = 0.
+
+        Careful, q is a difference of two large sums. When the sums come from
+        removing studies (see IncrementalMeta, leave_one_out_meta()) it loses
+        ~ log10(sum(w es**2) / q) digits to cancellation.
+    DEBUG:
+    FUTURE:
+    """
+    SumW = np.asarray(SumW, dtype=np.float64)
+    K    = np.asarray(K)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        es   = SumWEs / SumW
+        se   = np.sqrt(1.0 / SumW)
+        q    = np.where(K > 1, np.maximum(0.0, SumWEs2 - SumWEs**2 / SumW), 0.0)
+        tau2 = np.where(K > 1, np.maximum(0.0, (q - (K - 1)) / (SumW - SumW2 / SumW)), 0.0)
+        i2   = np.where(q > 0, np.maximum(0.0, (q - (K - 1)) / q), 0.0)
+    return({"es" : es[()], "se" : se[()], "lower" : (es - Z*se)[()],
+            "upper" : (es + Z*se)[()], "q" : q[()], "tau2" : tau2[()], "i2" : i2[()],
+            "k" : K[()]})
+
+
+
+def _random_effects_masked(EsV=None, VarV=None, Tau2V=None, MaskFunction=None, Z=Z_CRIT,
+                           ChunkCells=2**22):
+    """
+    ARGS:
+        EsV, VarV    : effect sizes and their variances, studies along the last axis
+        Tau2V        : between studies variance of each variant, shape of EsV
+        MaskFunction : function (Start, Stop) -> (Stop - Start, k) bool,
+                       rows Start..Stop-1 of the mask, [i,j] = study j is in
+                       variant i
+        Z            : critical value of the z-distribution for the CI
+        ChunkCells   : max weights (variants x studies) computed at a time,
+                       bounds memory
+    RETURN:
+        es, se, lower, upper of the random effects model of each variant
+    DESCRIPTION:
+        The weights w* = 1 / (var + tau2) depend on each variant's tau2, so
+        unlike the fixed effect model this can't come from running sums, it
+        is O(k) per variant. Done a chunk of variants at a time, only the
+        chunk's rows of the (k, k) mask are ever built. A variant without
+        studies (leave one out of a single study) is nan.
+    DEBUG:
+    FUTURE:
+    """
+    k  = EsV.shape[-1]
+    es = np.empty(Tau2V.shape)
+    se = np.empty(Tau2V.shape)
+    chunk = max(1, ChunkCells // max(EsV.size, 1))
+    for start in range(0, k, chunk):
+        stop = min(k, start + chunk)
+        wM = MaskFunction(start, stop) / (VarV[...,np.newaxis,:] +
+                                          Tau2V[...,start:stop,np.newaxis])
+        sumW = np.sum(wM, axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            es[...,start:stop] = np.sum(wM * EsV[...,np.newaxis,:], axis=-1) / sumW
+            se[...,start:stop] = np.where(sumW > 0, np.sqrt(1.0 / sumW), np.nan)
+    return(es, se, es - Z*se, es + Z*se)
+
+
+
+def cumulative_meta(EsV=None, VarV=None, Z=Z_CRIT, Random=False):
+    """
+    ARGS:
+        EsV    : effect sizes, studies along the last axis in publication order
+        VarV   : sampling variances of EsV, same shape
+        Z      : critical value of the z-distribution for the CI
+        Random : bool, also compute the random effects means (O(k**2))
+    RETURN:
+        dict like _pool_from_sums(), entry [..., i] is the meta-analysis of
+        studies 0..i. With Random, also random_es, random_se, random_lower
+        and random_upper
+    DESCRIPTION:
+        Cumulative meta-analysis from running sums (np.cumsum), O(k) for all
+        k rows instead of redoing fixed_effect() / random_effects() per row.
+    DEBUG:
+        1. Each row matches fixed_effect() / random_effects() on EsV[:i+1]
+    FUTURE:
+    """
+    EsV  = np.asarray(EsV, dtype=np.float64)
+    VarV = np.asarray(VarV, dtype=np.float64)
+    wV   = 1.0 / VarV
+    k    = EsV.shape[-1]
+    outD = _pool_from_sums(SumW=np.cumsum(wV, axis=-1), SumWEs=np.cumsum(wV*EsV, axis=-1),
+                           SumWEs2=np.cumsum(wV*EsV**2, axis=-1),
+                           SumW2=np.cumsum(wV**2, axis=-1), K=np.arange(1, k+1), Z=Z)
+    if(Random):
+        # Row i : studies 0..i
+        def mask(Start, Stop):
+            return(np.arange(k)[np.newaxis,:] <= np.arange(Start, Stop)[:,np.newaxis])
+        (outD["random_es"], outD["random_se"], outD["random_lower"],
+         outD["random_upper"]) = _random_effects_masked(EsV=EsV, VarV=VarV,
+                                   Tau2V=outD["tau2"], MaskFunction=mask, Z=Z)
+    return(outD)
+
+
+
+def leave_one_out_meta(EsV=None, VarV=None, Z=Z_CRIT, Random=False):
+    """
+    ARGS:
+        EsV    : effect sizes, studies along the last axis
+        VarV   : sampling variances of EsV, same shape
+        Z      : critical value of the z-distribution for the CI
+        Random : bool, also compute the random effects means (O(k**2))
+    RETURN:
+        dict like _pool_from_sums(), entry [..., i] is the meta-analysis of
+        every study but i. With Random, also random_es, random_se,
+        random_lower and random_upper
+    DESCRIPTION:
+        Sensitivity analysis. The totals are computed once and each study's
+        own terms subtracted, O(k) for all k rows.
+    DEBUG:
+        1. Each row matches fixed_effect() / random_effects() on
+           np.delete(EsV, i)
+    FUTURE:
+    """
+    EsV  = np.asarray(EsV, dtype=np.float64)
+    VarV = np.asarray(VarV, dtype=np.float64)
+    wV   = 1.0 / VarV
+    k    = EsV.shape[-1]
+    def total_minus_own(X):
+        return(np.sum(X, axis=-1, keepdims=True) - X)
+    outD = _pool_from_sums(SumW=total_minus_own(wV), SumWEs=total_minus_own(wV*EsV),
+                           SumWEs2=total_minus_own(wV*EsV**2),
+                           SumW2=total_minus_own(wV**2), K=np.full(k, k-1), Z=Z)
+    if(Random):
+        # Row i : every study but i
+        def mask(Start, Stop):
+            return(np.arange(k)[np.newaxis,:] != np.arange(Start, Stop)[:,np.newaxis])
+        (outD["random_es"], outD["random_se"], outD["random_lower"],
+         outD["random_upper"]) = _random_effects_masked(EsV=EsV, VarV=VarV,
+                                   Tau2V=outD["tau2"], MaskFunction=mask, Z=Z)
+    return(outD)
+
+
+
+class IncrementalMeta:
+    """
+    Meta-analysis that studies can be added to and removed from, e.g.
+
+        meta = IncrementalMeta()
+        idL  = [meta.add_study(Mean1=m1, Mean2=m2, N1=n1, N2=n2, Sd1=s1, Sd2=s2)
+                for (m1, m2, n1, n2, s1, s2) in studyL]
+        meta.remove(Id=idL[3])
+        meta.fixed()            # es, se, CI, q, tau2, i2 in O(1)
+        meta.random()           # random effects mean, O(k)
+
+    Keeps the running sums of w, w*es, w*es**2 and w**2 (w = 1 / var) that
+    fixed_effect() and random_effects() reduce over, so add() / remove() and
+    fixed() are O(1). The studies are kept too, only random() reads them.
+    """
+    def __init__(self, Z=Z_CRIT):
+        """
+        ARGS:
+            Z : critical value of the z-distribution for the CI
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        self.z       = Z
+        self.k       = 0
+        self.sumW    = 0.0
+        self.sumWEs  = 0.0
+        self.sumWEs2 = 0.0
+        self.sumW2   = 0.0
+        self.studyD  = {}           # id -> (es, var)
+        self.nextId  = 0
+
+
+    def add(self, Es=None, Var=None):
+        """
+        ARGS:
+            Es  : effect size of the study
+            Var : its sampling variance, see effect_size_variance()
+        RETURN:
+            id of the study, for remove()
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        w = 1.0 / Var
+        self.sumW    += w
+        self.sumWEs  += w * Es
+        self.sumWEs2 += w * Es**2
+        self.sumW2   += w**2
+        self.k       += 1
+        studyId = self.nextId
+        self.studyD[studyId] = (float(Es), float(Var))
+        self.nextId += 1
+        return(studyId)
+
+
+    def add_study(self, Mean1=None, Mean2=None, N1=None, N2=None, Sd1=None, Sd2=None):
+        """
+        ARGS:
+            see cohens_d()
+        RETURN:
+            id of the study, for remove()
+        DESCRIPTION:
+            Effect size from cohens_d() (eqs 3.20 / 3.21 in Lipsey & Wilson),
+            its variance from effect_size_variance()
+        DEBUG:
+        FUTURE:
+        """
+        (es, var) = cohens_d(Mean1=Mean1, Mean2=Mean2, N1=N1, N2=N2, Sd1=Sd1, Sd2=Sd2)
+        return(self.add(Es=es, Var=effect_size_variance(Es=es, N1=N1, N2=N2)))
+
+
+    def remove(self, Id=None):
+        """
+        ARGS:
+            Id : from add() / add_study()
+        RETURN:
+            (es, var) of the removed study
+        DESCRIPTION:
+            Subtracts the study's terms from the sums. Removing every study
+            resets the sums to exactly 0 so round off doesn't pile up.
+        DEBUG:
+        FUTURE:
+        """
+        if(Id not in self.studyD):
+            exit_with_error("ERROR!!! no study with id {}\n".format(Id))
+        (es, var) = self.studyD.pop(Id)
+        w = 1.0 / var
+        self.sumW    -= w
+        self.sumWEs  -= w * es
+        self.sumWEs2 -= w * es**2
+        self.sumW2   -= w**2
+        self.k       -= 1
+        if(self.k == 0):
+            (self.sumW, self.sumWEs, self.sumWEs2, self.sumW2) = (0.0, 0.0, 0.0, 0.0)
+        return(es, var)
+
+
+    def fixed(self):
+        """
+        ARGS:
+        RETURN:
+            dict, see _pool_from_sums()
+        DESCRIPTION:
+            O(1)
+        DEBUG:
+        FUTURE:
+        """
+        if(self.k == 0):
+            exit_with_error("ERROR!!! meta-analysis has no studies\n")
+        return(_pool_from_sums(SumW=self.sumW, SumWEs=self.sumWEs, SumWEs2=self.sumWEs2,
+                               SumW2=self.sumW2, K=self.k, Z=self.z))
+
+
+    def random(self):
+        """
+        ARGS:
+        RETURN:
+            dict, same entries as random_effects()
+        DESCRIPTION:
+            tau2 comes from the running sums, the reweighting with
+            w* = 1 / (var + tau2) has to visit every study, O(k)
+        DEBUG:
+        FUTURE:
+        """
+        outD = self.fixed()
+        (esV, varV) = np.array(list(self.studyD.values())).T
+        wStarV   = 1.0 / (varV + outD["tau2"])
+        sumWStar = np.sum(wStarV)
+        es = np.sum(wStarV * esV) / sumWStar
+        se = np.sqrt(1.0 / sumWStar)
+        outD.update({"es" : es, "se" : se, "lower" : es - self.z*se,
+                     "upper" : es + self.z*se})
+        return(outD)
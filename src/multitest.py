@@ -0,0 +1,299 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Multiple testing corrections of p-values. Section 3 reports the raw
+#   frac<.05, but run over nExp experiments, p < .05 alone is expected to
+#   flag 5% of them even when no null is false.
+#
+#   Methods (adjusted p-values, reject where adjusted <= alpha) :
+#       bonferroni : min(1, n p)                                  FWER
+#       holm       : step down, max_{j<=i} min(1, (n-j+1) p_(j))  FWER
+#       bh         : Benjamini-Hochberg step up,
+#                    min_{j>=i} min(1, n p_(j) / j)               FDR
+#       by         : Benjamini-Yekutieli, bh times sum_{k=1}^n 1/k,
+#                    FDR under any dependence
+#   p_(j) is the j-th smallest p-value. One sort, O(n log n), then a
+#   cumulative max / min, O(n).
+#
+#   1. adjust_pvalues() : arrays that fit in memory
+#   2. adjust_pvalues_chunked() : p-values streamed as chunks (e.g. the
+#      memory maps of a results.ResultsStore column), external sort. Each
+#      run of ~ChunkSize values is sorted and spilled to disk, the runs are
+#      merged block by block into a memory mapped sorted array, and the
+#      cumulative max / min is carried across blocks. Memory is
+#      O(ChunkSize + number of runs * block), independent of n.
+#
+# Future:
+#
+import os
+import tempfile
+import numpy as np
+from error import exit_with_error
+
+MULTITEST_METHOD_L = ["bonferroni", "holm", "bh", "by"]
+MULTITEST_CHUNK    = 2**20      # Values sorted in memory at a time by the chunked mode
+MULTITEST_BLOCK    = 2**16      # Values read from each sorted run at a time when merging
+
+
+
+def _by_factor(N=None):
+    """
+    ARGS:
+        N : int, number of p-values
+    RETURN:
+        sum_{k=1}^N 1/k, Benjamini-Yekutieli's correction of BH
+    DESCRIPTION:
+        Summed from the smallest term, in chunks, so N = 10^9 is fine
+    DEBUG:
+    FUTURE:
+    """
+    total = 0.0
+    for start in range(N, 0, -MULTITEST_CHUNK):
+        total += np.sum(1.0 / np.arange(start, max(start - MULTITEST_CHUNK, 0), -1,
+                                        dtype=np.float64))
+    return(total)
+
+
+
+def _check_method(Method=None):
+    if(Method not in MULTITEST_METHOD_L):
+        exit_with_error("ERROR!!! Method {} not in {}\n".format(Method, MULTITEST_METHOD_L))
+
+
+
+def adjust_pvalues(PV=None, Method=None):
+    """
+    ARGS:
+        PV     : array of p-values, any shape, no NaNs
+        Method : one of MULTITEST_METHOD_L
+    RETURN:
+        array of adjusted p-values, the shape of PV
+    DESCRIPTION:
+        Works directly on the pV arrays of functions.student_t_test_batch() /
+        welchs_t_test_batch(). Ties get the same adjusted p-value.
+    DEBUG:
+        1. Matches adjust_pvalues_chunked() and, for n <= 8, the definitions
+           evaluated over every subset
+    FUTURE:
+    """
+    _check_method(Method=Method)
+    pV = np.asarray(PV, dtype=np.float64)
+    shape = pV.shape
+    pV = pV.ravel()
+    n  = len(pV)
+    if(Method == "bonferroni"):
+        return(np.minimum(1.0, n * pV).reshape(shape))
+    order  = np.argsort(pV, kind="stable")
+    rankV  = np.arange(1, n + 1, dtype=np.float64)
+    factor = _by_factor(N=n) if Method == "by" else 1.0
+    adjV   = _adjust_sorted(SortedV=pV[order], RankV=rankV, N=n, Method=Method,
+                            Factor=factor)
+    outV   = np.empty(n)
+    outV[order] = adjV
+    return(outV.reshape(shape))
+
+
+
+def _adjust_sorted(SortedV=None, RankV=None, N=None, Method=None, Carry=None,
+                   Factor=1.0):
+    """
+    ARGS:
+        SortedV : block of the sorted p-values
+        RankV   : their 1 based ranks among all N
+        N       : int, total number of p-values
+        Method  : "holm", "bh" or "by"
+        Carry   : running max (holm) of the blocks before, or running min
+                  (bh, by) of the blocks after. None for the first block
+        Factor  : _by_factor() for "by", 1 otherwise
+    RETURN:
+        adjusted p-values of the block
+    DESCRIPTION:
+        holm is a cumulative max from the smallest p-value, so blocks go
+        forward. bh / by are a cumulative min from the largest, blocks go
+        backward.
+    DEBUG:
+    FUTURE:
+    """
+    if(Method == "holm"):
+        adjV = np.maximum.accumulate(np.minimum(1.0, (N - RankV + 1) * SortedV))
+        if(Carry is not None):
+            adjV = np.maximum(adjV, Carry)
+        return(adjV)
+    adjV = np.minimum.accumulate((np.minimum(1.0, Factor * N * SortedV / RankV))[::-1])[::-1]
+    if(Carry is not None):
+        adjV = np.minimum(adjV, Carry)
+    return(adjV)
+
+
+
+def reject(PV=None, Alpha=0.05, Method=None):
+    """
+    ARGS:
+        PV     : array of p-values
+        Alpha  : float, FWER (bonferroni, holm) or FDR (bh, by) level
+        Method : one of MULTITEST_METHOD_L
+    RETURN:
+        bool array, the shape of PV, True where the null is rejected
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return(adjust_pvalues(PV=PV, Method=Method) <= Alpha)
+
+
+
+def adjust_pvalues_chunked(ChunkIter=None, Method=None, Alpha=0.05, OutPath=None,
+                           TmpDir=None, ChunkSize=MULTITEST_CHUNK):
+    """
+    ARGS:
+        ChunkIter : function returning a fresh iterator over 1D arrays of
+                    p-values (chunks), e.g. lambda : (chunkD["p"] for chunkD
+                    in store.chunks(...)). Called once, twice for bonferroni
+        Method    : one of MULTITEST_METHOD_L
+        Alpha     : float, level the rejections are counted at
+        OutPath   : optional .npy file to write the adjusted p-values to, in
+                    the order of the chunks
+        TmpDir    : directory for the sorted runs, default the system's
+        ChunkSize : int, values sorted in memory at a time
+    RETURN:
+        dict :
+            n        : number of p-values
+            rejected : number with adjusted p-value <= Alpha
+            adjusted : read-only memory map of OutPath, None without it
+    DESCRIPTION:
+        External sort, see the top of the file. The runs and the merged
+        sorted array live in a temporary directory removed on return.
+    DEBUG:
+        1. 10^7 p-values, ChunkSize = 2^20 : identical to adjust_pvalues()
+    FUTURE:
+    """
+    _check_method(Method=Method)
+    if(Method == "bonferroni"):
+        n = sum(len(chunkV) for chunkV in ChunkIter())
+        outV = None
+        if(OutPath is not None):
+            outV = np.lib.format.open_memmap(OutPath, mode="w+", dtype=np.float64, shape=(n,))
+        (rejected, start) = (0, 0)
+        for chunkV in ChunkIter():
+            adjV = np.minimum(1.0, n * np.asarray(chunkV, dtype=np.float64))
+            rejected += int(np.count_nonzero(adjV <= Alpha))
+            if(outV is not None):
+                outV[start:start + len(adjV)] = adjV
+            start += len(adjV)
+        return(_chunked_result(N=n, Rejected=rejected, OutV=outV, OutPath=OutPath))
+    with tempfile.TemporaryDirectory(dir=TmpDir, prefix="multitest_") as tmpDir:
+        (runL, n) = _sorted_runs(ChunkIter=ChunkIter, ChunkSize=ChunkSize, TmpDir=tmpDir)
+        (sortedV, idxV) = _merge_runs(RunL=runL, N=n, TmpDir=tmpDir)
+        outV = None
+        if(OutPath is not None):
+            outV = np.lib.format.open_memmap(OutPath, mode="w+", dtype=np.float64, shape=(n,))
+        factor = _by_factor(N=n) if Method == "by" else 1.0
+        startL = list(range(0, n, ChunkSize))
+        if(Method != "holm"):
+            startL = startL[::-1]
+        (carry, rejected) = (None, 0)
+        for start in startL:
+            stop = min(start + ChunkSize, n)
+            adjV = _adjust_sorted(SortedV=np.asarray(sortedV[start:stop]),
+                                  RankV=np.arange(start + 1, stop + 1, dtype=np.float64),
+                                  N=n, Method=Method, Carry=carry, Factor=factor)
+            carry = adjV[-1] if Method == "holm" else adjV[0]
+            rejected += int(np.count_nonzero(adjV <= Alpha))
+            if(outV is not None):
+                outV[np.asarray(idxV[start:stop])] = adjV
+        del sortedV, idxV
+    return(_chunked_result(N=n, Rejected=rejected, OutV=outV, OutPath=OutPath))
+
+
+
+def _chunked_result(N=None, Rejected=None, OutV=None, OutPath=None):
+    adjusted = None
+    if(OutV is not None):
+        OutV.flush()
+        del OutV
+        adjusted = np.load(OutPath, mmap_mode="r")
+    return({"n" : N, "rejected" : Rejected, "adjusted" : adjusted})
+
+
+
+def _sorted_runs(ChunkIter=None, ChunkSize=None, TmpDir=None):
+    """
+    ARGS:
+        see adjust_pvalues_chunked()
+    RETURN:
+        runL : list of (values path, indices path), each run sorted
+        n    : total number of p-values
+    DESCRIPTION:
+        Chunks are gathered until ChunkSize values, sorted with their
+        positions in the stream and written out
+    DEBUG:
+    FUTURE:
+    """
+    (runL, bufL, nBuf, n) = ([], [], 0, 0)
+    def spill():
+        valueV = np.concatenate(bufL)
+        order  = np.argsort(valueV, kind="stable")
+        paths  = (os.path.join(TmpDir, "run_{}_p.npy".format(len(runL))),
+                  os.path.join(TmpDir, "run_{}_idx.npy".format(len(runL))))
+        np.save(paths[0], valueV[order])
+        np.save(paths[1], (n - len(valueV)) + order.astype(np.int64))
+        runL.append(paths)
+    for chunkV in ChunkIter():
+        chunkV = np.asarray(chunkV, dtype=np.float64).ravel()
+        if(np.any(np.isnan(chunkV))):
+            exit_with_error("ERROR!!! NaN p-value\n")
+        bufL.append(chunkV)
+        nBuf += len(chunkV)
+        n    += len(chunkV)
+        if(nBuf >= ChunkSize):
+            spill()
+            (bufL, nBuf) = ([], 0)
+    if(nBuf > 0):
+        spill()
+    return(runL, n)
+
+
+
+def _merge_runs(RunL=None, N=None, TmpDir=None, Block=MULTITEST_BLOCK):
+    """
+    ARGS:
+        RunL  : from _sorted_runs()
+        N     : total number of values
+        TmpDir: directory for the merged arrays
+        Block : values read from each run at a time
+    RETURN:
+        sortedV, idxV : memory maps (N,), all values sorted and their
+                        positions in the stream
+    DESCRIPTION:
+        Each step reads the next Block of every run, takes the smallest of
+        the blocks' last values as the bound, and emits every buffered value
+        <= bound (they all precede anything not yet read). The run the bound
+        came from empties its block, so every step makes progress.
+    DEBUG:
+    FUTURE:
+    """
+    sortedV = np.lib.format.open_memmap(os.path.join(TmpDir, "sorted_p.npy"), mode="w+",
+                                        dtype=np.float64, shape=(N,))
+    idxV    = np.lib.format.open_memmap(os.path.join(TmpDir, "sorted_idx.npy"), mode="w+",
+                                        dtype=np.int64, shape=(N,))
+    runL = [(np.load(pPath, mmap_mode="r"), np.load(iPath, mmap_mode="r"))
+            for (pPath, iPath) in RunL]
+    posL = [0] * len(runL)
+    out  = 0
+    while(out < N):
+        blockL = [(r, runL[r][0][posL[r]:posL[r] + Block]) for r in range(len(runL))
+                  if posL[r] < len(runL[r][0])]
+        bound  = min(blockV[-1] for (r, blockV) in blockL)
+        (valueL, indexL) = ([], [])
+        for (r, blockV) in blockL:
+            k = int(np.searchsorted(blockV, bound, side="right"))
+            valueL.append(np.asarray(blockV[:k]))
+            indexL.append(np.asarray(runL[r][1][posL[r]:posL[r] + k]))
+            posL[r] += k
+        valueV = np.concatenate(valueL)
+        order  = np.argsort(valueV, kind="stable")
+        sortedV[out:out + len(valueV)] = valueV[order]
+        idxV[out:out + len(valueV)]    = np.concatenate(indexL)[order]
+        out += len(valueV)
+    return(sortedV, idxV)
@@ -0,0 +1,154 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Permutation (randomization) test of the difference in means, an
+#   alternative to the t-tests' p-values that doesn't assume normality, which
+#   is shaky at Section 3's small nSamp.
+#
+#   Under the null the group labels are exchangeable, so the p-value is the
+#   fraction of relabelings of the pooled samples whose |mean1 - mean2| is
+#   at least the observed one. A relabeling is a 0/1 row picking group 1,
+#   and a batch of them is a (nPerm, n1+n2) mask matrix M. For a chunk of
+#   experiments, pooled samples P (nExp, n1+n2), the group 1 sums of every
+#   relabeling of every experiment are one matrix product, P @ M.T, so there
+#   is no python loop over experiments or permutations, only over batches.
+#
+#   1. Exact : all C(n1+n2, n1) relabelings, when there are at most NPerm of
+#      them (e.g. 20 for nSamp = 3, 184756 for nSamp = 10). p = k / C.
+#   2. Monte Carlo : NPerm random relabelings. p = (k + 1) / (NPerm + 1),
+#      which counts the observed labeling and is never 0.
+#   The same relabelings are used for every experiment in a chunk, each
+#   experiment's p-value is still a valid permutation p-value.
+#
+# Future:
+#
+import itertools
+import functools
+import numpy as np
+from math import comb
+from profiler import counted
+
+PERM_NPERM       = 10000        # Default max number of relabelings per experiment
+PERM_BATCH_CELLS = 2**22        # Max nExp * nPerm sums computed at once, bounds memory
+PERM_RTOL        = 1e-12        # |diff| within this of the observed one counts as a tie
+
+
+
+def permutation_method(N1=None, N2=None, NPerm=PERM_NPERM):
+    """
+    ARGS:
+        N1, N2 : int, group sizes
+        NPerm  : int, max number of relabelings
+    RETURN:
+        "exact" if all C(N1+N2, N1) relabelings fit in NPerm, "monte-carlo"
+        otherwise
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return("exact" if comb(N1 + N2, N1) <= NPerm else "monte-carlo")
+
+
+
+@functools.lru_cache(maxsize=16)
+def exact_masks(N1=None, N2=None):
+    """
+    ARGS:
+        N1, N2 : int, group sizes
+    RETURN:
+        float array (C(N1+N2, N1), N1+N2), 1 where a relabeling puts the
+        sample in group 1. Read-only, cached
+    DESCRIPTION:
+        Built once per (N1, N2) and process
+    DEBUG:
+    FUTURE:
+    """
+    n = N1 + N2
+    idxM = np.array(list(itertools.combinations(range(n), N1)), dtype=np.intp)
+    maskM = np.zeros((len(idxM), n))
+    maskM[np.arange(len(idxM))[:,None], idxM] = 1.0
+    maskM.setflags(write=False)
+    return(maskM)
+
+
+
+def random_masks(N1=None, N2=None, NPerm=None, Rng=None):
+    """
+    ARGS:
+        N1, N2 : int, group sizes
+        NPerm  : int, number of relabelings
+        Rng    : numpy.random.Generator
+    RETURN:
+        float array (NPerm, N1+N2), 1 where a relabeling puts the sample in
+        group 1. Each row is a uniformly random relabeling
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    n = N1 + N2
+    idxM = Rng.permuted(np.tile(np.arange(n), (NPerm, 1)), axis=1)[:, :N1]
+    maskM = np.zeros((NPerm, n))
+    maskM[np.arange(NPerm)[:,None], idxM] = 1.0
+    return(maskM)
+
+
+
+@counted("permutation_test_batch")
+def permutation_test_batch(Samp1M=None, Samp2M=None, NPerm=PERM_NPERM, Rng=None,
+                           Method=None):
+    """
+    ARGS:
+        Samp1M : samples from population 1, shape (nExp, n1)
+        Samp2M : samples from population 2, shape (nExp, n2)
+        NPerm  : int, max number of relabelings per experiment
+        Rng    : numpy.random.Generator, only used by Monte Carlo
+        Method : "exact", "monte-carlo" or None to pick with
+                 permutation_method()
+    RETURN:
+        dV : observed mean(Samp1) - mean(Samp2) of every experiment
+        pV : two sided permutation p-value of every experiment
+        method : the method used
+    DESCRIPTION:
+        See the top of the file. The relabelings are processed in batches of
+        ~PERM_BATCH_CELLS / nExp, the counts are summed over batches.
+    DEBUG:
+        1. nSamp = 3, exact : p-values are multiples of 1/20, the smallest
+           being 2/20 (the observed labeling and its mirror image)
+        2. Exact vs. a python loop over itertools.combinations per
+           experiment : identical
+    FUTURE:
+    """
+    Samp1M = np.atleast_2d(np.asarray(Samp1M, dtype=np.float64))
+    Samp2M = np.atleast_2d(np.asarray(Samp2M, dtype=np.float64))
+    (nExp, n1) = Samp1M.shape
+    n2 = Samp2M.shape[1]
+    if(Method is None):
+        Method = permutation_method(N1=n1, N2=n2, NPerm=NPerm)
+    pooledM = np.concatenate((Samp1M, Samp2M), axis=1)
+    totalV  = np.sum(pooledM, axis=1)
+    # mean1 - mean2 = sum1 (1/n1 + 1/n2) - total / n2, for any labeling
+    scale   = 1.0 / n1 + 1.0 / n2
+    dV      = np.sum(Samp1M, axis=1) * scale - totalV / n2
+    tolV    = PERM_RTOL * np.maximum(np.max(np.abs(pooledM), axis=1), 1e-300)
+    thresholdV = (np.abs(dV) - tolV)[:,None]
+    if(Method == "exact"):
+        maskM = exact_masks(N1=n1, N2=n2)
+        nPerm = len(maskM)
+    else:
+        nPerm = NPerm
+    batch  = max(1, PERM_BATCH_CELLS // max(nExp, 1))
+    countV = np.zeros(nExp, dtype=np.int64)
+    for start in range(0, nPerm, batch):
+        nBatch = min(batch, nPerm - start)
+        if(Method == "exact"):
+            batchM = maskM[start:start + nBatch]
+        else:
+            batchM = random_masks(N1=n1, N2=n2, NPerm=nBatch, Rng=Rng)
+        permM = (pooledM @ batchM.T) * scale - totalV[:,None] / n2
+        countV += np.count_nonzero(np.abs(permM) >= thresholdV, axis=1)
+    if(Method == "exact"):
+        pV = countV / nPerm
+    else:
+        pV = (countV + 1.0) / (nPerm + 1.0)
+    return(dV, pV, Method)
@@ -1,24 +1,114 @@
-import matplotlib.pyplot as plt
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Headless plots. Figures are rendered with matplotlib's Agg backend and
+#   written straight to PNG / SVG, so the sections can plot every sweep cell
+#   in batch, without a display. The histograms are pre-binned
+#   accumulator.StreamingHistograms, built while the sweeps run, so the raw
+#   values are never kept for plotting.
+#
+#   matplotlib is imported on the first plot, main.py runs without it when
+#   --plot-dir isn't given.
+#
+# Future:
+#
+import os
 import numpy as np
+from accumulator import StreamingHistogram
 
+PLOT_FORMAT_L = ["png", "svg"]      # Formats write_histograms() can write
 
 
-def plot_histogram(DataV = None, NBins = None):
+
+def _pyplot():
+    """
+    ARGS:
+    RETURN:
+        matplotlib.pyplot, using the Agg backend
+    DESCRIPTION:
+        The backend has to be picked before pyplot is imported
+    DEBUG:
+    FUTURE:
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return(plt)
+
+
+
+def plot_histogram(DataV = None, NBins = None, Path = None):
     """
     ARGS:
         DataV : 1D vector of points
-        NBins: Number of bins
+        NBins : Number of bins, spread evenly over [min(DataV), max(DataV)]
+        Path  : output file, the format is taken from its extension
+    RETURN:
+    DESCRIPTION:
+        Bins are normalized, (N_in_bin) / (dx * N_total)
+    DEBUG:
+    FUTURE:
+    """
+    DataV = np.asarray(DataV)
+    hist = StreamingHistogram(Edges=np.linspace(np.min(DataV), np.max(DataV), NBins + 1))
+    plot_streaming_histogram(Hist=hist.update(DataV), Path=Path)
+
+
+
+def plot_streaming_histogram(Hist=None, Path=None, Title=None, XLabel=None):
+    """
+    ARGS:
+        Hist   : accumulator.StreamingHistogram
+        Path   : output file, the format is taken from its extension
+        Title  : figure title
+        XLabel : x axis label
+    RETURN:
+    DESCRIPTION:
+        Draws the density of the binned values. Under / overflow and non
+        finite values aren't drawn, they are noted in the legend.
+    DEBUG:
+    FUTURE:
+    """
+    plt = _pyplot()
+    edgeV = Hist.edges()
+    (fig, ax) = plt.subplots(figsize=(6.4, 4.8))
+    ax.bar(edgeV[:-1], Hist.density(), width=np.diff(edgeV), align="edge",
+           label="N = {}".format(Hist.count))
+    if(Hist.underflow + Hist.overflow + Hist.nan > 0):
+        ax.plot([], [], " ", label="outside : {} below, {} above, {} nan".format(
+                Hist.underflow, Hist.overflow, Hist.nan))
+    ax.set_ylabel("Probability density")
+    if(XLabel is not None):
+        ax.set_xlabel(XLabel)
+    if(Title is not None):
+        ax.set_title(Title)
+    ax.legend(loc="upper right", frameon=False)
+    fig.savefig(Path)
+    # Figures aren't freed until closed, there is one per cell
+    plt.close(fig)
+
+
+
+def write_histograms(HistD=None, Dir=None, FormatL=None, Prefix=None):
+    """
+    ARGS:
+        HistD   : dict, name -> (StreamingHistogram, title, x label)
+        Dir     : output directory, created if needed
+        FormatL : list of formats, see PLOT_FORMAT_L
+        Prefix  : file name prefix, e.g. the section
     RETURN:
+        list of the files written
     DESCRIPTION:
+        Writes Dir/Prefix_name.format for every histogram and format
     DEBUG:
     FUTURE:
-        1. Make more efficient
-    """
-    minX = min(DataV)
-    maxX = max(DataV)
-    #dx = (maxX-minX) / NBins
-    #binV = np.zeros(NBins)
-    #for i in range(bin
-    plt.hist(DataV, bins=NBins, density=True)       ## bins = (N_in_bin) / (dx * N_total)
-    plt.ylabel('Probability');
-    plt.show()
+    """
+    os.makedirs(Dir, exist_ok=True)
+    pathL = []
+    for (name, (hist, title, xLabel)) in HistD.items():
+        for fmt in FormatL:
+            path = os.path.join(Dir, "{}_{}.{}".format(Prefix, name, fmt))
+            plot_streaming_histogram(Hist=hist, Path=path, Title=title, XLabel=xLabel)
+            pathL.append(path)
+    return(pathL)
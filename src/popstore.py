@@ -0,0 +1,293 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   On disk cache of generated populations. A population is fully determined
+#   by (mu, sd, N, dtype, seed), so parameter sweeps that rerun main.py with
+#   the same populations can reopen them with np.load(mmap_mode='r') instead
+#   of regenerating them. Processes that map the same file share its pages.
+#
+#   Each entry is a pair of files :
+#       pop_<key>.npy  : the population
+#       pop_<key>.json : the parameters, POPSTORE_VERSION and checksums
+#   The .npy is written first and the .json last, both atomically
+#   (write to a temporary file + os.replace), so an entry without a readable
+#   .json is incomplete and ignored.
+#
+# Future:
+#
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+import numpy as np
+from population import make_rng
+from population import build_population
+
+### Bump this whenever build_population() would generate different numbers
+### for the same parameters, so old files are regenerated instead of reused.
+POPSTORE_VERSION = 1
+POPSTORE_SAMPLE  = 4096         # Number of strided values in the quick checksum
+
+
+
+def population_key(Mu=None, Sd=None, N=None, Dtype=None, Seed=None):
+    """
+    ARGS:
+        Mu, Sd, N, Dtype : see population.build_population()
+        Seed             : numpy.random.SeedSequence the population is built from
+    RETURN:
+        paramD : dict of the parameters, json serializable
+        key    : hex digest of paramD
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    paramD = {"version"   : POPSTORE_VERSION,
+              "mu"        : float(Mu),
+              "sd"        : float(Sd),
+              "n"         : int(N),
+              "dtype"     : np.dtype(Dtype).str,
+              "entropy"   : str(Seed.entropy),
+              "spawn_key" : [int(k) for k in Seed.spawn_key],
+              "bitgen"    : "PCG64"}
+    key = hashlib.sha1(json.dumps(paramD, sort_keys=True).encode()).hexdigest()[:20]
+    return(paramD, key)
+
+
+
+def quick_checksum(PopV=None):
+    """
+    ARGS:
+        PopV : population array
+    RETURN:
+        crc32 of POPSTORE_SAMPLE evenly strided values (and the last one).
+    DESCRIPTION:
+        Cheap enough to check on every load of a memory mapped file, it only
+        touches a few thousand pages. See full_checksum() for the whole file.
+    DEBUG:
+    FUTURE:
+    """
+    stride = max(1, len(PopV) // POPSTORE_SAMPLE)
+    sampV  = np.ascontiguousarray(PopV[::stride])
+    crc = zlib.crc32(sampV.tobytes())
+    if(len(PopV) > 0):
+        crc = zlib.crc32(np.ascontiguousarray(PopV[-1:]).tobytes(), crc)
+    return(crc)
+
+
+
+def full_checksum(PopV=None, ChunkSize=2**22):
+    """
+    ARGS:
+        PopV      : population array
+        ChunkSize : number of values hashed at a time
+    RETURN:
+        crc32 of the whole array
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    crc = 0
+    for start in range(0, len(PopV), ChunkSize):
+        crc = zlib.crc32(np.ascontiguousarray(PopV[start:start+ChunkSize]).tobytes(), crc)
+    return(crc)
+
+
+
+def _atomic_write(Path=None, WriteFunction=None):
+    """
+    ARGS:
+        Path          : final path
+        WriteFunction : function taking an open binary file object
+    RETURN:
+    DESCRIPTION:
+        Writes to a temporary file in the same directory, then os.replace()
+    DEBUG:
+    FUTURE:
+    """
+    (fd, tmpPath) = tempfile.mkstemp(dir=os.path.dirname(Path), prefix=".tmp_")
+    try:
+        os.chmod(tmpPath, 0o644)        # mkstemp makes it 0600
+        with os.fdopen(fd, "wb") as f:
+            WriteFunction(f)
+        os.replace(tmpPath, Path)
+    except BaseException:
+        if(os.path.exists(tmpPath)):
+            os.remove(tmpPath)
+        raise
+
+
+
+class PopulationStore:
+    """
+    Directory of cached populations, e.g.
+
+        store = PopulationStore(Dir="pop_cache", MaxBytes=8*2**30)
+        popV  = store.get(Mu=0, Sd=1, N=10**8, Dtype=np.float32, Seed=seedSeq)
+
+    get() returns a read-only np.memmap when the entry exists (and passes
+    the version / checksum guard), otherwise it builds the population, writes
+    it and evicts the least recently used entries until the store fits in
+    MaxBytes.
+    """
+    def __init__(self, Dir=None, MaxBytes=None, Verify=False):
+        """
+        ARGS:
+            Dir      : directory of the store, created if missing
+            MaxBytes : int, max size of the .npy files, None = unbounded
+            Verify   : bool, check full_checksum() on every load (reads the
+                       whole file) instead of only quick_checksum()
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        self.dir      = Dir
+        self.maxBytes = MaxBytes
+        self.verify   = Verify
+        self.hits     = 0
+        self.misses   = 0
+        os.makedirs(self.dir, exist_ok=True)
+
+
+    def _paths(self, Key=None):
+        return(os.path.join(self.dir, "pop_{}.npy".format(Key)),
+               os.path.join(self.dir, "pop_{}.json".format(Key)))
+
+
+    def get(self, Mu=None, Sd=None, N=None, Dtype=np.float64, Seed=None):
+        """
+        ARGS:
+            Mu, Sd, N, Dtype : see population.build_population()
+            Seed             : numpy.random.SeedSequence to build it from
+        RETURN:
+            popV : the population, a read-only memory map of the cached file
+        DESCRIPTION:
+        DEBUG:
+            1. N=10^8 float32 : build + write ~2 s, later loads ~1 ms
+        FUTURE:
+        """
+        (paramD, key) = population_key(Mu=Mu, Sd=Sd, N=N, Dtype=Dtype, Seed=Seed)
+        popV = self._load(ParamD=paramD, Key=key)
+        if(popV is not None):
+            self.hits += 1
+            return(popV)
+        self.misses += 1
+        popV = build_population(Rng=make_rng(Seed=Seed), Mu=Mu, Sd=Sd, N=N, Dtype=Dtype)
+        self._store(PopV=popV, ParamD=paramD, Key=key)
+        self.evict(KeepKey=key)
+        (npyPath, jsonPath) = self._paths(Key=key)
+        return(np.load(npyPath, mmap_mode="r"))
+
+
+    def _load(self, ParamD=None, Key=None):
+        """
+        ARGS:
+            ParamD, Key : from population_key()
+        RETURN:
+            the memory mapped population, or None if missing / stale
+        DESCRIPTION:
+            Stale entries (other version, wrong shape / dtype, bad checksum)
+            are deleted
+        DEBUG:
+        FUTURE:
+        """
+        (npyPath, jsonPath) = self._paths(Key=Key)
+        if(not os.path.exists(jsonPath) or not os.path.exists(npyPath)):
+            return(None)
+        try:
+            with open(jsonPath, "r") as f:
+                metaD = json.load(f)
+            popV = np.load(npyPath, mmap_mode="r")
+        except (ValueError, OSError):
+            self._remove(Key=Key)
+            return(None)
+        ok = (metaD.get("params") == ParamD and popV.shape == (ParamD["n"],) and
+              popV.dtype.str == ParamD["dtype"] and
+              metaD.get("quick_crc") == quick_checksum(PopV=popV))
+        if(ok and self.verify):
+            ok = (metaD.get("full_crc") == full_checksum(PopV=popV))
+        if(not ok):
+            del popV
+            self._remove(Key=Key)
+            return(None)
+        os.utime(jsonPath)          # Mark as recently used, for evict()
+        return(popV)
+
+
+    def _store(self, PopV=None, ParamD=None, Key=None):
+        """
+        ARGS:
+            PopV        : population to write
+            ParamD, Key : from population_key()
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        (npyPath, jsonPath) = self._paths(Key=Key)
+        metaD = {"params"    : ParamD,
+                 "quick_crc" : quick_checksum(PopV=PopV),
+                 "full_crc"  : full_checksum(PopV=PopV),
+                 "nbytes"    : int(PopV.nbytes)}
+        _atomic_write(Path=npyPath, WriteFunction=lambda f : np.save(f, PopV))
+        _atomic_write(Path=jsonPath,
+                      WriteFunction=lambda f : f.write(json.dumps(metaD, indent=1).encode()))
+
+
+    def _remove(self, Key=None):
+        for path in self._paths(Key=Key):
+            if(os.path.exists(path)):
+                os.remove(path)
+
+
+    def entries(self):
+        """
+        ARGS:
+        RETURN:
+            list of (last used time, nbytes, key), oldest first
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        entryL = []
+        for fileName in os.listdir(self.dir):
+            if(not (fileName.startswith("pop_") and fileName.endswith(".npy"))):
+                continue
+            key = fileName[len("pop_"):-len(".npy")]
+            (npyPath, jsonPath) = self._paths(Key=key)
+            if(not os.path.exists(jsonPath)):
+                continue                # Being written by someone else
+            entryL.append((os.path.getmtime(jsonPath), os.path.getsize(npyPath), key))
+        return(sorted(entryL))
+
+
+    def evict(self, KeepKey=None):
+        """
+        ARGS:
+            KeepKey : key never to evict, e.g. the entry just written
+        RETURN:
+            list of evicted keys
+        DESCRIPTION:
+            Removes the least recently used entries until the .npy files fit
+            in MaxBytes. On Linux a process that still has an evicted file
+            mapped keeps its pages until it unmaps it.
+        DEBUG:
+        FUTURE:
+        """
+        if(self.maxBytes is None):
+            return([])
+        entryL = self.entries()
+        total  = sum(entry[1] for entry in entryL)
+        evictL = []
+        for (mtime, nbytes, key) in entryL:
+            if(total <= self.maxBytes):
+                break
+            if(key == KeepKey):
+                continue
+            self._remove(Key=key)
+            total -= nbytes
+            evictL.append(key)
+        return(evictL)
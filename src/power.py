@@ -0,0 +1,335 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Monte Carlo power analysis of Student's and Welch's t-tests. Section 3 of
+#   main.py is a small fixed power study (500 experiments per nSamp). Here
+#
+#   1. every cell of a grid over (effect size, sd ratio, nSamp) runs
+#      experiments in rounds and stops as soon as the confidence interval on
+#      its rejection rate is narrower than a target, see estimate_power().
+#   2. the minimum nSamp reaching a target power is found by doubling then
+#      bisecting on nSamp, see min_sample_size(). A probe stops as soon as
+#      its interval is entirely above or below the target.
+#
+#   Samples are drawn from the normal distributions directly (group 1 is
+#   N(0,1), group 2 is N(effect size, sd ratio**2)), not from the finite
+#   populations of main.py, so power is a function of the grid alone. The
+#   tests are functions.student_t_test_batch() / welchs_t_test_batch() as
+#   used in Section 3 (np.std with ddof=0), so for small nSamp the rejection
+#   rate under the null runs above alpha just like Section 3's frac<.05.
+#
+#   Every task has its own SeedSequence, addressed by (cell, round, chunk)
+#   with scheduler.child_seed(), and the stopping decisions only depend on
+#   the merged counts. So the output doesn't depend on --workers.
+#
+# Future:
+#
+import numpy as np
+from population import make_rng
+from scheduler import child_seed
+from scheduler import chunk_sizes
+from functions import student_t_test_batch
+from functions import welchs_t_test_batch
+
+POWER_ALPHA     = 0.05          # Significance level of the t-tests
+POWER_Z         = 1.96          # Critical value of the CI on the rejection rate
+POWER_MIN_ROUND = 1000          # Experiments in the first round of a cell
+_TEST_D = {"student" : student_t_test_batch,
+           "welch"   : welchs_t_test_batch}
+POWER_TEST_L = list(_TEST_D)
+
+
+
+def power_task(EffectSize=None, SdRatio=None, NSamp=None, NChunk=None, Seed=None,
+               TestL=None, Alpha=POWER_ALPHA, PvalueMethod=None):
+    """
+    ARGS:
+        EffectSize : float, (mu2 - mu1) / sd1
+        SdRatio    : float, sd2 / sd1
+        NSamp      : int, number of samples per group per experiment
+        NChunk     : int, number of experiments in this task
+        Seed       : numpy.random.SeedSequence of this task
+        TestL      : list of tests, from POWER_TEST_L
+        Alpha      : float, reject when p < Alpha
+        PvalueMethod : see functions.convert_tscore_to_pvalue()
+    RETURN:
+        dict, test -> number of experiments that rejected the null hypothesis
+    DESCRIPTION:
+        All tests are run on the same draws
+    DEBUG:
+    FUTURE:
+    """
+    rng    = make_rng(Seed)
+    samp1M = rng.standard_normal((NChunk, NSamp))
+    samp2M = EffectSize + SdRatio * rng.standard_normal((NChunk, NSamp))
+    rejectD = {}
+    for test in TestL:
+        (tV,vV,pV) = _TEST_D[test](Samp1M=samp1M, Samp2M=samp2M, Method=PvalueMethod)
+        rejectD[test] = int(np.count_nonzero(pV < Alpha))
+    return(rejectD)
+
+
+
+def wilson_interval(K=None, N=None, Z=POWER_Z):
+    """
+    ARGS:
+        K : number of successes, int or array
+        N : number of trials, int or array
+        Z : critical value of the z-distribution
+    RETURN:
+        (lower, upper) Wilson score interval of the rate K/N
+    DESCRIPTION:
+        Unlike the normal approximation it doesn't collapse to zero width at
+        K = 0 or K = N, so a cell with power ~0 or ~1 can't stop after a
+        handful of experiments
+    DEBUG:
+    FUTURE:
+    """
+    K = np.asarray(K, dtype=np.float64)
+    N = np.asarray(N, dtype=np.float64)
+    rate   = K / N
+    denom  = 1.0 + Z**2 / N
+    center = (rate + Z**2 / (2.0 * N)) / denom
+    half   = Z * np.sqrt(rate * (1.0 - rate) / N + Z**2 / (4.0 * N**2)) / denom
+    return(center - half, center + half)
+
+
+
+def _next_round(NExp=None, RejectD=None, HalfWidth=None, Threshold=None, MaxExp=None,
+                Z=POWER_Z):
+    """
+    ARGS:
+        NExp    : experiments run so far in the cell
+        RejectD : rejections so far, test -> count
+        HalfWidth, Threshold, MaxExp, Z : see estimate_power()
+    RETURN:
+        number of experiments to run in the next round
+    DESCRIPTION:
+        Guesses the total needed from the rate so far (n = Z**2 p(1-p) / h**2,
+        with h the target half width or the distance to Threshold), but at
+        most doubles NExp per round, so a noisy early guess overshoots by at
+        most 2x.
+    DEBUG:
+    FUTURE:
+    """
+    if(NExp == 0):
+        return(min(POWER_MIN_ROUND, MaxExp))
+    needL = []
+    for k in RejectD.values():
+        rate = (k + 2.0) / (NExp + 4.0)     # Agresti-Coull, never 0 or 1
+        half = HalfWidth
+        if(Threshold is not None):
+            half = max(half, abs(k / NExp - Threshold))
+        needL.append(Z**2 * rate * (1.0 - rate) / half**2)
+    nNext = int(np.ceil(max(needL))) - NExp
+    nNext = min(max(nNext, POWER_MIN_ROUND), NExp)
+    return(min(nNext, MaxExp - NExp))
+
+
+
+def estimate_power(Sched=None, CellL=None, SeedL=None, HalfWidth=0.01, Threshold=None,
+                   MaxExp=100000, ChunkSize=2**15, Alpha=POWER_ALPHA, PvalueMethod=None,
+                   Z=POWER_Z, Label=""):
+    """
+    ARGS:
+        Sched     : scheduler.Scheduler
+        CellL     : list of (effect size, sd ratio, nSamp, list of tests)
+        SeedL     : numpy.random.SeedSequence of each cell
+        HalfWidth : float, a cell stops once the CI of every test's rejection
+                    rate is at most this wide on either side
+        Threshold : float or None. If given, a cell also stops once every
+                    test's CI lies entirely above or below it
+        MaxExp    : int, max number of experiments per cell
+        ChunkSize : max number of experiments per task
+        Alpha     : float, reject when p < Alpha
+        PvalueMethod : see functions.convert_tscore_to_pvalue()
+        Z         : critical value of the CI
+        Label     : prefix of the cells' labels, for the profiler
+    RETURN:
+        list with a dict per cell :
+            nexp   : number of experiments run
+            reject : test -> number of rejections
+            power  : test -> rejection rate
+            lower  : test -> lower end of its Wilson CI
+            upper  : test -> upper end of its Wilson CI
+            stop   : "ci", "threshold" or "max"
+    DESCRIPTION:
+        Sequential sampling. Each round, every active cell gets a batch of
+        experiments (see _next_round()) and all of them are submitted to
+        Sched at once, then the cells whose CI is narrow enough drop out.
+        A cell with power p needs ~ Z**2 p(1-p) / HalfWidth**2 experiments,
+        e.g. 9604 at p = 0.5 but only 1825 at p = 0.05 (HalfWidth = 0.01).
+
+        Stopping on the CI width barely biases the rate, stopping on the
+        Threshold only decides which side of it the rate is on.
+    DEBUG:
+    FUTURE:
+    """
+    stateL = [{"nexp" : 0, "round" : 0, "reject" : {test : 0 for test in cell[3]},
+               "stop" : None} for cell in CellL]
+    while(any(state["stop"] is None for state in stateL)):
+        argsL  = []
+        ownerL = []
+        labelL = []
+        for (idx, (cell, state)) in enumerate(zip(CellL, stateL)):
+            if(state["stop"] is not None):
+                continue
+            label = "{}es={} sd_ratio={} nSamp={} {}".format(Label, cell[0], cell[1], cell[2],
+                                                             "+".join(cell[3]))
+            nNext = _next_round(NExp=state["nexp"], RejectD=state["reject"],
+                                HalfWidth=HalfWidth, Threshold=Threshold, MaxExp=MaxExp, Z=Z)
+            for (chunk, nChunk) in enumerate(chunk_sizes(N=nNext, ChunkSize=ChunkSize)):
+                seed = child_seed(SeedSeq=SeedL[idx], Key=(state["round"], chunk))
+                argsL.append((cell[0], cell[1], cell[2], nChunk, seed, cell[3], Alpha,
+                              PvalueMethod))
+                ownerL.append(idx)
+                labelL.append(label)
+            state["round"] += 1
+        resultL = Sched.map(Function=power_task, ArgsL=argsL, LabelL=labelL)
+        for (idx, args, rejectD) in zip(ownerL, argsL, resultL):
+            stateL[idx]["nexp"] += args[3]
+            for (test, k) in rejectD.items():
+                stateL[idx]["reject"][test] += k
+        for state in stateL:
+            if(state["stop"] is None):
+                state["stop"] = _stop_reason(State=state, HalfWidth=HalfWidth,
+                                             Threshold=Threshold, MaxExp=MaxExp, Z=Z)
+    outL = []
+    for state in stateL:
+        testL = list(state["reject"])
+        kV = np.array([state["reject"][test] for test in testL])
+        (lowerV, upperV) = wilson_interval(K=kV, N=state["nexp"], Z=Z)
+        outL.append({"nexp"   : state["nexp"],
+                     "reject" : dict(state["reject"]),
+                     "power"  : dict(zip(testL, kV / state["nexp"])),
+                     "lower"  : dict(zip(testL, lowerV)),
+                     "upper"  : dict(zip(testL, upperV)),
+                     "stop"   : state["stop"]})
+    return(outL)
+
+
+
+def _stop_reason(State=None, HalfWidth=None, Threshold=None, MaxExp=None, Z=POWER_Z):
+    """
+    ARGS:
+        State : a cell's state in estimate_power()
+        HalfWidth, Threshold, MaxExp, Z : see estimate_power()
+    RETURN:
+        "ci", "threshold", "max" or None to keep going
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    kV = np.array(list(State["reject"].values()))
+    (lowerV, upperV) = wilson_interval(K=kV, N=State["nexp"], Z=Z)
+    if(np.all((upperV - lowerV) / 2.0 <= HalfWidth)):
+        return("ci")
+    if(Threshold is not None and np.all((lowerV > Threshold) | (upperV < Threshold))):
+        return("threshold")
+    if(State["nexp"] >= MaxExp):
+        return("max")
+    return(None)
+
+
+
+def power_grid(Sched=None, EffectSizeL=None, SdRatioL=None, NSampL=None, SeedSeq=None,
+               TestL=POWER_TEST_L, **Kwargs):
+    """
+    ARGS:
+        Sched       : scheduler.Scheduler
+        EffectSizeL : list of effect sizes, (mu2 - mu1) / sd1
+        SdRatioL    : list of sd2 / sd1
+        NSampL      : list of samples per group
+        SeedSeq     : numpy.random.SeedSequence of the grid
+        TestL       : tests to run in every cell, on the same draws
+        Kwargs      : passed on to estimate_power()
+    RETURN:
+        list of ((effect size, sd ratio, nSamp), result of estimate_power())
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    keyL  = [(es, ratio, nSamp) for es in EffectSizeL for ratio in SdRatioL
+             for nSamp in NSampL]
+    cellL = [key + (list(TestL),) for key in keyL]
+    seedL = [child_seed(SeedSeq=SeedSeq, Key=(0, idx)) for idx in range(len(cellL))]
+    resultL = estimate_power(Sched=Sched, CellL=cellL, SeedL=seedL, **Kwargs)
+    return(list(zip(keyL, resultL)))
+
+
+
+def min_sample_size(Sched=None, SearchL=None, TargetPower=0.8, NMin=2, NMax=1000,
+                    SeedSeq=None, **Kwargs):
+    """
+    ARGS:
+        Sched       : scheduler.Scheduler
+        SearchL     : list of (effect size, sd ratio, test)
+        TargetPower : float, power to reach
+        NMin, NMax  : int, range of nSamp searched
+        SeedSeq     : numpy.random.SeedSequence of the searches
+        Kwargs      : passed on to estimate_power(), except Threshold
+    RETURN:
+        list with a dict per search :
+            nsamp : smallest nSamp with power >= TargetPower, None if even
+                    NMax doesn't reach it
+            power : its estimated power (or NMax's if nsamp is None)
+            nexp  : experiments run, summed over every probe of the search
+            probe : list of (nSamp, power) in the order probed
+    DESCRIPTION:
+        Power increases with nSamp, so each search first doubles nSamp from
+        NMin until the power reaches TargetPower, then bisects between the
+        last two probes. That is O(log(NMax)) probes instead of one per
+        nSamp. Probes run with Threshold = TargetPower so the ones far from
+        the target stop after a round or two.
+
+        All searches advance in lock step, a round's probes are evaluated
+        together by one estimate_power() call so the workers stay busy.
+        The seed of a probe is keyed on (search, nSamp), so a probe's result
+        doesn't depend on the path that led to it.
+    DEBUG:
+    FUTURE:
+    """
+    stateL = [{"lo" : NMin - 1, "hi" : None, "next" : NMin, "nexp" : 0, "probe" : [],
+               "powerD" : {}, "done" : False} for search in SearchL]
+    while(not all(state["done"] for state in stateL)):
+        cellL  = []
+        seedL  = []
+        ownerL = []
+        for (idx, (search, state)) in enumerate(zip(SearchL, stateL)):
+            if(state["done"]):
+                continue
+            cellL.append((search[0], search[1], state["next"], [search[2]]))
+            seedL.append(child_seed(SeedSeq=SeedSeq, Key=(1, idx, state["next"])))
+            ownerL.append(idx)
+        resultL = estimate_power(Sched=Sched, CellL=cellL, SeedL=seedL,
+                                 Threshold=TargetPower, Label="search ", **Kwargs)
+        for (idx, cell, result) in zip(ownerL, cellL, resultL):
+            state = stateL[idx]
+            nSamp = cell[2]
+            power = result["power"][cell[3][0]]
+            state["nexp"] += result["nexp"]
+            state["probe"].append((nSamp, power))
+            state["powerD"][nSamp] = power
+            if(power >= TargetPower):
+                state["hi"] = nSamp
+            else:
+                state["lo"] = nSamp
+            ### Pick the next probe ###
+            if(state["hi"] is None):
+                if(nSamp >= NMax):
+                    state["done"] = True
+                else:
+                    state["next"] = min(2 * nSamp, NMax)
+            elif(state["hi"] - state["lo"] <= 1):
+                state["done"] = True
+            else:
+                state["next"] = (state["lo"] + state["hi"]) // 2
+    outL = []
+    for state in stateL:
+        nSamp = state["hi"]
+        outL.append({"nsamp" : nSamp,
+                     "power" : state["powerD"][NMax if nSamp is None else nSamp],
+                     "nexp"  : state["nexp"],
+                     "probe" : state["probe"]})
+    return(outL)
@@ -0,0 +1,310 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Instrumentation behind main.py --profile. Records
+#       1. wall time of each section and of each sweep cell (the summed wall
+#          time of the cell's tasks, wherever they ran)
+#       2. calls to, and inclusive time in, the functions decorated with
+#          counted(), e.g. convert_tscore_to_pvalue() and the t-tests
+#       3. values drawn from the random number generators of make_rng()
+#       4. peak RSS of the main process and of the workers
+#   and writes them as JSON or CSV, see write_report().
+#
+#   Cost when disabled : counted() decides when the module defining the
+#   function is imported. If profiling is off then, it returns the function
+#   itself, so there is no wrapper at all. main.py calls enable() before it
+#   imports any of the instrumented modules. Everything else checks
+#   is_enabled() once per task / section.
+#
+#   Only the standard library is imported here, so main.py can import it
+#   before numpy.
+#
+# Future:
+#
+import sys
+import csv
+import json
+import time
+import functools
+import contextlib
+
+_state    = {"enabled" : False, "section" : None, "start" : None}
+_callD    = {}              # name -> [calls, inclusive wall time in s]
+_drawD    = {"rng" : 0}     # values drawn through CountingRng
+_sectionL = []              # (section, wall time in s), in run order
+_cellD    = {}              # (section, cell label) -> [tasks, wall time in s]
+_rssD     = {"workers" : 0.0}
+_skippedL = []              # counted() functions imported before enable()
+### Generator methods counted as draws, see CountingRng ###
+_RNG_DRAW_L = ["integers", "random", "standard_normal", "normal", "uniform", "choice",
+               "permutation", "permuted"]
+
+
+
+def enable():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+        Turn profiling on in this process. Call it before importing the
+        instrumented modules, see counted().
+    DEBUG:
+    FUTURE:
+    """
+    if(len(_skippedL) > 0 and not _state["enabled"]):
+        sys.stderr.write("WARNING!!! imported before profiler.enable(), not counted : "
+                         "{}\n".format(", ".join(_skippedL)))
+    _state["enabled"] = True
+    if(_state["start"] is None):
+        _state["start"] = time.perf_counter()
+
+
+
+def is_enabled():
+    """
+    ARGS:
+    RETURN:
+        bool, True once enable() has been called in this process
+    DESCRIPTION:
+        Checked once per task / section by the code that records section
+        and cell times, RSS and random draws. The scheduler passes it on to
+        its pool, whose workers call enable() in their initializer.
+    DEBUG:
+    FUTURE:
+    """
+    return(_state["enabled"])
+
+
+
+def counted(Name=None):
+    """
+    ARGS:
+        Name : name the calls are reported under
+    RETURN:
+        decorator
+    DESCRIPTION:
+        If profiling is enabled when the decorated function is defined, wrap
+        it to count its calls and their inclusive wall time. Otherwise the
+        function is returned untouched.
+
+        The choice is made once, at import time. Calling enable() after the
+        module defining the function has been imported has no effect on it,
+        its calls are never counted (enable() warns about these).
+    DEBUG:
+    FUTURE:
+    """
+    def decorator(Function):
+        if(not _state["enabled"]):
+            _skippedL.append(Name)
+            return(Function)
+        _callD.setdefault(Name, [0, 0.0])
+        @functools.wraps(Function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return(Function(*args, **kwargs))
+            finally:
+                entry = _callD[Name]
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+        return(wrapper)
+    return(decorator)
+
+
+
+class CountingRng:
+    """
+    Wraps a numpy.random.Generator and counts the values its sampling methods
+    (_RNG_DRAW_L) return. population.make_rng() hands these out when
+    profiling is enabled. Everything else is forwarded to the Generator, so
+    the streams are unchanged.
+    """
+    def __init__(self, Rng=None):
+        self._rng = Rng
+
+
+    def __getattr__(self, Name):
+        attr = getattr(self._rng, Name)
+        if(Name not in _RNG_DRAW_L):
+            return(attr)
+        def draw(*args, **kwargs):
+            out = attr(*args, **kwargs)
+            _drawD["rng"] += getattr(out, "size", 1)
+            return(out)
+        return(draw)
+
+
+
+@contextlib.contextmanager
+def section(Name=None):
+    """
+    ARGS:
+        Name : section name
+    RETURN:
+    DESCRIPTION:
+        Context manager timing a section. Sweep cells run inside it are
+        reported under this section.
+    DEBUG:
+    FUTURE:
+    """
+    if(not _state["enabled"]):
+        yield
+        return
+    _state["section"] = Name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _sectionL.append((Name, time.perf_counter() - start))
+        _state["section"] = None
+
+
+
+def _counters():
+    """
+    ARGS:
+    RETURN:
+        copy of this process's counters
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return({"calls" : {name : list(entry) for (name, entry) in _callD.items()},
+            "rng"   : _drawD["rng"]})
+
+
+
+def run_task(Function=None, Args=None):
+    """
+    ARGS:
+        Function : task function
+        Args     : its argument tuple
+    RETURN:
+        (result, infoD) with infoD = {wall, calls, rng, maxrss_mb}, calls and
+        rng are what the task added to the counters
+    DESCRIPTION:
+        What Scheduler.map() runs instead of Function(*Args) when profiling.
+        Top level so it can be pickled to the workers.
+    DEBUG:
+    FUTURE:
+    """
+    before = _counters()
+    start  = time.perf_counter()
+    result = Function(*Args)
+    wall   = time.perf_counter() - start
+    after  = _counters()
+    callD  = {}
+    for (name, (calls, seconds)) in after["calls"].items():
+        (calls0, seconds0) = before["calls"].get(name, [0, 0.0])
+        if(calls > calls0):
+            callD[name] = [calls - calls0, seconds - seconds0]
+    return(result, {"wall" : wall, "calls" : callD, "rng" : after["rng"] - before["rng"],
+                    "maxrss_mb" : _maxrss_mb()})
+
+
+
+def record_task(Label=None, InfoD=None, MergeCounters=None):
+    """
+    ARGS:
+        Label         : cell the task belongs to
+        InfoD         : from run_task()
+        MergeCounters : bool, add the task's counters to this process's. True
+                        when the task ran in a worker, False when it ran here
+                        (its counts are already in this process's counters)
+    RETURN:
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    entry = _cellD.setdefault((_state["section"], Label), [0, 0.0])
+    entry[0] += 1
+    entry[1] += InfoD["wall"]
+    if(MergeCounters):
+        for (name, (calls, seconds)) in InfoD["calls"].items():
+            total = _callD.setdefault(name, [0, 0.0])
+            total[0] += calls
+            total[1] += seconds
+        _drawD["rng"] += InfoD["rng"]
+        _rssD["workers"] = max(_rssD["workers"], InfoD["maxrss_mb"])
+
+
+
+def _maxrss_mb(Who=None):
+    """
+    ARGS:
+        Who : None for this process, "children" for its reaped children
+    RETURN:
+        peak resident set size in MB
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    import resource
+    who = resource.RUSAGE_CHILDREN if Who == "children" else resource.RUSAGE_SELF
+    # ru_maxrss is in kB on Linux, bytes on OSX
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return(resource.getrusage(who).ru_maxrss / scale)
+
+
+
+def report():
+    """
+    ARGS:
+    RETURN:
+        dict of everything recorded so far
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    total = time.perf_counter() - _state["start"] if _state["start"] is not None else 0.0
+    return({"total_wall_s" : total,
+            "sections"     : [{"section" : name, "wall_s" : wall}
+                              for (name, wall) in _sectionL],
+            "cells"        : [{"section" : section, "cell" : label, "tasks" : tasks,
+                               "wall_s" : wall}
+                              for ((section, label), (tasks, wall)) in _cellD.items()],
+            "calls"        : {name : {"calls" : calls, "wall_s" : wall}
+                              for (name, (calls, wall)) in sorted(_callD.items())},
+            "rng_draws"    : _drawD["rng"],
+            "peak_rss_mb"  : {"main"     : _maxrss_mb(),
+                              "workers"  : max(_rssD["workers"],
+                                               _maxrss_mb(Who="children"))},
+            "not_counted"  : list(_skippedL)})
+
+
+
+def write_report(Path=None, MetaD=None):
+    """
+    ARGS:
+        Path  : output file. '.csv' writes CSV, anything else JSON
+        MetaD : dict of run information (command line, workers ...) for
+                the JSON report
+    RETURN:
+    DESCRIPTION:
+        The CSV has one row per measurement :
+            kind,section,name,count,wall_s,value
+        with kind one of total, section, cell, call, rng_draws, peak_rss_mb
+    DEBUG:
+    FUTURE:
+    """
+    reportD = report()
+    if(not Path.endswith(".csv")):
+        reportD = dict({"meta" : MetaD if MetaD is not None else {}}, **reportD)
+        with open(Path, "w") as f:
+            json.dump(reportD, f, indent=1)
+        return
+    with open(Path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["kind", "section", "name", "count", "wall_s", "value"])
+        writer.writerow(["total", "", "", "", reportD["total_wall_s"], ""])
+        for sectionD in reportD["sections"]:
+            writer.writerow(["section", sectionD["section"], "", 1, sectionD["wall_s"], ""])
+        for cellD in reportD["cells"]:
+            writer.writerow(["cell", cellD["section"], cellD["cell"], cellD["tasks"],
+                             cellD["wall_s"], ""])
+        for (name, callD) in reportD["calls"].items():
+            writer.writerow(["call", "", name, callD["calls"], callD["wall_s"], ""])
+        writer.writerow(["rng_draws", "", "", "", "", reportD["rng_draws"]])
+        for (name, value) in reportD["peak_rss_mb"].items():
+            writer.writerow(["peak_rss_mb", "", name, "", "", value])
@@ -0,0 +1,324 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Columnar, append-only store for the results of main.py (--results DIR),
+#   so they can be analysed without parsing the printed tables. Every table
+#   is a set of named 1D columns, written in chunks as the sweeps produce
+#   them :
+#       DIR/index.json                 : runs, tables, their columns and chunks
+#       DIR/<table>/<chunk>_<col>.npy  : one column of one chunk
+#   Each chunk's .npy files are written first and index.json last, both
+#   atomically (see popstore._atomic_write()), so a crash mid run leaves the
+#   store as it was after the last complete chunk. Files not in the index
+#   are ignored.
+#
+#   Read back with memory maps, nothing is parsed or copied until used :
+#       store = ResultsStore(Dir="results")
+#       for colD in store.chunks(Table="pvalue-sweep_experiments"):
+#           colD["p"]                   # np.memmap
+#   or 'python src/results.py DIR [TABLE]' to print the tables.
+#
+# Future:
+#
+import os
+import sys
+import json
+import numpy as np
+from error import exit_with_error
+from popstore import _atomic_write
+
+RESULTS_VERSION = 1
+
+
+
+class ResultsStore:
+    """
+    Directory of columnar result tables, e.g.
+
+        store = ResultsStore(Dir="results", Append=True)
+        run   = store.start_run(MetaD={"argv" : sys.argv})
+        store.append(Table="pvalue-sweep", ColumnD={"nsamp" : nSampV, "mu_t" : muV})
+        store.read(Table="pvalue-sweep", Run=run)     # dict, column -> array
+
+    A table's columns (names and dtypes) are fixed by its first chunk. Every
+    chunk records the run that wrote it, so runs appended to the same store
+    can be told apart.
+    """
+    def __init__(self, Dir=None, Append=False):
+        """
+        ARGS:
+            Dir    : directory of the store, created if missing
+            Append : bool, let start_run() add a run to a store that already
+                     has some. Otherwise that is an error, so a rerun doesn't
+                     silently mix its results with old ones
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        self.dir         = Dir
+        self.allowAppend = Append
+        self.run         = None         # Run being written, see start_run()
+        self.nAppendD    = {}           # Table -> appends without a Key so far
+        self.keyD        = {}           # Table -> set of the run's chunk Keys
+        self.indexD      = {"version" : RESULTS_VERSION, "runs" : [], "tables" : {}}
+        indexPath = os.path.join(self.dir, "index.json")
+        if(os.path.exists(indexPath)):
+            with open(indexPath, "r") as f:
+                self.indexD = json.load(f)
+            if(self.indexD.get("version") != RESULTS_VERSION):
+                exit_with_error("ERROR!!! {} has version {}, expected {}\n".format(indexPath,
+                                self.indexD.get("version"), RESULTS_VERSION))
+
+
+    def start_run(self, MetaD=None):
+        """
+        ARGS:
+            MetaD : dict of run information (command line, seed ...), json
+                    serializable
+        RETURN:
+            run number, chunks appended from now on belong to it
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(len(self.indexD["runs"]) > 0 and not self.allowAppend):
+            exit_with_error("ERROR!!! {} already holds results, append to them with "
+                            "--results-append or use another directory\n".format(self.dir))
+        os.makedirs(self.dir, exist_ok=True)
+        self.run = len(self.indexD["runs"])
+        self.indexD["runs"].append({"run" : self.run,
+                                    "meta" : MetaD if MetaD is not None else {}})
+        self._write_index()
+        return(self.run)
+
+
+    def resume_run(self):
+        """
+        ARGS:
+        RETURN:
+            run number of the last run, chunks appended from now on belong to it
+        DESCRIPTION:
+            For main.py --resume. Appends of chunks the run already has (same
+            Key) are skipped, see append()
+        DEBUG:
+        FUTURE:
+        """
+        if(len(self.indexD["runs"]) == 0):
+            return(self.start_run())
+        self.run = len(self.indexD["runs"]) - 1
+        for (table, tableD) in self.indexD["tables"].items():
+            self.keyD[table] = set(chunkD.get("key") for chunkD in tableD["chunks"]
+                                   if chunkD["run"] == self.run)
+        return(self.run)
+
+
+    def append(self, Table=None, ColumnD=None, Key=None):
+        """
+        ARGS:
+            Table   : table name, also its directory name
+            ColumnD : dict, column name -> 1D array, all the same length.
+                      Numeric, bool or fixed width string dtypes
+            Key     : int identifying the chunk within the run's table, e.g.
+                      the task that computed it. None numbers the table's
+                      appends in order
+        RETURN:
+        DESCRIPTION:
+            Writes the chunk's columns, then the index. If the run already has
+            a chunk with this Key in Table (a resumed run redoing work) it is
+            left as is, the same run computes the same chunk.
+        DEBUG:
+        FUTURE:
+        """
+        if(self.run is None):
+            exit_with_error("ERROR!!! call start_run() before append()\n")
+        if(Key is None):
+            Key = self.nAppendD.get(Table, 0)
+            self.nAppendD[Table] = Key + 1
+        keySet = self.keyD.setdefault(Table, set())
+        if(Key in keySet):
+            return
+        colD = {name : np.ascontiguousarray(colV) for (name, colV) in ColumnD.items()}
+        tableD = self.indexD["tables"].get(Table)
+        nRowL = [len(colV) if colV.ndim == 1 else -1 for colV in colD.values()]
+        if(len(set(nRowL)) != 1 or nRowL[0] < 0):
+            exit_with_error("ERROR!!! {} : columns have to be 1D and the same length, "
+                            "got {}\n".format(Table, nRowL))
+        if(any(colV.dtype.hasobject for colV in colD.values())):
+            exit_with_error("ERROR!!! {} : object columns can't be memory mapped\n".format(
+                            Table))
+        if(tableD is None):
+            tableD = {"columns" : {name : colV.dtype.str for (name, colV) in colD.items()},
+                      "chunks"  : []}
+            self.indexD["tables"][Table] = tableD
+            os.makedirs(os.path.join(self.dir, Table), exist_ok=True)
+        elif(not _same_columns(ColumnD=tableD["columns"], ArrayD=colD)):
+            exit_with_error("ERROR!!! {} : columns {} don't match the table's {}\n".format(
+                            Table, {name : colV.dtype.str for (name, colV) in colD.items()},
+                            tableD["columns"]))
+        chunk = len(tableD["chunks"])
+        for (name, colV) in colD.items():
+            _atomic_write(Path=self._path(Table=Table, Chunk=chunk, Column=name),
+                          WriteFunction=lambda f, colV=colV : np.save(f, colV))
+        tableD["chunks"].append({"run" : self.run, "key" : Key, "rows" : nRowL[0]})
+        keySet.add(Key)
+        self._write_index()
+
+
+    def _path(self, Table=None, Chunk=None, Column=None):
+        return(os.path.join(self.dir, Table, "{:06d}_{}.npy".format(Chunk, Column)))
+
+
+    def _write_index(self):
+        text = json.dumps(self.indexD, indent=1).encode()
+        _atomic_write(Path=os.path.join(self.dir, "index.json"),
+                      WriteFunction=lambda f : f.write(text))
+
+
+    def tables(self):
+        """
+        ARGS:
+        RETURN:
+            list of table names, in the order they were created
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        return(list(self.indexD["tables"]))
+
+
+    def chunks(self, Table=None, Run=None, ColumnL=None):
+        """
+        ARGS:
+            Table   : table name
+            Run     : only this run's chunks, None = all runs
+            ColumnL : list of columns to map, None = all
+        RETURN:
+            generator of dicts, column -> read-only np.memmap of one chunk
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(Table not in self.indexD["tables"]):
+            exit_with_error("ERROR!!! no table {} in {}\n".format(Table, self.dir))
+        tableD = self.indexD["tables"][Table]
+        ColumnL = list(tableD["columns"]) if ColumnL is None else ColumnL
+        for (chunk, chunkD) in enumerate(tableD["chunks"]):
+            if(Run is not None and chunkD["run"] != Run):
+                continue
+            yield({name : np.load(self._path(Table=Table, Chunk=chunk, Column=name),
+                                  mmap_mode="r") for name in ColumnL})
+
+
+    def read(self, Table=None, Run=None, ColumnL=None):
+        """
+        ARGS:
+            see chunks()
+        RETURN:
+            dict, column -> 1D array of all the selected chunks
+        DESCRIPTION:
+            A single chunk is returned as its memory maps, several are
+            concatenated (copied into memory)
+        DEBUG:
+        FUTURE:
+        """
+        chunkL = list(self.chunks(Table=Table, Run=Run, ColumnL=ColumnL))
+        columnD = self.indexD["tables"][Table]["columns"]
+        ColumnL = list(columnD) if ColumnL is None else ColumnL
+        if(len(chunkL) == 1):
+            return(chunkL[0])
+        if(len(chunkL) == 0):
+            return({name : np.zeros(0, dtype=columnD[name]) for name in ColumnL})
+        return({name : np.concatenate([chunkD[name] for chunkD in chunkL])
+                for name in ColumnL})
+
+
+
+def _same_columns(ColumnD=None, ArrayD=None):
+    """
+    ARGS:
+        ColumnD : dict, column name -> dtype string, from the index
+        ArrayD  : dict, column name -> array of a new chunk
+    RETURN:
+        True if the names and dtypes match. Strings only need the same kind,
+        their width can differ between chunks
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    if(list(ColumnD) != list(ArrayD)):
+        return(False)
+    for (name, dtypeStr) in ColumnD.items():
+        (dtype, newDtype) = (np.dtype(dtypeStr), ArrayD[name].dtype)
+        if(dtype != newDtype and not (dtype.kind == newDtype.kind and dtype.kind in "SU")):
+            return(False)
+    return(True)
+
+
+
+def format_table(ColumnD=None, MaxRows=None):
+    """
+    ARGS:
+        ColumnD : dict, column name -> 1D array
+        MaxRows : int, max number of rows printed, None = all
+    RETURN:
+        the columns as fixed width text
+    DESCRIPTION:
+        Generic layout for 'python src/results.py', the sections print their
+        own layouts of the same columns
+    DEBUG:
+    FUTURE:
+    """
+    nameL = list(ColumnD)
+    nRow  = len(ColumnD[nameL[0]]) if len(nameL) > 0 else 0
+    nShow = nRow if MaxRows is None else min(nRow, MaxRows)
+    cellLL = [[_format_value(ColumnD[name][row]) for name in nameL] for row in range(nShow)]
+    widthL = [max([len(name)] + [len(cellL[col]) for cellL in cellLL]) + 2
+              for (col, name) in enumerate(nameL)]
+    lineL = ["".join("{:<{}}".format(name, width) for (name, width) in zip(nameL, widthL))]
+    for cellL in cellLL:
+        lineL.append("".join("{:<{}}".format(cell, width) for (cell, width)
+                             in zip(cellL, widthL)))
+    if(nShow < nRow):
+        lineL.append("... {} more rows".format(nRow - nShow))
+    return("\n".join(lineL))
+
+
+
+def _format_value(Value=None):
+    if(isinstance(Value, (float, np.floating))):
+        return("{:.6g}".format(Value))
+    return(str(Value))
+
+
+
+def main():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+        python src/results.py DIR [TABLE [MAX_ROWS]]
+        Lists DIR's runs and tables, or prints TABLE (default first 20 rows)
+    DEBUG:
+    FUTURE:
+    """
+    if(len(sys.argv) < 2):
+        exit_with_error("USAGE : python src/results.py DIR [TABLE [MAX_ROWS]]\n")
+    store = ResultsStore(Dir=sys.argv[1])
+    if(len(sys.argv) == 2):
+        for runD in store.indexD["runs"]:
+            print("run {} : {}".format(runD["run"], json.dumps(runD["meta"])))
+        for table in store.tables():
+            tableD = store.indexD["tables"][table]
+            print("{:<32} {:>10} rows {:>6} chunks   {}".format(table,
+                  sum(chunkD["rows"] for chunkD in tableD["chunks"]), len(tableD["chunks"]),
+                  " ".join(tableD["columns"])))
+        return
+    maxRows = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print(format_table(ColumnD=store.read(Table=sys.argv[2]), MaxRows=maxRows))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   Fan Monte Carlo tasks (sweep cells and chunks within a cell) out over a
+#   pool of worker processes.
+#
+#   1. The populations are copied once into shared memory, workers attach to
+#      them by name instead of having them pickled with every task.
+#   2. Every task gets its own numpy.random.SeedSequence, spawned from the
+#      run's seed in a fixed order (see spawn_seeds()). Results are returned
+#      in task order, so the output is bit-identical no matter how many
+#      workers are used.
+#
+# Future:
+#
+import os
+import atexit
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from error import exit_with_error
+import profiler
+
+_popD = {}                      # name -> population array, visible to tasks
+_shmL = []                      # SharedMemory blocks attached in this process
+
+
+
+def get_population(Name=None):
+    """
+    ARGS:
+        Name : name the population was registered under in Scheduler()
+    RETURN:
+        the population array. Inside a worker it is a view of shared memory
+    DESCRIPTION:
+        Task functions call this instead of receiving the population as an
+        argument
+    DEBUG:
+    FUTURE:
+    """
+    if(Name not in _popD):
+        exit_with_error("ERROR!!! population {} not registered\n".format(Name))
+    return(_popD[Name])
+
+
+
+def spawn_seeds(SeedSeq=None, NCells=None, NChunkL=None):
+    """
+    ARGS:
+        SeedSeq : numpy.random.SeedSequence of the sweep
+        NCells  : number of cells in the sweep
+        NChunkL : number of chunks in each cell
+    RETURN:
+        seedLL : seedLL[cell][chunk] is the SeedSequence for that task
+    DESCRIPTION:
+        The seeds only depend on SeedSeq and the shape of the sweep, never on
+        the number of workers. Careful, chunking a cell differently (i.e.
+        changing --chunk-size) changes which draws land in which task.
+    DEBUG:
+    FUTURE:
+    """
+    if(len(NChunkL) != NCells):
+        exit_with_error("ERROR!!! len(NChunkL) != NCells, {} != {}\n".format(
+                        len(NChunkL), NCells))
+    cellSeedL = SeedSeq.spawn(NCells)
+    seedLL = [cellSeedL[i].spawn(NChunkL[i]) for i in range(NCells)]
+    return(seedLL)
+
+
+
+def child_seed(SeedSeq=None, Key=None):
+    """
+    ARGS:
+        SeedSeq : numpy.random.SeedSequence
+        Key     : tuple of ints
+    RETURN:
+        the SeedSequence SeedSeq.spawn() would give at spawn_key + Key
+    DESCRIPTION:
+        For sweeps whose tasks aren't known up front (e.g. adaptive ones), the
+        seed of a task is addressed by a key, e.g. (cell, chunk), instead of
+        by the order of spawn() calls. Doesn't touch SeedSeq's spawn counter.
+    DEBUG:
+        1. child_seed(s, (i,)) == s.spawn(n)[i] for a fresh s
+    FUTURE:
+    """
+    return(np.random.SeedSequence(entropy=SeedSeq.entropy,
+                                  spawn_key=tuple(SeedSeq.spawn_key) + tuple(Key),
+                                  pool_size=SeedSeq.pool_size))
+
+
+
+def chunk_sizes(N=None, ChunkSize=None):
+    """
+    ARGS:
+        N         : total number of experiments in a cell
+        ChunkSize : max number of experiments per chunk
+    RETURN:
+        list of chunk sizes summing to N
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    return([min(ChunkSize, N - start) for start in range(0, N, ChunkSize)])
+
+
+
+def _attach_populations(SpecL, Profile=False):
+    """
+    ARGS:
+        SpecL   : list of (name, shared memory name, shape, dtype)
+        Profile : bool, enable the profiler in the worker
+    RETURN:
+    DESCRIPTION:
+        Pool initializer, runs once in every worker. It runs before the first
+        task is unpickled, so with the spawn start method the worker imports
+        the instrumented modules after profiler.enable()
+    DEBUG:
+    FUTURE:
+    """
+    if(Profile):
+        profiler.enable()
+    for (name, shmName, shape, dtype) in SpecL:
+        # The parent owns (and unlinks) the block, the workers share its
+        # resource tracker so attaching here doesn't register it twice
+        shm = shared_memory.SharedMemory(name=shmName)
+        _shmL.append(shm)
+        _popD[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+
+def _call_task(Task):
+    """
+    ARGS:
+        Task : (function, argument tuple)
+    RETURN:
+        function(*arguments)
+    DESCRIPTION:
+        Pool.imap() passes a single argument
+    DEBUG:
+    FUTURE:
+    """
+    return(Task[0](*Task[1]))
+
+
+
+class Scheduler:
+    """
+    Run task functions over a list of argument tuples, either in this process
+    (Workers = 1) or on a multiprocessing.Pool. Use as a context manager so
+    the shared memory is released, e.g.
+
+        with Scheduler(Workers=4, PopD={"pop1" : pop1V}) as sched:
+            resultL = sched.map(Function=some_task, ArgsL=argsL)
+    """
+    def __init__(self, Workers=1, PopD=None):
+        """
+        ARGS:
+            Workers : int, number of worker processes. <= 0 uses os.cpu_count()
+            PopD    : dict, name -> population array to share with the tasks
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(Workers is None or Workers <= 0):
+            Workers = os.cpu_count()
+        self.workers = Workers
+        self.pool    = None
+        self.shmL    = []
+        atexit.register(self.close)     # close() is safe to call twice
+        PopD = {} if PopD is None else PopD
+        if(self.workers == 1):
+            _popD.update(PopD)
+            return
+        specL = []
+        for (name, popV) in PopD.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(popV.nbytes,1))
+            sharedV = np.ndarray(popV.shape, dtype=popV.dtype, buffer=shm.buf)
+            sharedV[:] = popV[:]
+            self.shmL.append(shm)
+            specL.append((name, shm.name, popV.shape, popV.dtype.str))
+        self.pool = mp.Pool(processes=self.workers, initializer=_attach_populations,
+                            initargs=(specL, profiler.is_enabled()))
+
+
+    def map(self, Function=None, ArgsL=None, LabelL=None, Callback=None):
+        """
+        ARGS:
+            Function : top level (picklable) function
+            ArgsL    : list of argument tuples, Function(*args) is one task
+            LabelL   : list of the sweep cell of each task, for the profiler.
+                       None labels them all with Function's name
+            Callback : optional function(index, result), called in this
+                       process on each result as soon as it and all the
+                       results before it are done. What it returns is kept
+                       instead of the result, e.g. write out the bulky part
+                       of a result and only keep its summary
+        RETURN:
+            list of results (or Callback's returns), in the same order as ArgsL
+        DESCRIPTION:
+            When profiling, each task runs through profiler.run_task() and is
+            recorded under its label
+        DEBUG:
+        FUTURE:
+        """
+        if(profiler.is_enabled()):
+            return(self._map_profiled(Function=Function, ArgsL=ArgsL, LabelL=LabelL,
+                                      Callback=Callback))
+        if(Callback is None):
+            if(self.pool is None):
+                return([Function(*args) for args in ArgsL])
+            return(self.pool.starmap(Function, ArgsL, chunksize=1))
+        return([Callback(idx, result) for (idx, result) in
+                enumerate(self._imap(Function=Function, ArgsL=ArgsL))])
+
+
+    def _imap(self, Function=None, ArgsL=None):
+        """
+        ARGS:
+            see map()
+        RETURN:
+            iterator over the results, in the same order as ArgsL
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(self.pool is None):
+            return(Function(*args) for args in ArgsL)
+        return(self.pool.imap(_call_task, [(Function, args) for args in ArgsL], chunksize=1))
+
+
+    def _map_profiled(self, Function=None, ArgsL=None, LabelL=None, Callback=None):
+        """
+        ARGS:
+            see map()
+        RETURN:
+            see map()
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        if(LabelL is None):
+            LabelL = [Function.__name__] * len(ArgsL)
+        outIter = self._imap(Function=profiler.run_task,
+                             ArgsL=[(Function, args) for args in ArgsL])
+        resultL = []
+        for (idx, (label, (result, infoD))) in enumerate(zip(LabelL, outIter)):
+            profiler.record_task(Label=label, InfoD=infoD,
+                                 MergeCounters=self.pool is not None)
+            resultL.append(result if Callback is None else Callback(idx, result))
+        return(resultL)
+
+
+    def close(self):
+        """
+        ARGS:
+        RETURN:
+        DESCRIPTION:
+            Stop the workers and release the shared memory. Also drops the
+            atexit hook of __init__(), so closed Schedulers aren't kept
+            alive until exit
+        DEBUG:
+        FUTURE:
+        """
+        atexit.unregister(self.close)
+        if(self.pool is not None):
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for shm in self.shmL:
+            shm.close()
+            shm.unlink()
+        self.shmL = []
+        _popD.clear()
+
+
+    def __enter__(self):
+        return(self)
+
+
+    def __exit__(self, ExcType, ExcValue, Traceback):
+        self.close()
+        return(False)
@@ -0,0 +1,339 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   The Monte Carlo sweeps behind main.py's sections, split into tasks that
+#   scheduler.Scheduler can fan out over worker processes. A task is one
+#   chunk of one sweep cell and draws from its own SeedSequence.
+#
+# Future:
+#
+import numpy as np
+from population import make_rng
+from accumulator import OnlineStats
+from scheduler import get_population
+from scheduler import spawn_seeds
+from scheduler import chunk_sizes
+from bootstrap import sampling_distribution_chunk
+from bootstrap import merge_sampling_chunks
+from bootstrap import pooled_bootstrap_chunk
+from bootstrap import BOOT_MAX_DRAWS
+from functions import student_t_test_batch
+from functions import welchs_t_test_batch
+from permutation import permutation_test_batch
+
+
+
+def stderr_task(PopName=None, NSamp=None, NChunk=None, Seed=None, Hist=None):
+    """
+    ARGS:
+        PopName : name of the population, see scheduler.get_population()
+        NSamp   : int, number of samples per experiment
+        NChunk  : int, number of experiments in this task
+        Seed    : numpy.random.SeedSequence of this task
+        Hist    : optional empty accumulator.StreamingHistogram, the bins to
+                  histogram the experiment means into
+    RETURN:
+        see bootstrap.sampling_distribution_chunk(), followed by the task's 
+        StreamingHistogram (None without Hist)
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    hist = None if Hist is None else Hist.copy_empty()
+    chunk = sampling_distribution_chunk(PopV=get_population(PopName), NSamp=NSamp,
+                                        NChunk=NChunk, Rng=make_rng(Seed), Hist=hist)
+    return(chunk + (hist,))
+
+
+
+def stderr_sweep(Sched=None, PopName=None, NSamp=None, NExpL=None, SeedSeq=None,
+                 ChunkSize=None, Hist=None, Checkpoint=None):
+    """
+    ARGS:
+        Sched     : scheduler.Scheduler
+        PopName   : name of the population to draw from
+        NSamp     : int, number of samples per experiment
+        NExpL     : list of number of experiments, one sweep cell each
+        SeedSeq   : numpy.random.SeedSequence of the sweep
+        ChunkSize : max number of experiments per task
+        Hist      : optional empty accumulator.StreamingHistogram, see 
+                    stderr_task()
+        Checkpoint : optional checkpoint.Checkpoint, see sched_results_by_cell()
+    RETURN:
+        list with a (meanSampDist, stdSampDist, std0, meanStd) tuple per cell,
+        see bootstrap.sampling_distribution(). With Hist the tuple is followed
+        by the cell's histogram of experiment means
+    DESCRIPTION:
+        Section 1 of main.py. All chunks of all cells are submitted at once
+    DEBUG:
+    FUTURE:
+    """
+    nChunkLL = [chunk_sizes(N=nExp, ChunkSize=ChunkSize) for nExp in NExpL]
+    seedLL   = spawn_seeds(SeedSeq=SeedSeq, NCells=len(NExpL),
+                           NChunkL=[len(nChunkL) for nChunkL in nChunkLL])
+    argsL = []
+    for cell in range(len(NExpL)):
+        for chunk in range(len(nChunkLL[cell])):
+            argsL.append((PopName, NSamp, nChunkLL[cell][chunk], seedLL[cell][chunk], Hist))
+    resultL = sched_results_by_cell(Sched=Sched, Function=stderr_task, ArgsL=argsL,
+                                    NChunkLL=nChunkLL,
+                                    CellLabelL=["nExp={}".format(nExp) for nExp in NExpL],
+                                    Checkpoint=Checkpoint)
+    cellL = []
+    for chunkL in resultL:
+        cell = merge_sampling_chunks(ChunkL=chunkL, NSamp=NSamp)
+        if(Hist is not None):
+            hist = Hist.copy_empty()
+            for chunk in chunkL:
+                hist.merge(chunk[-1])
+            cell = cell + (hist,)
+        cellL.append(cell)
+    return(cellL)
+
+
+
+### Section 3 summaries, name -> thresholds counted ###
+TTEST_STATS_D = {"t"      : {"frac>2"   : ("abs_gt", 2.0)},
+                 "p"      : {"frac<.05" : ("lt", 0.05)},
+                 "tWelch" : {"frac>2"   : ("abs_gt", 2.0)},
+                 "pWelch" : {"frac<.05" : ("lt", 0.05)},
+                 "pPerm"  : {"frac<.05" : ("lt", 0.05)}}    # Only with NPerm > 0
+### Columns of Section 3's per experiment results table, p_perm only with NPerm > 0 ###
+TTEST_EXPERIMENT_L = ["nsamp", "t", "df", "p", "t_welch", "df_welch", "p_welch", "p_perm"]
+
+
+
+def ttest_task(Pop1Name=None, Pop2Name=None, NSamp=None, NChunk=None, Seed=None,
+               PvalueMethod=None, HistD=None, Experiments=False, NPerm=0):
+    """
+    ARGS:
+        Pop1Name : name of population 1
+        Pop2Name : name of population 2
+        NSamp    : int, number of samples per group per experiment
+        NChunk   : int, number of experiments in this task
+        Seed     : numpy.random.SeedSequence of this task
+        PvalueMethod : see functions.convert_tscore_to_pvalue()
+        HistD    : optional dict, name in TTEST_STATS_D -> empty 
+                   accumulator.StreamingHistogram, the bins to histogram 
+                   that value into
+        Experiments : bool, also return the per experiment values
+        NPerm    : int, > 0 also runs a permutation test of the difference in
+                   means with at most NPerm relabelings, see 
+                   permutation.permutation_test_batch(). Its draws come after
+                   the samples', so the t-tests are unchanged
+    RETURN:
+        dict, name in TTEST_STATS_D -> accumulator.OnlineStats over the 
+        experiments in this task. With HistD also 'name_hist' -> the
+        StreamingHistogram of name. With Experiments also 'experiments' ->
+        dict, column in TTEST_EXPERIMENT_L -> 1D array (NChunk,)
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    rng   = make_rng(Seed)
+    pop1V = get_population(Pop1Name)
+    pop2V = get_population(Pop2Name)
+    samp1M = pop1V[rng.integers(low=0, high=len(pop1V), size=(NChunk,NSamp))]
+    samp2M = pop2V[rng.integers(low=0, high=len(pop2V), size=(NChunk,NSamp))]
+    (tV,vV,pV) = student_t_test_batch(Samp1M=samp1M, Samp2M=samp2M,
+                                      Method=PvalueMethod)
+    (tWelchV,vWelchV,pWelchV) = welchs_t_test_batch(Samp1M=samp1M, Samp2M=samp2M,
+                                                            Method=PvalueMethod)
+    valueD = {"t" : tV, "p" : pV, "tWelch" : tWelchV, "pWelch" : pWelchV}
+    if(NPerm > 0):
+        valueD["pPerm"] = permutation_test_batch(Samp1M=samp1M, Samp2M=samp2M, NPerm=NPerm,
+                                                 Rng=rng)[1]
+    statsD = {name : OnlineStats(ThresholdD=TTEST_STATS_D[name]).update(valueD[name])
+              for name in valueD}
+    if(HistD is not None):
+        for (name, hist) in HistD.items():
+            statsD[name + "_hist"] = hist.copy_empty().update(valueD[name])
+    if(Experiments):
+        statsD["experiments"] = dict(zip(TTEST_EXPERIMENT_L[1:], [tV, vV, pV, tWelchV,
+                                         vWelchV, pWelchV] + [valueD.get("pPerm")]))
+        if(NPerm == 0):
+            del statsD["experiments"]["p_perm"]
+    return(statsD)
+
+
+
+def ttest_sweep(Sched=None, Pop1Name=None, Pop2Name=None, NSampL=None, NExp=None,
+                SeedSeq=None, ChunkSize=None, PvalueMethod=None, HistD=None, Results=None,
+                Table="pvalue-sweep_experiments", Checkpoint=None, NPerm=0):
+    """
+    ARGS:
+        Sched     : scheduler.Scheduler
+        Pop1Name  : name of population 1
+        Pop2Name  : name of population 2
+        NSampL    : list of samples per group, one sweep cell each
+        NExp      : int, number of experiments per cell
+        SeedSeq   : numpy.random.SeedSequence of the sweep
+        ChunkSize : max number of experiments per task
+        PvalueMethod : see functions.convert_tscore_to_pvalue(). Passed to
+                       every task, so spawned workers use it too
+        HistD     : optional, see ttest_task()
+        Results   : optional results.ResultsStore. Every experiment's t, DF
+                    and p values (TTEST_EXPERIMENT_L) are appended to its
+                    Table, a chunk per task as the tasks complete
+        Table     : table name in Results
+        Checkpoint : optional checkpoint.Checkpoint, see sched_results_by_cell()
+        NPerm     : int, see ttest_task()
+    RETURN:
+        list with a dict per cell, name in TTEST_STATS_D -> OnlineStats 
+        merged over all the cell's experiments (and the 'name_hist' 
+        StreamingHistograms with HistD)
+    DESCRIPTION:
+        Section 3 of main.py.
+    DEBUG:
+    FUTURE:
+    """
+    nChunkLL = [chunk_sizes(N=NExp, ChunkSize=ChunkSize) for nSamp in NSampL]
+    seedLL   = spawn_seeds(SeedSeq=SeedSeq, NCells=len(NSampL),
+                           NChunkL=[len(nChunkL) for nChunkL in nChunkLL])
+    argsL = []
+    for cell in range(len(NSampL)):
+        for chunk in range(len(nChunkLL[cell])):
+            argsL.append((Pop1Name, Pop2Name, NSampL[cell], nChunkLL[cell][chunk],
+                          seedLL[cell][chunk], PvalueMethod, HistD, Results is not None,
+                          NPerm))
+    callback = None
+    if(Results is not None):
+        def callback(Idx, StatsD):
+            # Written out here, only the summaries are kept
+            expD = StatsD.pop("experiments")
+            nSamp = argsL[Idx][2]
+            Results.append(Table=Table, ColumnD=dict({"nsamp" : np.full(len(expD["t"]),
+                           nSamp)}, **expD), Key=Idx)
+            return(StatsD)
+    resultL = sched_results_by_cell(Sched=Sched, Function=ttest_task, ArgsL=argsL,
+                                    NChunkLL=nChunkLL,
+                                    CellLabelL=["nSamp={}".format(nSamp) for nSamp in NSampL],
+                                    Callback=callback, Checkpoint=Checkpoint)
+    cellL = []
+    for chunkL in resultL:
+        cellL.append(merge_stats(StatsL=chunkL))
+    return(cellL)
+
+
+
+def pooled_bootstrap_task(Samp1V=None, Samp2V=None, N1V=None, N2V=None, NRep=None,
+                          Seed=None, Resample=None):
+    """
+    ARGS:
+        see bootstrap.pooled_bootstrap_chunk()
+        Seed : numpy.random.SeedSequence of this task
+    RETURN:
+        see bootstrap.pooled_bootstrap_chunk()
+    DESCRIPTION:
+        The studies' samples are small, they are passed with the task instead
+        of being registered with the Scheduler
+    DEBUG:
+    FUTURE:
+    """
+    return(pooled_bootstrap_chunk(Samp1V=Samp1V, Samp2V=Samp2V, N1V=N1V, N2V=N2V,
+                                  NRep=NRep, Rng=make_rng(Seed), Resample=Resample))
+
+
+
+def pooled_bootstrap_sweep(Sched=None, Samp1V=None, Samp2V=None, N1V=None, N2V=None,
+                           NRep=None, SeedSeq=None, ChunkSize=None, Resample="both"):
+    """
+    ARGS:
+        Sched     : scheduler.Scheduler
+        Samp1V, Samp2V, N1V, N2V, Resample : see bootstrap.pooled_bootstrap_chunk()
+        NRep      : int, number of bootstrap replicates
+        SeedSeq   : numpy.random.SeedSequence of the bootstrap
+        ChunkSize : max number of replicates per task. It is lowered so a task
+                    draws at most ~bootstrap.BOOT_MAX_DRAWS observations
+    RETURN:
+        dict, "fixed" / "random" -> 1D array (NRep,) of the replicates' 
+        pooled effect sizes, in task order
+    DESCRIPTION:
+        Section 4's bootstrap CIs. Memory is bounded by the chunk size, only 
+        the NRep pooled effects are kept.
+    DEBUG:
+        1. 10^5 replicates of the default studies, 1 worker : ~2.5 s
+    FUTURE:
+    """
+    nObs = int(np.sum(N1V) + np.sum(N2V))
+    ChunkSize = max(1, min(ChunkSize, BOOT_MAX_DRAWS // nObs))
+    nChunkL = chunk_sizes(N=NRep, ChunkSize=ChunkSize)
+    seedL   = spawn_seeds(SeedSeq=SeedSeq, NCells=1, NChunkL=[len(nChunkL)])[0]
+    argsL = [(Samp1V, Samp2V, N1V, N2V, nChunk, seed, Resample) for (nChunk, seed)
+             in zip(nChunkL, seedL)]
+    resultL = Sched.map(Function=pooled_bootstrap_task, ArgsL=argsL,
+                        LabelL=["bootstrap resample={}".format(Resample)] * len(argsL))
+    return({name : np.concatenate([result[name] for result in resultL])
+            for name in ["fixed", "random"]})
+
+
+
+def merge_stats(StatsL=None):
+    """
+    ARGS:
+        StatsL : list of dicts, name -> OnlineStats (or any accumulator with 
+                 copy_empty() and merge(), e.g. StreamingHistogram), e.g. one 
+                 per chunk
+    RETURN:
+        dict, name -> accumulator merged in list order
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    mergedD = {}
+    for statsD in StatsL:
+        for (name, acc) in statsD.items():
+            if(name not in mergedD):
+                mergedD[name] = acc.copy_empty()
+            mergedD[name].merge(acc)
+    return(mergedD)
+
+
+
+def sched_results_by_cell(Sched=None, Function=None, ArgsL=None, NChunkLL=None,
+                          CellLabelL=None, Callback=None, Checkpoint=None):
+    """
+    ARGS:
+        Sched      : scheduler.Scheduler
+        Function   : task function
+        ArgsL      : flat list of task arguments, cell by cell, chunk by chunk
+        NChunkLL   : chunk sizes of each cell
+        CellLabelL : label of each cell, for the profiler
+        Callback   : see scheduler.Scheduler.map(), indexed into ArgsL
+        Checkpoint : optional checkpoint.Checkpoint. Tasks it holds aren't
+                     run again, the others are recorded in it as they
+                     complete (after Callback), under Function's name
+    RETURN:
+        list (per cell) of lists (per chunk) of task results
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    labelL = [None] * len(ArgsL)
+    if(CellLabelL is not None):
+        labelL = [label for (label, nChunkL) in zip(CellLabelL, NChunkLL)
+                  for chunk in nChunkL]
+    key   = Function.__name__
+    doneD = {} if Checkpoint is None else Checkpoint.done(Key=key)
+    todoL = [idx for idx in range(len(ArgsL)) if idx not in doneD]
+    def record(Idx, Result):
+        idx = todoL[Idx]
+        if(Callback is not None):
+            Result = Callback(idx, Result)
+        Checkpoint.record(Key=key, Idx=idx, Result=Result)
+        return(Result)
+    flatL = [doneD.get(idx) for idx in range(len(ArgsL))]
+    resultL = Sched.map(Function=Function, ArgsL=[ArgsL[idx] for idx in todoL],
+                        LabelL=None if CellLabelL is None else [labelL[idx] for idx in todoL],
+                        Callback=Callback if Checkpoint is None else record)
+    for (idx, result) in zip(todoL, resultL):
+        flatL[idx] = result
+    if(Checkpoint is not None):
+        Checkpoint.save()
+    resultL = []
+    start = 0
+    for nChunkL in NChunkLL:
+        resultL.append(flatL[start:start + len(nChunkL)])
+        start += len(nChunkL)
+    return(resultL)
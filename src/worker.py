@@ -0,0 +1,545 @@
+#!/usr/bin/env python
+###############################################################################
+#   Author : Ali Snedden
+#   Date   : 3/9/19
+#
+#   Purpose:
+#       Long running worker answering small statistics queries, so a
+#       pipeline doesn't pay an interpreter start, the numpy import and the
+#       t-distribution tables for every one. Requests are JSON lines, read
+#       from stdin (answers on stdout) or from clients of a unix socket
+#       (--socket PATH, answers on the same connection) :
+#
+#       {"id" : 1, "op" : "ttest", "samp1" : [...], "samp2" : [...]}
+#           -> t, df, p (Student's, null if the sizes differ) and t_welch,
+#              df_welch, p_welch
+#       {"id" : 2, "op" : "pvalue", "t" : 2.1, "df" : 10}
+#           -> p, two sided. t, df can be numbers or (broadcastable) lists
+#       {"id" : 3, "op" : "meta", "es" : [...], "var" : [...]}
+#       {"id" : 4, "op" : "meta", "studies" : {"n1" : [...], "t" : [...], ...}}
+#           -> fixed and random (null for a single study) effects models.
+#              "studies" are converted by effectsize.convert_studies(), Hedges'
+#              g is pooled unless "es_type" is "d"
+#       {"id" : 5, "op" : "stats"}     -> counters and the tail table cache
+#       {"id" : 6, "op" : "shutdown"}  -> stops the worker
+#
+#       Answers are {"id" : ..., <results>} or {"id" : ..., "error" : msg},
+#       one line per request, in the order each client sent them. Non
+#       finite numbers are written as null.
+#
+#       Requests are micro-batched : the worker takes whatever arrived within
+#       --max-wait ms of the first one (at most --max-batch) and runs each op
+#       once for the whole batch, e.g. all t-tests with the same sample sizes
+#       are one student_t_test_batch() call and all t -> p conversions one
+#       convert_tscore_to_pvalue() call. p-values are exact ("beta") by
+#       default : Welch's DFs are rarely on the 0.01 grid the "grid" method
+#       caches its tail tables on, so it builds a table for most requests.
+#       With --pvalue-method grid the tables stay cached between batches
+#       (--warm-df builds some at start up).
+#
+#   Notes :
+#       1. python src/worker.py < requests.jsonl > answers.jsonl
+#          python src/worker.py --socket /tmp/pvalue.sock &
+#       2. src/loadgen.py measures throughput and latency
+#
+###############################################################################
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import numpy as np
+from error import exit_with_error
+from functions import PVALUE_METHOD_L
+from functions import convert_tscore_to_pvalue
+from functions import student_t_test_batch
+from functions import welchs_t_test_batch
+from functions import tail_table
+from functions import tail_table_cache_info
+from meta import fixed_effect
+from meta import random_effects
+from effectsize import convert_studies
+
+WORKER_MAX_BATCH = 1024         # Max requests per batch
+WORKER_MAX_WAIT  = 2.0          # ms waited for more requests after the first of a batch
+META_KEY_L       = ["es", "se", "lower", "upper", "q", "tau2", "i2", "k"]
+
+
+
+def parse_args(ArgL):
+    """
+    ARGS:
+        ArgL : command line, without the program name
+    RETURN:
+        argparse.Namespace
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    parser = argparse.ArgumentParser(
+        description="Answer t-test, t -> p and meta-analysis queries sent as JSON lines")
+    parser.add_argument("--socket", type=str, default=None, metavar="PATH",
+                        help="listen on this unix socket instead of stdin / stdout")
+    parser.add_argument("--max-batch", type=int, default=WORKER_MAX_BATCH,
+                        help="max requests per batch (default: %(default)s)")
+    parser.add_argument("--max-wait", type=float, default=WORKER_MAX_WAIT, metavar="MS",
+                        help="ms to wait for more requests once one arrived "
+                             "(default: %(default)s)")
+    parser.add_argument("--pvalue-method", type=str, choices=PVALUE_METHOD_L,
+                        default="beta",
+                        help="t -> p method, see functions.convert_tscore_to_pvalue() "
+                             "(default: %(default)s)")
+    parser.add_argument("--warm-df", type=int, nargs="+", default=[], metavar="DF",
+                        help="build the 'grid' tail tables of these DFs at start up")
+    return(parser.parse_args(ArgL))
+
+
+
+def _json_value(X=None):
+    """
+    ARGS:
+        X : number or array
+    RETURN:
+        X as a python float / int / (nested) list, non finite numbers as None
+    DESCRIPTION:
+        One tolist() per array, the answers of a batch convert each result
+        column once
+    DEBUG:
+    FUTURE:
+    """
+    X = np.asarray(X)
+    if(X.dtype.kind == "f" and not np.all(np.isfinite(X))):
+        X = np.where(np.isfinite(X), X, None)
+    return(X.tolist())
+
+
+
+def _float_array(ReqD=None, Key=None):
+    """
+    ARGS:
+        ReqD : request
+        Key  : field of the request
+    RETURN:
+        the field as a float array, ValueError if it isn't numbers
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    if(Key not in ReqD):
+        raise ValueError("missing '{}'".format(Key))
+    return(np.asarray(ReqD[Key], dtype=np.float64))
+
+
+
+def batch_ttest(ReqL=None, Method=None):
+    """
+    ARGS:
+        ReqL   : list of "ttest" requests
+        Method : p-value method
+    RETURN:
+        list of answers, one per request
+    DESCRIPTION:
+        Requests are grouped by (len(samp1), len(samp2)), each group is one
+        call of welchs_t_test_batch() and, for equal sizes, of
+        student_t_test_batch(). Rows with a nan t-score or a non finite DF
+        (e.g. samples without variance) get a null p
+    DEBUG:
+    FUTURE:
+    """
+    outL   = [None] * len(ReqL)
+    groupD = {}
+    for (i, reqD) in enumerate(ReqL):
+        try:
+            samp1V = _float_array(ReqD=reqD, Key="samp1")
+            samp2V = _float_array(ReqD=reqD, Key="samp2")
+            if(samp1V.ndim != 1 or samp2V.ndim != 1 or len(samp1V) < 2 or len(samp2V) < 2):
+                raise ValueError("samp1 and samp2 need 2 or more numbers each")
+        except (ValueError, TypeError) as err:
+            outL[i] = {"error" : str(err)}
+            continue
+        groupD.setdefault((len(samp1V), len(samp2V)), []).append((i, samp1V, samp2V))
+    for ((n1, n2), groupL) in groupD.items():
+        samp1M = np.stack([samp1V for (i, samp1V, samp2V) in groupL])
+        samp2M = np.stack([samp2V for (i, samp1V, samp2V) in groupL])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            (tWV, vWV, pWV) = welchs_t_test_batch(Samp1M=samp1M, Samp2M=samp2M, Method=Method)
+            if(n1 == n2):
+                (tV, vV, pV) = student_t_test_batch(Samp1M=samp1M, Samp2M=samp2M,
+                                                    Method=Method)
+            else:
+                (tV, vV, pV) = [np.full(len(groupL), np.nan)] * 3
+        pWV = np.where(np.isfinite(vWV) & ~np.isnan(tWV), pWV, np.nan)
+        pV  = np.where(np.isfinite(vV) & ~np.isnan(tV), pV, np.nan)
+        colD = {"t" : tV, "df" : vV, "p" : pV, "t_welch" : tWV, "df_welch" : vWV,
+                "p_welch" : pWV}
+        colD = {key : _json_value(colV) for (key, colV) in colD.items()}
+        for (j, (i, samp1V, samp2V)) in enumerate(groupL):
+            outL[i] = {key : colL[j] for (key, colL) in colD.items()}
+    return(outL)
+
+
+
+def batch_pvalue(ReqL=None, Method=None):
+    """
+    ARGS:
+        ReqL   : list of "pvalue" requests
+        Method : p-value method
+    RETURN:
+        list of answers, one per request
+    DESCRIPTION:
+        Every request's (t, df) pairs are concatenated into one
+        convert_tscore_to_pvalue() call. The values are checked on the
+        concatenation too, a request with a bad pair gets an error.
+    DEBUG:
+    FUTURE:
+    """
+    outL  = [None] * len(ReqL)
+    partL = []                  # (request index, shape, t, df)
+    for (i, reqD) in enumerate(ReqL):
+        try:
+            (tV, dfV) = np.broadcast_arrays(_float_array(ReqD=reqD, Key="t"),
+                                            _float_array(ReqD=reqD, Key="df"))
+        except (ValueError, TypeError) as err:
+            outL[i] = {"error" : str(err)}
+            continue
+        if(tV.size == 0):
+            outL[i] = {"p" : _json_value(tV)}
+            continue
+        partL.append((i, tV.shape, tV.ravel(), dfV.ravel()))
+    if(len(partL) == 0):
+        return(outL)
+    tV  = np.concatenate([t for (i, shape, t, df) in partL])
+    dfV = np.concatenate([df for (i, shape, t, df) in partL])
+    startV = np.cumsum([0] + [len(t) for (i, shape, t, df) in partL])
+    badV   = ~(dfV > 0) | np.isnan(tV)
+    badReqV = np.logical_or.reduceat(badV, startV[:-1])
+    # Placeholders for the bad pairs, their requests get an error
+    pV = np.asarray(convert_tscore_to_pvalue(T=np.where(badV, 0.0, tV),
+                                             DF=np.where(badV, 1.0, dfV), Method=Method))
+    for (j, (i, shape, t, df)) in enumerate(partL):
+        if(badReqV[j]):
+            outL[i] = {"error" : "df has to be > 0 and t a number"}
+        else:
+            outL[i] = {"p" : _json_value(pV[startV[j]:startV[j+1]].reshape(shape))}
+    return(outL)
+
+
+
+def batch_meta(ReqL=None):
+    """
+    ARGS:
+        ReqL : list of "meta" requests
+    RETURN:
+        list of answers, one per request
+    DESCRIPTION:
+        Requests are grouped by their number of studies k, each group is one
+        fixed_effect() and one random_effects() call on (requests, k) arrays.
+        The values are checked on those arrays too.
+    DEBUG:
+    FUTURE:
+    """
+    outL   = [None] * len(ReqL)
+    groupD = {}
+    for (i, reqD) in enumerate(ReqL):
+        try:
+            if("studies" in reqD):
+                if(not isinstance(reqD["studies"], dict)):
+                    raise ValueError("'studies' has to be an object of columns")
+                colD = {name : np.atleast_1d(np.asarray(colV, dtype=np.float64))
+                        for (name, colV) in reqD["studies"].items()}
+                esType = reqD.get("es_type", "g")
+                if(esType not in ["d", "g"]):
+                    raise ValueError("es_type has to be 'd' or 'g'")
+                convD = convert_studies(ColumnD=colD)
+                (esV, varV) = (convD[esType], convD["var_" + esType])
+            else:
+                esV  = _float_array(ReqD=reqD, Key="es")
+                varV = _float_array(ReqD=reqD, Key="var")
+            if(esV.ndim != 1 or esV.shape != varV.shape or len(esV) == 0):
+                raise ValueError("es and var have to be lists of the same length")
+        except (ValueError, TypeError) as err:
+            outL[i] = {"error" : str(err)}
+            continue
+        groupD.setdefault(len(esV), []).append((i, esV, varV))
+    for (k, groupL) in groupD.items():
+        esM  = np.stack([esV for (i, esV, varV) in groupL])
+        varM = np.stack([varV for (i, esV, varV) in groupL])
+        badM = ~(np.isfinite(esM) & np.isfinite(varM) & (varM > 0))
+        badV = np.any(badM, axis=1)
+        # Placeholders for the bad studies, their requests get an error
+        esM  = np.where(badM, 0.0, esM)
+        varM = np.where(badM, 1.0, varM)
+        fixD = fixed_effect(EsV=esM, VarV=varM)
+        ranD = random_effects(EsV=esM, VarV=varM) if k > 1 else None
+        fixD = {key : _json_value(np.broadcast_to(fixD[key], len(groupL)))
+                for key in META_KEY_L if key in fixD}
+        if(ranD is not None):
+            ranD = {key : _json_value(np.broadcast_to(ranD[key], len(groupL)))
+                    for key in META_KEY_L}
+        for (j, (i, esV, varV)) in enumerate(groupL):
+            if(badV[j]):
+                outL[i] = {"error" : "every study needs a finite effect size and variance > 0"}
+                continue
+            outL[i] = {"fixed" : {key : colL[j] for (key, colL) in fixD.items()},
+                       "random" : None if ranD is None else {key : colL[j] for (key, colL)
+                                                             in ranD.items()}}
+    return(outL)
+
+
+
+class Worker:
+    """
+    Reads requests from one or more sources into a queue and answers them in
+    micro-batches, on the main thread :
+
+        worker = Worker(MaxBatch=1024, MaxWait=2.0, Method="beta")
+        worker.serve_stdin()            # or worker.serve_socket(Path=...)
+
+    Only the main thread computes and writes answers, the reader threads
+    just parse lines.
+    """
+    def __init__(self, MaxBatch=WORKER_MAX_BATCH, MaxWait=WORKER_MAX_WAIT, Method=None):
+        """
+        ARGS:
+            MaxBatch : max requests per batch
+            MaxWait  : ms to wait for more requests after the first of a batch
+            Method   : p-value method, see convert_tscore_to_pvalue()
+        RETURN:
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        self.maxBatch = MaxBatch
+        self.maxWait  = MaxWait / 1000.0
+        self.method   = Method
+        self.queue    = queue.Queue()     # (reply function, line), None at end of input
+        self.running  = True
+        self.start    = time.perf_counter()
+        self.statsD   = {"requests" : 0, "batches" : 0, "errors" : 0, "max_batch" : 0}
+        self.opD      = {"ttest"  : lambda ReqL : batch_ttest(ReqL=ReqL, Method=self.method),
+                         "pvalue" : lambda ReqL : batch_pvalue(ReqL=ReqL, Method=self.method),
+                         "meta"   : lambda ReqL : batch_meta(ReqL=ReqL)}
+
+
+    def next_batch(self):
+        """
+        ARGS:
+        RETURN:
+            list of (reply function, line), empty at the end of the input
+        DESCRIPTION:
+            Blocks for the first request, then takes what arrives in the next
+            MaxWait seconds, up to MaxBatch
+        DEBUG:
+        FUTURE:
+        """
+        item = self.queue.get()
+        if(item is None):
+            return([])
+        batchL = [item]
+        deadline = time.perf_counter() + self.maxWait
+        while(len(batchL) < self.maxBatch):
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if(item is None):
+                # Answer what was read, then stop
+                self.queue.put(None)
+                break
+            batchL.append(item)
+        return(batchL)
+
+
+    def answer(self, BatchL=None):
+        """
+        ARGS:
+            BatchL : list of (reply function, line)
+        RETURN:
+        DESCRIPTION:
+            Parses the lines, runs each op once on all its requests and sends
+            the answers back in the order the lines arrived, see run_op()
+        DEBUG:
+        FUTURE:
+        """
+        outL = [None] * len(BatchL)
+        opD  = {}                   # op -> [(batch index, request)]
+        for (i, (reply, line)) in enumerate(BatchL):
+            try:
+                reqD = json.loads(line)
+                if(not isinstance(reqD, dict)):
+                    raise ValueError("a request has to be a JSON object")
+            except ValueError as err:
+                outL[i] = {"id" : None, "error" : "bad JSON : {}".format(err)}
+                continue
+            op = reqD.get("op")
+            if(op in self.opD):
+                opD.setdefault(op, []).append((i, reqD))
+            elif(op == "stats"):
+                outL[i] = dict({"id" : reqD.get("id")}, **self.stats())
+            elif(op == "shutdown"):
+                self.running = False
+                outL[i] = {"id" : reqD.get("id"), "shutdown" : True}
+            else:
+                outL[i] = {"id" : reqD.get("id"), "error" : "unknown op {}, expected one of "
+                           "{}".format(op, list(self.opD) + ["stats", "shutdown"])}
+        for (op, itemL) in opD.items():
+            ansL = self.run_op(Op=op, ReqL=[reqD for (i, reqD) in itemL])
+            for ((i, reqD), ansD) in zip(itemL, ansL):
+                outL[i] = dict({"id" : reqD.get("id")}, **ansD)
+        for (i, (reply, line)) in enumerate(BatchL):
+            if("error" in outL[i]):
+                self.statsD["errors"] += 1
+            reply(json.dumps(outL[i]) + "\n")
+        self.statsD["requests"] += len(BatchL)
+        self.statsD["batches"]  += 1
+        self.statsD["max_batch"] = max(self.statsD["max_batch"], len(BatchL))
+
+
+    def run_op(self, Op=None, ReqL=None):
+        """
+        ARGS:
+            Op   : key of self.opD
+            ReqL : list of requests of that op
+        RETURN:
+            list of answers, one per request
+        DESCRIPTION:
+            Runs the op once on all the requests. The batch_*() functions
+            check each request and give the bad ones an error of their own,
+            but if the batched call still fails each request is run on its
+            own, so a bad request (or client) only fails itself. Catches
+            SystemExit too, exit_with_error() mustn't stop the worker.
+        DEBUG:
+        FUTURE:
+        """
+        try:
+            return(self.opD[Op](ReqL))
+        except Exception as err:
+            msg = "{} failed : {}".format(Op, err)
+        except SystemExit:
+            msg = "{} failed, see the worker's stderr".format(Op)
+        if(len(ReqL) == 1):
+            return([{"error" : msg}])
+        return([self.run_op(Op=Op, ReqL=[reqD])[0] for reqD in ReqL])
+
+
+    def stats(self):
+        """
+        ARGS:
+        RETURN:
+            dict of the counters, uptime and tail table cache info
+        DESCRIPTION:
+        DEBUG:
+        FUTURE:
+        """
+        return(dict(self.statsD, uptime=time.perf_counter() - self.start,
+                    tail_table_cache=tail_table_cache_info()))
+
+
+    def run(self, Flush=None):
+        """
+        ARGS:
+            Flush : function called after each batch's answers, or None
+        RETURN:
+        DESCRIPTION:
+            Answers batches until the input ends or a shutdown request
+        DEBUG:
+        FUTURE:
+        """
+        while(self.running):
+            batchL = self.next_batch()
+            if(len(batchL) == 0):
+                break
+            self.answer(BatchL=batchL)
+            if(Flush is not None):
+                Flush()
+
+
+    def serve_stdin(self):
+        """
+        ARGS:
+        RETURN:
+        DESCRIPTION:
+            Requests from stdin, answers to stdout
+        DEBUG:
+        FUTURE:
+        """
+        def read():
+            for line in sys.stdin:
+                if(line.strip() != ""):
+                    self.queue.put((sys.stdout.write, line))
+            self.queue.put(None)
+        threading.Thread(target=read, daemon=True).start()
+        self.run(Flush=sys.stdout.flush)
+
+
+    def serve_socket(self, Path=None):
+        """
+        ARGS:
+            Path : unix socket to listen on, removed on exit
+        RETURN:
+        DESCRIPTION:
+            One reader thread per client connection. Answers to a client that
+            has gone away are dropped
+        DEBUG:
+        FUTURE:
+        """
+        if(os.path.exists(Path)):
+            exit_with_error("ERROR!!! {} already exists, is another worker running?\n".format(
+                            Path))
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(Path)
+        server.listen()
+        def read(Conn):
+            def reply(Text):
+                try:
+                    Conn.sendall(Text.encode())
+                except OSError:
+                    pass
+            with Conn, Conn.makefile("r") as f:
+                for line in f:
+                    if(line.strip() != ""):
+                        self.queue.put((reply, line))
+        def accept():
+            while(True):
+                try:
+                    (conn, addr) = server.accept()
+                except OSError:
+                    return
+                threading.Thread(target=read, args=(conn,), daemon=True).start()
+        threading.Thread(target=accept, daemon=True).start()
+        try:
+            self.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(Path)
+
+
+
+def main():
+    """
+    ARGS:
+    RETURN:
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    args = parse_args(sys.argv[1:])
+    if(args.max_batch < 1 or args.max_wait < 0):
+        exit_with_error("ERROR!!! --max-batch has to be >= 1 and --max-wait >= 0\n")
+    for df in args.warm_df:
+        tail_table(DF=df)
+    worker = Worker(MaxBatch=args.max_batch, MaxWait=args.max_wait, Method=args.pvalue_method)
+    if(args.socket is None):
+        worker.serve_stdin()
+    else:
+        worker.serve_socket(Path=args.socket)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   The modules in src/ import each other by name (e.g. "from error import
+#   exit_with_error"), so src/ is put on the path of the tests.
+#
+#       python -m pytest -q tests
+#
+# Future:
+#
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,84 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/accumulator.py : OnlineStats and StreamingHistogram, updated in
+#   chunks and merged, against numpy on all the values at once
+#
+# Future:
+#
+import numpy as np
+from accumulator import OnlineStats
+from accumulator import StreamingHistogram
+
+
+
+def test_online_stats_merge():
+    rng = np.random.default_rng(5)
+    xV  = rng.normal(1e3, 2, 10001)
+    thresholdD = {"frac>1002" : ("gt", 1002.0), "abs<999" : ("abs_lt", 999.0)}
+    accL = [OnlineStats(ThresholdD=thresholdD).update(chunkV)
+            for chunkV in np.array_split(xV, 7)]
+    accL[3].update(xV[:0])
+    acc = OnlineStats(ThresholdD=thresholdD)
+    for other in accL[::-1]:
+        acc.merge(other)
+    assert acc.count == len(xV)
+    assert np.isclose(acc.mean, np.mean(xV), rtol=1e-14)
+    assert np.isclose(acc.var(), np.var(xV), rtol=1e-10)
+    assert np.isclose(acc.std(Ddof=1), np.std(xV, ddof=1), rtol=1e-10)
+    assert (acc.min, acc.max) == (np.min(xV), np.max(xV))
+    assert acc.frac("frac>1002") == np.mean(xV > 1002)
+    assert acc.frac("abs<999") == np.mean(np.abs(xV) < 999)
+
+
+
+def check_counts(Hist=None, XV=None):
+    # Bins are [k width, (k+1) width), np.histogram's last bin is closed
+    edgeV = Hist.edges()
+    assert np.all(XV >= edgeV[0]) and np.all(XV < edgeV[-1])
+    assert np.array_equal(Hist.counts, np.histogram(XV, bins=edgeV)[0])
+    assert len(Hist.counts) <= Hist.maxBins and Hist.count == len(XV)
+
+
+
+def test_histogram_chunks_and_merge_order():
+    rng = np.random.default_rng(6)
+    chunkL = [rng.normal(0, 1, 1000), rng.normal(50, 1, 10), rng.standard_t(1, 5000),
+              rng.normal(-3, 0.01, 100)]
+    xV = np.concatenate(chunkL)
+    hist = StreamingHistogram(NBins=100, MaxBins=512)
+    for chunkV in chunkL:
+        hist.update(chunkV)
+    check_counts(Hist=hist, XV=xV)
+    # Workers that saw different data calibrate different widths
+    histL = [StreamingHistogram(NBins=100, MaxBins=512).update(chunkV) for chunkV in chunkL]
+    assert len(set(h.width for h in histL)) > 1
+    for orderL in [[0, 1, 2, 3], [3, 2, 1, 0], [1, 3, 0, 2]]:
+        merged = StreamingHistogram(NBins=100, MaxBins=512)
+        for i in orderL:
+            merged.merge(histL[i])
+        check_counts(Hist=merged, XV=xV)
+
+
+
+def test_histogram_huge_range_stays_bounded():
+    # A t-score of 1e15 after a first batch in [0,1] used to allocate ~500 TiB
+    hist = StreamingHistogram(NBins=100, MaxBins=4096)
+    hist.update(np.linspace(0, 1, 1000))
+    hist.update([1e15, -1e15, np.inf, np.nan])
+    assert len(hist.counts) <= 4096 and hist.nan == 2
+    check_counts(Hist=hist, XV=np.concatenate([np.linspace(0, 1, 1000), [1e15, -1e15]]))
+    other = StreamingHistogram(NBins=100, MaxBins=4096).update(np.linspace(0, 1e-6, 10))
+    other.merge(hist)
+    assert len(other.counts) <= 4096 and other.count == 1012
+
+
+
+def test_fixed_histogram():
+    rng  = np.random.default_rng(7)
+    xV   = rng.uniform(-0.5, 1.5, 3000)
+    hist = StreamingHistogram(Edges=np.linspace(0, 1, 51))
+    hist.update(xV[:1000]).merge(StreamingHistogram(Edges=np.linspace(0, 1, 51)).update(xV[1000:]))
+    assert np.array_equal(hist.counts, np.histogram(xV, bins=np.linspace(0, 1, 51))[0])
+    assert (hist.underflow, hist.overflow) == (np.sum(xV < 0), np.sum(xV > 1))
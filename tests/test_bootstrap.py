@@ -0,0 +1,39 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/bootstrap.py : bootstrap confidence intervals
+#
+# Future:
+#
+import numpy as np
+from bootstrap import bootstrap_ci
+
+
+
+def test_bca_one_sided_replicates_fall_back_to_percentile(capsys):
+    bootV = np.array([1.0, 2.0, 3.0, 4.0])
+    for estimate in [0.5, 10.0]:
+        ci = bootstrap_ci(BootV=bootV, Estimate=estimate, Method="bca",
+                          JackknifeV=[1.0, 2.0, 4.0])
+        assert ci == bootstrap_ci(BootV=bootV, Estimate=estimate, Method="percentile")
+    assert "falls back to the percentile" in capsys.readouterr().err
+
+
+
+def test_no_finite_replicates_is_nan(capsys):
+    for method in ["percentile", "bca"]:
+        ci = bootstrap_ci(BootV=[np.nan, np.inf], Estimate=0.0, Method=method,
+                          JackknifeV=[1.0, 2.0])
+        assert np.all(np.isnan(ci))
+    assert "no finite bootstrap replicates" in capsys.readouterr().err
+
+
+
+def test_bca_without_bias_or_skew_is_percentile():
+    # z0 = 0 (half the replicates below the estimate) and a = 0 (symmetric jackknife)
+    bootV = np.random.default_rng(13).normal(0, 1, 4000)
+    bootV = np.concatenate([bootV, -bootV])
+    bca = bootstrap_ci(BootV=bootV, Estimate=0.0, Method="bca", JackknifeV=[-2.0, -1.0, 1.0, 2.0])
+    assert np.allclose(bca, bootstrap_ci(BootV=bootV, Estimate=0.0, Method="percentile"),
+                       rtol=1e-12, atol=0)
@@ -0,0 +1,40 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/functions.py : the binned gaussian() and t_dist() against the
+#   original loops over their bins
+#
+# Future:
+#
+from math import erf
+from math import sqrt
+import numpy as np
+import pytest
+from functions import gaussian
+from functions import integrate
+from functions import t_dist
+from functions import t_dist_pdf_at_x
+
+
+
+@pytest.mark.parametrize(("S", "Mu", "Tol"), [(1.0, 0.0, 1e-15), (1.3, 0.2, 1e-15),
+                                              (1e3, -7.0, 1e-15), (0.01, 5.0, 1e-13)])
+def test_gaussian_matches_loop(S, Mu, Tol):
+    # Tol grows with |Mu| / S, the loop's Mu - x loses digits
+    (xV, pdfV) = gaussian(S=S, Mu=Mu)
+    dx = S/100.0
+    loopXV = np.arange(-10*S+Mu, 10*S+Mu, dx)
+    loopV  = [(-erf((Mu - x) / (sqrt(2.0) * S)) + erf((Mu - (x-dx)) / (sqrt(2.0) * S))) / 2.0
+              for x in loopXV]
+    assert np.array_equal(xV, loopXV)
+    assert np.max(np.abs(pdfV - loopV)) < Tol
+    assert abs(np.sum(pdfV) - 1) < 1e-12
+
+
+
+@pytest.mark.parametrize("DF", [1, 4.5, 30, 1000])
+def test_t_dist_matches_loop(DF):
+    (xV, pdfV) = t_dist(DF=DF)
+    loopV = [integrate(Function=t_dist_pdf_at_x, DF=DF, Xmin=x, Xmax=x+0.01) for x in xV]
+    assert np.max(np.abs(pdfV - loopV)) < 1e-17
@@ -0,0 +1,35 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/main.py : end to end runs of the subcommands
+#
+# Future:
+#
+import os
+import subprocess
+import sys
+import numpy as np
+from functions import convert_tscore_to_pvalue
+from results import ResultsStore
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main.py")
+
+
+
+def test_multitest_ignores_grid_zero_pvalues(tmp_path):
+    # mu1 == mu2, nSamp = 3 : some |t| > 10, where the grid's p-value is 0
+    subprocess.run([sys.executable, MAIN, "pvalue-sweep", "0", "1", "0", "1", "--npop",
+                    "10000", "--sweep-nexp", "20000", "--sweep-nsamp", "3", "--multitest",
+                    "--pvalue-method", "grid", "--results", str(tmp_path)],
+                   check=True, capture_output=True)
+    store = ResultsStore(Dir=str(tmp_path))
+    expD  = store.read(Table="pvalue-sweep_experiments")
+    multiD = store.read(Table="pvalue-sweep_multitest")
+    assert np.count_nonzero(np.asarray(expD["p"]) == 0) > 0
+    assert list(multiD["test"]) == ["student", "welch"]
+    for method in ["bonferroni", "holm", "bh", "by"]:
+        assert np.all(np.asarray(multiD[method]) == 0)
+    pV = convert_tscore_to_pvalue(T=np.asarray(expD["t"]), DF=np.asarray(expD["df"]),
+                                  Method="beta")
+    assert multiD["raw"][0] == np.count_nonzero(pV < 0.05)
@@ -0,0 +1,111 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/meta.py : fixed and random effects models, and the cumulative and
+#   leave one out analyses against refitting each subset
+#
+# Future:
+#
+import functools
+import warnings
+import numpy as np
+import pytest
+import meta
+from meta import fixed_effect
+from meta import random_effects
+from meta import cumulative_meta
+from meta import leave_one_out_meta
+from meta import IncrementalMeta
+
+
+
+def test_single_study():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        fixD = fixed_effect(EsV=[0.3], VarV=[0.1])
+        ranD = random_effects(EsV=[0.3], VarV=[0.1])
+        looD = leave_one_out_meta(EsV=[0.3], VarV=[0.1], Random=True)
+    assert fixD["q"] == 0 and not np.signbit(fixD["q"])
+    assert ranD["tau2"] == 0 and ranD["i2"] == 0
+    for key in ["es", "se", "lower", "upper"]:
+        assert ranD[key] == fixD[key]
+    assert np.isnan(looD["random_es"][0]) and np.isnan(looD["random_se"][0])
+
+
+
+def studies(K=None, Seed=None):
+    rng = np.random.default_rng(Seed)
+    return(rng.normal(0.4, 0.6, K), rng.uniform(0.02, 0.2, K))
+
+
+
+def test_dersimonian_laird_by_hand():
+    (esV, varV) = studies(K=12, Seed=1)
+    wV   = 1 / varV
+    mu   = sum(wV * esV) / sum(wV)
+    q    = sum(wV * (esV - mu)**2)
+    tau2 = max(0.0, (q - 11) / (sum(wV) - sum(wV**2) / sum(wV)))
+    wRV  = 1 / (varV + tau2)
+    fixD = fixed_effect(EsV=esV, VarV=varV)
+    ranD = random_effects(EsV=esV, VarV=varV)
+    assert tau2 > 0
+    assert np.isclose(fixD["es"], mu, rtol=1e-13) and np.isclose(fixD["q"], q, rtol=1e-12)
+    assert np.isclose(ranD["tau2"], tau2, rtol=1e-12)
+    assert np.isclose(ranD["i2"], (q - 11) / q, rtol=1e-12)
+    assert np.isclose(ranD["es"], sum(wRV * esV) / sum(wRV), rtol=1e-13)
+    assert np.isclose(ranD["se"], np.sqrt(1 / sum(wRV)), rtol=1e-13)
+
+
+
+@pytest.mark.parametrize("ChunkCells", [2**22, 7])
+def test_cumulative_and_leave_one_out_match_refits(monkeypatch, ChunkCells):
+    monkeypatch.setattr(meta, "_random_effects_masked", functools.partial(
+                        meta._random_effects_masked, ChunkCells=ChunkCells))
+    (esV, varV) = studies(K=9, Seed=2)
+    cumD = cumulative_meta(EsV=esV, VarV=varV, Random=True)
+    looD = leave_one_out_meta(EsV=esV, VarV=varV, Random=True)
+    for i in range(len(esV)):
+        for (outD, subV) in [(cumD, np.arange(i+1)), (looD, np.delete(np.arange(9), i))]:
+            fixD = fixed_effect(EsV=esV[subV], VarV=varV[subV])
+            ranD = random_effects(EsV=esV[subV], VarV=varV[subV])
+            for key in ["es", "se", "q"]:
+                assert np.isclose(outD[key][i], fixD[key], rtol=1e-9, atol=1e-12)
+            for key in ["tau2", "i2"]:
+                assert np.isclose(outD[key][i], ranD[key], rtol=1e-9, atol=1e-12)
+            assert np.isclose(outD["random_es"][i], ranD["es"], rtol=1e-9)
+            assert np.isclose(outD["random_se"][i], ranD["se"], rtol=1e-9)
+
+
+
+def test_masks_are_built_a_chunk_at_a_time():
+    # The random effects of k variants used to build (k, k) masks at once
+    (esV, varV) = studies(K=3000, Seed=3)
+    rowL = []
+    def mask(Start, Stop):
+        rowL.append(Stop - Start)
+        return(np.arange(len(esV))[np.newaxis,:] != np.arange(Start, Stop)[:,np.newaxis])
+    looD = leave_one_out_meta(EsV=esV, VarV=varV)
+    (es, se, lower, upper) = meta._random_effects_masked(EsV=esV, VarV=varV,
+                              Tau2V=looD["tau2"], MaskFunction=mask, ChunkCells=30000)
+    assert max(rowL) * len(esV) <= 30000 and sum(rowL) == len(esV)
+    for i in [0, 1234, 2999]:
+        ranD = random_effects(EsV=np.delete(esV, i), VarV=np.delete(varV, i))
+        assert np.isclose(es[i], ranD["es"], rtol=1e-12)
+        assert np.isclose(se[i], ranD["se"], rtol=1e-12)
+
+
+
+def test_incremental_matches_refit():
+    (esV, varV) = studies(K=8, Seed=4)
+    inc = IncrementalMeta()
+    idL = [inc.add(Es=es, Var=var) for (es, var) in zip(esV, varV)]
+    inc.remove(Id=idL[2])
+    inc.remove(Id=idL[5])
+    keepV = np.delete(np.arange(8), [2, 5])
+    fixD = fixed_effect(EsV=esV[keepV], VarV=varV[keepV])
+    ranD = random_effects(EsV=esV[keepV], VarV=varV[keepV])
+    for key in ["es", "se", "q"]:
+        assert np.isclose(inc.fixed()[key], fixD[key], rtol=1e-9)
+    for key in ["es", "se", "tau2"]:
+        assert np.isclose(inc.random()[key], ranD[key], rtol=1e-9)
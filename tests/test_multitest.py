@@ -0,0 +1,66 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/multitest.py : the adjusted p-values against their definitions, and
+#   the chunked external sort against the in memory version
+#
+# Future:
+#
+import numpy as np
+import pytest
+from multitest import adjust_pvalues
+from multitest import adjust_pvalues_chunked
+from multitest import reject
+from multitest import MULTITEST_METHOD_L
+
+
+
+def adjust_by_definition(PV=None, Method=None):
+    # Straight from the formulas at the top of multitest.py, O(n**2)
+    n = len(PV)
+    sortedL = sorted(PV)
+    factor  = sum(1.0 / k for k in range(1, n + 1)) if Method == "by" else 1.0
+    outL = []
+    for p in PV:
+        # Rank of p among the sorted, the last of its ties
+        i = max(j for j in range(1, n + 1) if sortedL[j-1] == p)
+        if(Method == "bonferroni"):
+            outL.append(min(1.0, n * p))
+        elif(Method == "holm"):
+            outL.append(max(min(1.0, (n - j + 1) * sortedL[j-1]) for j in range(1, i + 1)))
+        else:
+            outL.append(min(min(1.0, factor * n * sortedL[j-1] / j) for j in range(i, n + 1)))
+    return(np.array(outL))
+
+
+
+@pytest.mark.parametrize("Method", MULTITEST_METHOD_L)
+def test_adjust_matches_definition(Method):
+    rng = np.random.default_rng(8)
+    for n in [1, 2, 5, 37]:
+        pV = rng.uniform(0, 0.2, n)**2
+        pV[n // 2:][:2] = pV[0]                 # Ties
+        assert np.allclose(adjust_pvalues(PV=pV, Method=Method),
+                           adjust_by_definition(PV=pV, Method=Method), rtol=1e-13, atol=0)
+    pM = rng.uniform(0, 1, (4, 5))
+    assert np.array_equal(reject(PV=pM, Alpha=0.1, Method=Method),
+                          adjust_pvalues(PV=pM, Method=Method) <= 0.1)
+
+
+
+@pytest.mark.parametrize("Method", MULTITEST_METHOD_L)
+def test_chunked_matches_in_memory(Method, tmp_path):
+    rng = np.random.default_rng(9)
+    pV  = np.concatenate([rng.uniform(0, 1, 5000), rng.uniform(0, 1e-4, 300),
+                          np.full(50, 0.01)])
+    rng.shuffle(pV)
+    chunkL = np.array_split(pV, 13)
+    outD = adjust_pvalues_chunked(ChunkIter=lambda : iter(chunkL), Method=Method,
+                                  Alpha=0.05, OutPath=str(tmp_path / "adjusted.npy"),
+                                  TmpDir=str(tmp_path), ChunkSize=701)
+    adjV = adjust_pvalues(PV=pV, Method=Method)
+    assert outD["n"] == len(pV)
+    assert outD["rejected"] == np.count_nonzero(adjV <= 0.05) > 0
+    assert np.array_equal(outD["adjusted"], adjV)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["adjusted.npy"]
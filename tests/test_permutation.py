@@ -0,0 +1,58 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/permutation.py : exact permutation p-values against a loop over the
+#   relabelings, and Monte Carlo against exact
+#
+# Future:
+#
+import itertools
+import numpy as np
+from permutation import permutation_test_batch
+
+
+
+def exact_by_loop(Samp1V=None, Samp2V=None):
+    pooledV = np.concatenate((Samp1V, Samp2V))
+    (n, n1) = (len(pooledV), len(Samp1V))
+    obs = abs(np.mean(Samp1V) - np.mean(Samp2V))
+    (count, total) = (0, 0)
+    for idxT in itertools.combinations(range(n), n1):
+        maskV = np.zeros(n, dtype=bool)
+        maskV[list(idxT)] = True
+        d = abs(np.mean(pooledV[maskV]) - np.mean(pooledV[~maskV]))
+        count += d >= obs - 1e-12 * np.max(np.abs(pooledV))
+        total += 1
+    return(count / total)
+
+
+
+def test_exact_matches_loop():
+    rng = np.random.default_rng(10)
+    for (n1, n2) in [(3, 3), (4, 6)]:
+        samp1M = rng.normal(0, 1, (25, n1))
+        samp2M = rng.normal(0.8, 1, (25, n2))
+        (dV, pV, method) = permutation_test_batch(Samp1M=samp1M, Samp2M=samp2M)
+        assert method == "exact"
+        assert np.allclose(dV, np.mean(samp1M, axis=1) - np.mean(samp2M, axis=1),
+                           rtol=1e-12, atol=1e-14)
+        assert np.array_equal(pV, [exact_by_loop(Samp1V=s1, Samp2V=s2)
+                                   for (s1, s2) in zip(samp1M, samp2M)])
+        if(n1 == n2 == 3):
+            # The observed labeling and its mirror image always count
+            assert np.all(np.isclose(pV * 20, np.round(pV * 20))) and np.min(pV) >= 2 / 20
+
+
+
+def test_monte_carlo_near_exact():
+    rng = np.random.default_rng(11)
+    samp1M = rng.normal(0, 1, (20, 6))
+    samp2M = rng.normal(1, 1, (20, 6))
+    (dV, exactV, method) = permutation_test_batch(Samp1M=samp1M, Samp2M=samp2M,
+                                                  Method="exact")
+    (dV, mcV, method) = permutation_test_batch(Samp1M=samp1M, Samp2M=samp2M, NPerm=20000,
+                                               Rng=np.random.default_rng(12),
+                                               Method="monte-carlo")
+    assert method == "monte-carlo"
+    assert np.all(mcV > 0) and np.max(np.abs(mcV - exactV)) < 0.015
@@ -0,0 +1,130 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/functions.py : t -> p conversions, "beta" against closed forms and the
+#   normal limit, "grid" against the original bin sums, both methods on non
+#   finite input and the grid's array DF path
+#
+# Future:
+#
+from math import erfc
+from math import exp
+from math import pi
+from math import sqrt
+import numpy as np
+import pytest
+import functions
+from functions import convert_tscore_to_pvalue
+from functions import pvalue_incomplete_beta
+from functions import t_dist
+from functions import tscore_from_pvalue
+
+
+
+def test_beta_closed_forms():
+    tV = np.concatenate([np.linspace(0, 10, 101), [25.0, 100.0, 1000.0]])
+    assert np.allclose(pvalue_incomplete_beta(T=tV, DF=1), 1 - 2 / pi * np.arctan(tV),
+                       rtol=0, atol=2e-15)
+    assert np.allclose(pvalue_incomplete_beta(T=tV, DF=2), 1 - tV / np.sqrt(2 + tV**2),
+                       rtol=0, atol=2e-15)
+    assert np.allclose(pvalue_incomplete_beta(T=tV, DF=4),
+                       1 - tV * (tV**2 + 6) / (tV**2 + 4)**1.5, rtol=0, atol=3e-15)
+
+
+
+@pytest.mark.parametrize("DF", [1e9, 1e12, 1e15])
+def test_beta_large_df(DF):
+    # Normal limit and its first order term, the next one is O(t**7 / DF**2)
+    tV   = np.array([0.1, 0.5, 1.0, 1.8, 2.0, 3.0, 5.0, 8.0])
+    refV = np.array([erfc(t / sqrt(2)) + exp(-t*t / 2) / sqrt(2 * pi) * (t**3 + t) / (2 * DF)
+                     for t in tV])
+    assert np.max(np.abs(pvalue_incomplete_beta(T=tV, DF=DF) - refV) / refV) < 1e-12
+
+
+
+def test_beta_continuous_at_hill_df():
+    # The continued fraction below PVALUE_HILL_DF, Hill's transformation from it on
+    tV = np.array([0.01, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0])
+    below = pvalue_incomplete_beta(T=tV, DF=np.nextafter(functions.PVALUE_HILL_DF, 0))
+    above = pvalue_incomplete_beta(T=tV, DF=functions.PVALUE_HILL_DF)
+    assert np.max(np.abs(below - above) / above) < 1e-12
+
+
+
+@pytest.mark.parametrize("Method", ["grid", "beta"])
+def test_non_finite_is_nan(Method):
+    # e.g. samples without variance, t = 0/0 and Welch's DF = 0/0
+    tV  = np.array([np.nan, np.inf, -np.inf, 2.0, 2.0, 2.0])
+    dfV = np.array([4.0, 4.0, 1e6, np.nan, np.inf, 4.0])
+    pV  = convert_tscore_to_pvalue(T=tV, DF=dfV, Method=Method)
+    assert np.all(np.isnan(pV[:5])) and np.isfinite(pV[5])
+    assert np.all(np.isnan(convert_tscore_to_pvalue(T=tV[:3], DF=4, Method=Method)))
+    assert np.isnan(convert_tscore_to_pvalue(T=np.nan, DF=4, Method=Method))
+    assert np.isnan(convert_tscore_to_pvalue(T=2.0, DF=np.nan, Method=Method))
+
+
+
+def test_beta_unconverged_is_nan(monkeypatch, capsys):
+    monkeypatch.setattr(functions, "BETACF_MAXIT", 2)
+    pV = pvalue_incomplete_beta(T=np.array([3.0]), DF=np.array([500.0]))
+    assert np.isnan(pV[0])
+    assert "didn't converge" in capsys.readouterr().err
+
+
+
+def test_tscore_from_pvalue_inverts_beta():
+    pV  = np.array([1e-12, 1e-6, 0.01, 0.05, 0.5, 0.99])
+    dfV = np.array([1.0, 3.7, 10.0, 78.0, 1e4, 1e9])
+    (pM, dfM) = np.meshgrid(pV, dfV)
+    tM  = tscore_from_pvalue(P=pM, DF=dfM)
+    assert np.allclose(pvalue_incomplete_beta(T=tM, DF=dfM), pM, rtol=1e-12, atol=0)
+
+
+
+def test_grid_array_df_matches_scalar(monkeypatch):
+    # More unique DF keys than the cache holds, each is looked up in turn
+    monkeypatch.setattr(functions, "TAIL_TABLE_MAXSIZE", 4)
+    functions.tail_table_cache_clear()
+    rng = np.random.default_rng(42)
+    dfV = np.concatenate([rng.uniform(2, 3, 40), [5.0, 5.0, 7.0]])
+    tV  = rng.normal(0, 3, len(dfV))
+    pV  = convert_tscore_to_pvalue(T=tV, DF=dfV, Method="grid")
+    assert functions.tail_table_cache_info()["size"] <= 4
+    assert np.array_equal(pV, [convert_tscore_to_pvalue(T=t, DF=df, Method="grid")
+                               for (t, df) in zip(tV, dfV)])
+    functions.tail_table_cache_clear()
+
+
+
+def bin_sum_pvalue(T=None, DF=None):
+    # The original convert_tscore_to_pvalue(), re-bins t_dist(DF) on every call
+    (xV,pdfV) = t_dist(DF=DF)
+    return(np.sum(pdfV[xV<-abs(T)]) + np.sum(pdfV[xV>abs(T)]))
+
+
+
+@pytest.mark.parametrize("DF", [1, 2, 3, 10, 40, 100])
+def test_grid_integer_df_matches_bin_sums(DF):
+    tV = np.linspace(-12, 12, 241)
+    pV = convert_tscore_to_pvalue(T=tV, DF=DF, Method="grid")
+    assert np.max(np.abs(pV - [bin_sum_pvalue(T=t, DF=DF) for t in tV])) < 3e-15
+
+
+
+@pytest.mark.parametrize(("DF", "Bound"), [(1.00499, 7e-4), (2.00499, 2.5e-4),
+                                           (5.00499, 6e-5)])
+def test_grid_df_bucketing_bound(DF, Bound):
+    # Just under half a bucket off, the worst case
+    tV = np.linspace(-12, 12, 241)
+    pV = convert_tscore_to_pvalue(T=tV, DF=DF, Method="grid")
+    assert np.max(np.abs(pV - [bin_sum_pvalue(T=t, DF=DF) for t in tV])) < Bound
+
+
+
+def test_grid_is_zero_beyond_ten():
+    # The bins stop at |t| = 10, which is why the multiple testing of Section 3
+    # recomputes its p-values with "beta"
+    for DF in [2, 4, 7.5]:
+        assert convert_tscore_to_pvalue(T=10.5, DF=DF, Method="grid") == 0
+        assert convert_tscore_to_pvalue(T=10.5, DF=DF, Method="beta") > 0
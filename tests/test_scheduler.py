@@ -0,0 +1,24 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/scheduler.py : Scheduler life cycle
+#
+# Future:
+#
+import gc
+import weakref
+import numpy as np
+from scheduler import Scheduler
+
+
+
+def test_closed_scheduler_is_released():
+    # close() drops the atexit hook, which otherwise kept every Scheduler alive
+    refL = []
+    for i in range(3):
+        with Scheduler(Workers=1, PopD={"pop1" : np.arange(10.0)}) as sched:
+            refL.append(weakref.ref(sched))
+        del sched
+    gc.collect()
+    assert all(ref() is None for ref in refL)
@@ -0,0 +1,71 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/functions.py : the batched Student's and Welch's t-tests against the
+#   original one experiment at a time formulas
+#
+# Future:
+#
+import numpy as np
+import pytest
+from functions import convert_tscore_to_pvalue
+from functions import student_t_test
+from functions import student_t_test_batch
+from functions import welchs_t_test_batch
+
+
+
+def student_row(Samp1V=None, Samp2V=None):
+    n  = len(Samp1V)
+    sp = np.sqrt((np.std(Samp1V)**2 + np.std(Samp2V)**2) / 2.0)
+    return((np.mean(Samp1V) - np.mean(Samp2V)) / (sp * np.sqrt(2.0 / n)), 2*n - 2)
+
+
+
+def welch_row(Samp1V=None, Samp2V=None):
+    (n1, n2) = (len(Samp1V), len(Samp2V))
+    (v1, v2) = (np.std(Samp1V)**2 / n1, np.std(Samp2V)**2 / n2)
+    return((np.mean(Samp1V) - np.mean(Samp2V)) / np.sqrt(v1 + v2),
+           (v1 + v2)**2 / (v1**2 / (n1 - 1) + v2**2 / (n2 - 1)))
+
+
+
+@pytest.mark.parametrize("Method", ["grid", "beta"])
+def test_batch_matches_rows(Method):
+    rng = np.random.default_rng(3)
+    samp1M = rng.normal(0, 1, (200, 5))
+    samp2M = rng.normal(0.5, 2, (200, 5))
+    samp3M = rng.normal(0.5, 2, (200, 8))
+    for (batch, row, samp2M) in [(student_t_test_batch, student_row, samp2M),
+                                 (welchs_t_test_batch, welch_row, samp2M),
+                                 (welchs_t_test_batch, welch_row, samp3M)]:
+        (tV, vV, pV) = batch(Samp1M=samp1M, Samp2M=samp2M, Method=Method)
+        (refTV, refVV) = np.array([row(Samp1V=s1, Samp2V=s2)
+                                   for (s1, s2) in zip(samp1M, samp2M)]).T
+        assert np.allclose(tV, refTV, rtol=1e-13, atol=0)
+        assert np.allclose(vV, refVV, rtol=1e-13, atol=0)
+        assert np.allclose(pV, [convert_tscore_to_pvalue(T=t, DF=v, Method=Method)
+                                for (t, v) in zip(refTV, refVV)], rtol=1e-12, atol=1e-15)
+
+
+
+@pytest.mark.parametrize("Method", ["grid", "beta"])
+def test_no_variance_is_nan(Method):
+    # Welch's DF is 0/0, the rest of the batch is unaffected
+    samp1M = np.array([[1.0, 1.0, 1.0], [0.1, 0.7, 0.3]])
+    samp2M = np.array([[1.0, 1.0, 1.0], [1.2, 0.9, 1.6]])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        (tV, vV, pV) = welchs_t_test_batch(Samp1M=samp1M, Samp2M=samp2M, Method=Method)
+    assert np.isnan(vV[0]) and np.isnan(pV[0])
+    assert 0 < pV[1] < 1
+
+
+
+def test_single_experiment_wrapper():
+    rng = np.random.default_rng(4)
+    (s1V, s2V) = (rng.normal(0, 1, 6), rng.normal(1, 1, 6))
+    (t, v, p) = student_t_test(Samp1V=s1V, Samp2V=s2V, Method="beta")
+    (refT, refV) = student_row(Samp1V=s1V, Samp2V=s2V)
+    assert np.isclose(t, refT, rtol=1e-13, atol=0) and v == refV
+    assert p == convert_tscore_to_pvalue(T=t, DF=v, Method="beta")
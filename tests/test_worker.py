@@ -0,0 +1,78 @@
+# Author : Ali Snedden
+# Date   : 3/9/19
+# License: MIT
+# Purpose:
+#   src/worker.py : a bad request only fails itself, whatever else is in its
+#   batch
+#
+# Future:
+#
+import json
+import pytest
+import worker
+from worker import Worker
+
+GOOD_META_L = [{"id" : 4, "op" : "meta", "es" : [0.1, 0.3], "var" : [0.1, 0.2]},
+               {"id" : 5, "op" : "meta", "studies" : {"n1" : [10, 12], "n2" : [10, 11],
+                                                      "t" : [1.2, 2.0]}}]
+
+
+
+def answer_batch(Worker=None, ReqL=None):
+    """
+    ARGS:
+        Worker : worker.Worker
+        ReqL   : list of requests, answered as one batch
+    RETURN:
+        list of answers, in the order of ReqL
+    DESCRIPTION:
+    DEBUG:
+    FUTURE:
+    """
+    outL = []
+    Worker.answer(BatchL=[(outL.append, json.dumps(reqD)) for reqD in ReqL])
+    return([json.loads(line) for line in outL])
+
+
+
+def test_bad_studies_only_fail_themselves():
+    bad   = {"id" : 3, "op" : "meta", "studies" : {"n1" : [10], "n2" : [10, 3], "t" : [1.2]}}
+    alone = [answer_batch(Worker=Worker(), ReqL=[reqD])[0] for reqD in GOOD_META_L]
+    ansL  = answer_batch(Worker=Worker(), ReqL=[bad] + GOOD_META_L)
+    assert ansL[0]["id"] == 3 and "same length" in ansL[0]["error"]
+    assert ansL[1:] == alone
+
+
+
+@pytest.mark.parametrize("Raise", [IndexError("boom"), SystemExit(1)])
+def test_unchecked_error_only_fails_its_request(monkeypatch, Raise):
+    # An error the per request checks don't catch fails the batched call
+    convert = worker.convert_studies
+    def convert_studies(ColumnD=None):
+        if(len(ColumnD["n1"]) == 3):
+            raise Raise
+        return(convert(ColumnD=ColumnD))
+    monkeypatch.setattr(worker, "convert_studies", convert_studies)
+    bad   = {"id" : 3, "op" : "meta", "studies" : {"n1" : [10, 10, 10], "t" : [1, 2, 3]}}
+    alone = [answer_batch(Worker=Worker(), ReqL=[reqD])[0] for reqD in GOOD_META_L]
+    wrk   = Worker()
+    ansL  = answer_batch(Worker=wrk, ReqL=GOOD_META_L[:1] + [bad] + GOOD_META_L[1:])
+    assert ansL[1]["id"] == 3 and "meta failed" in ansL[1]["error"]
+    assert [ansL[0], ansL[2]] == alone
+    assert wrk.stats()["errors"] == 1
+
+
+
+def test_failed_batch_is_answered_per_request(monkeypatch):
+    # The batched call itself fails, each request is retried on its own
+    random = worker.random_effects
+    def random_effects(EsV=None, VarV=None):
+        if(EsV.shape[0] > 1):
+            raise IndexError("boom")
+        return(random(EsV=EsV, VarV=VarV))
+    monkeypatch.setattr(worker, "random_effects", random_effects)
+    reqL  = [{"id" : i, "op" : "meta", "es" : [0.1 * i, 0.3], "var" : [0.1, 0.2]}
+             for i in range(4)]
+    alone = [answer_batch(Worker=Worker(), ReqL=[reqD])[0] for reqD in reqL]
+    assert answer_batch(Worker=Worker(), ReqL=reqL) == alone
+    assert all("error" not in ansD for ansD in alone)